@@ -21,12 +21,49 @@ Full documentation is maintained in documentation.md"""
 
 __version__ = '0.1.0'
 __all__ = [
-    'generate_source', 'generate_file', 'Itermode', 'Iterable', 'IterGroup',
-    'RemovalIterGroup', 'run_all_tests', 'run_func_tests',
-    'run_interface_tests', 'run_iter_tests'
+    'generate_source', 'generate_file', 'generate_file_mapped',
+    'generate_file_parallel', 'generate_sharded_files',
+    'generate_file_guarded', 'generate_files', 'generate_files_distributed',
+    'report_stale', 'CheckResult', 'generate_bindings', 'binding_keys',
+    'DedupRegistry', 'DroppedInstantiation', 'generate_source_async',
+    'generate_file_async', 'generate_files_async', 'SourceTemplate',
+    'Itermode', 'Iterable', 'IterGroup', 'RemovalIterGroup', 'LengthPolicy',
+    'EmitMode', 'BindingForm', 'ShardMode', 'ValueFile', 'ValueStream',
+    'DerivedKey', 'ConditionalSegment', 'get_source_loads',
+    'write_source_loads', 'register_itermode', 'run_all_tests',
+    'run_func_tests', 'run_interface_tests', 'run_iter_tests',
+    'run_iter_class_tests', 'run_async_interface_tests', 'run_mode_tests',
+    'run_locking_tests', 'run_equivalence_tests', 'run_table_tests',
+    'run_incremental_tests', 'run_source_template_tests', 'run_check_tests',
+    'run_source_tests', 'run_dedup_tests', 'run_jobserver_tests',
+    'run_stream_tests', 'run_parallel_tests', 'run_shard_tests',
+    'run_checkpoint_tests', 'run_queue_tests', 'run_derived_tests',
+    'run_segment_tests'
 ]
 
-from .interface import generate_source, generate_file
-from .iter_classes import Itermode, Iterable, IterGroup, RemovalIterGroup
+from .interface import (generate_source, generate_file, generate_file_mapped,
+                        generate_file_parallel, generate_sharded_files,
+                        generate_file_guarded, generate_files,
+                        generate_files_distributed, report_stale, CheckResult,
+                        generate_bindings, binding_keys)
+from .async_interface import (generate_source_async, generate_file_async,
+                              generate_files_async)
+from .source_template import SourceTemplate
+from .iter_classes import (Itermode, Iterable, IterGroup, RemovalIterGroup,
+                           LengthPolicy, EmitMode, BindingForm, ShardMode,
+                           ValueFile, ValueStream, DerivedKey,
+                           ConditionalSegment)
+from .internal.dedup import DedupRegistry, DroppedInstantiation
+from .internal.modes import register_itermode
+from .internal.sources import get_source_loads, write_source_loads
 from .run_tests import (run_all_tests, run_func_tests, run_interface_tests,
-                        run_iter_tests)
+                        run_iter_tests, run_iter_class_tests,
+                        run_async_interface_tests, run_mode_tests,
+                        run_locking_tests, run_equivalence_tests,
+                        run_table_tests, run_incremental_tests,
+                        run_source_template_tests, run_check_tests,
+                        run_source_tests, run_dedup_tests,
+                        run_jobserver_tests, run_stream_tests,
+                        run_parallel_tests, run_shard_tests,
+                        run_checkpoint_tests, run_queue_tests,
+                        run_derived_tests, run_segment_tests)
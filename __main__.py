@@ -0,0 +1,60 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+"""Command line entry point of py_gen. python -m py_gen worker QUEUE_DIR runs
+a worker of the work queue in QUEUE_DIR, see generate_files_distributed."""
+
+import argparse
+import importlib
+import sys
+from py_gen.internal.queue import work
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m py_gen')
+    commands = parser.add_subparsers(dest='command')
+    worker = commands.add_parser(
+        'worker', help='run tasks from a shared directory work queue')
+    worker.add_argument('queue_dir', help='directory of the work queue')
+    worker.add_argument('--idle-timeout',
+                        type=float,
+                        default=None,
+                        help='exit once no task has been found for this many '
+                        'seconds, rather than running until killed')
+    worker.add_argument('--poll-interval',
+                        type=float,
+                        default=0.5,
+                        help='seconds to wait between looking for tasks')
+    worker.add_argument('--import',
+                        dest='modules',
+                        action='append',
+                        default=[],
+                        help='module to import before running tasks, such as '
+                        'one registering Itermodes, may be repeated')
+    args = parser.parse_args(argv)
+    if args.command != 'worker':
+        parser.print_help()
+        return 2
+    for module in args.modules:
+        importlib.import_module(module)
+    work(args.queue_dir,
+         idle_timeout=args.idle_timeout,
+         poll_interval=args.poll_interval)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,139 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from py_gen.internal.async_funcs import (read_from_file_async,
+                                         write_to_file_async,
+                                         clang_format_async)
+from py_gen.internal.jobserver import get_jobserver
+from py_gen.interface import generate_source, generate_file
+
+# Default number of files generate_files_async keeps in flight at once
+DEFAULT_MAX_CONCURRENCY = 64
+
+
+async def generate_source_async(source, iter_groups, executor=None):
+    """Coroutine version of generate_source. The generation is run in
+    executor, or the default executor of the event loop if executor is None.
+    As generation is CPU bound, passing a ProcessPoolExecutor lets several
+    sources generate at the same time."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, generate_source, source,
+                                      iter_groups)
+
+
+async def generate_file_async(input_file_name,
+                              output_file_name,
+                              iter_groups,
+                              format_generated=False,
+                              format_script="",
+                              executor=None,
+                              check=False):
+    """Coroutine version of generate_file. Reading and writing the files is
+    done without blocking the event loop, generation is run in executor as in
+    generate_source_async, and the formatting script is run as an asynchronous
+    subprocess. If check is True, the check of generate_file is run in
+    executor and its CheckResult returned."""
+    if check:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor,
+            partial(generate_file, input_file_name, output_file_name,
+                    iter_groups, format_generated, format_script, check=True))
+    source = await read_from_file_async(input_file_name)
+    source = await generate_source_async(source, iter_groups, executor)
+    await write_to_file_async(output_file_name, source)
+    if format_generated:
+        await clang_format_async(output_file_name, format_script)
+    return source
+
+
+async def generate_files_async(jobs,
+                               format_generated=False,
+                               format_script="",
+                               executor=None,
+                               max_concurrency=DEFAULT_MAX_CONCURRENCY,
+                               check=False):
+    """Runs generate_file_async for each job in jobs, a list of tuples of form
+    (input_file_name, output_file_name, iter_groups). At most max_concurrency
+    jobs are in flight at once, so the formatting of one file overlaps with the
+    generation of the next. When run from a recipe of make -jN, each job also
+    holds a job slot of the make jobserver while it runs, including its
+    formatting. Returns the list of generated sources in the order of jobs, or
+    of CheckResults if check is True. If a job raises, the other jobs are
+    cancelled, and have given back their job slots, before it is raised.
+    Generation already running in executor can't be stopped, and is left to
+    finish."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+    jobserver = get_jobserver()
+
+    async def run_job(input_file_name, output_file_name, iter_groups):
+        async with semaphore:
+            token = None
+            if jobserver is not None:
+                token = await _acquire_token(jobserver, token_executor)
+            try:
+                return await generate_file_async(
+                    input_file_name, output_file_name, iter_groups,
+                    format_generated, format_script, executor, check)
+            finally:
+                if jobserver is not None:
+                    jobserver.release(token)
+
+    if jobserver is None:
+        return await _run_all([run_job(*job) for job in jobs])
+    # Waiting for a token blocks a thread, so the threads waiting are kept
+    # apart from those the jobs run in
+    token_executor = ThreadPoolExecutor(max_concurrency)
+    try:
+        return await _run_all([run_job(*job) for job in jobs])
+    finally:
+        token_executor.shutdown(wait=False)
+        jobserver.close()
+
+
+async def _run_all(coroutines):
+    """Runs coroutines concurrently and returns the list of their results. If
+    one raises, or this is cancelled, the others are cancelled and waited for
+    before the exception is raised."""
+    tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+async def _acquire_token(jobserver, token_executor):
+    """Waits for a job slot of jobserver in token_executor and returns its
+    token. If cancelled while waiting, the thread waiting can't be stopped, so
+    the token is waited for and given back before the cancellation is
+    raised."""
+    future = asyncio.get_running_loop().run_in_executor(
+        token_executor, jobserver.acquire)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        try:
+            jobserver.release(await future)
+        except OSError:
+            pass
+        raise
@@ -15,15 +15,39 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from py_gen.internal.funcs import (read_from_file, insert_in_source,
-                                   write_to_file, clang_format)
-from py_gen.internal.iters import (dispatch_iterations, combined_dispatcher,
-                                   removal_dispatcher,
-                                   combined_removal_dispatcher)
-from py_gen.iter_classes import IterGroup, RemovalIterGroup
+                                   write_to_file, clang_format, map_file,
+                                   splice_in_buffer, write_vectored,
+                                   hash_generation, make_dirs)
+from py_gen.internal.checkpoint import (DEFAULT_CHECKPOINT_INTERVAL,
+                                        clear_checkpoint,
+                                        generate_checkpointed,
+                                        get_checkpoint_path)
+from py_gen.internal.check import (CheckResult, check_output,
+                                   generate_with_spans, make_manifest,
+                                   write_manifest)
+from py_gen.internal.guards import (update_guarded_source,
+                                    find_stale_insertion_points)
+from py_gen.internal.dedup import expand_iter_group_dedup
+from py_gen.internal.incremental import expand_iter_group_incremental
+from py_gen.internal.jobserver import get_jobserver
+from py_gen.internal.parallel import DEFAULT_CHUNK_SIZE, render_parallel
+from py_gen.internal.shards import generate_shard_sources
+from py_gen.internal.queue import (DEFAULT_LEASE_SECONDS, DEFAULT_TASK_ROWS,
+                                   create_run, remove_run, split_iter_group,
+                                   wait_for_run)
+from py_gen.internal.locking import (file_lock, read_lock_record,
+                                     write_lock_record, write_file_atomic)
+from py_gen.internal.iters import (expand_iter_group, iterate_bindings,
+                                   get_binding_keys)
+from py_gen.iter_classes import BindingForm, ShardMode
 
 
-def generate_source(source, iter_groups):
+def generate_source(source, iter_groups, state_dir=None, dedup=None):
     """Generates strings from the IterGroup and/or RemovalIterGroup objects in
     iter_groups, then inserts the generated strings into the input string,
     source.
@@ -34,35 +58,77 @@ def generate_source(source, iter_groups):
     by the result of substituting ${} keys in the string Template with the
     output of the Iterable object.
 
+    If a state_dir is given, the generated rows of each group are kept in it,
+    and generating a group again only substitutes the rows which weren't
+    generated before, such as those using a value newly added to an Iterable.
+
+    If dedup, a DedupRegistry, is given, copies of a template which dedup has
+    already emitted, in this or an earlier generation, are left out. The
+    state_dir is then not used.
+
     More extensive explanation is contained within the internal documentation"""
+    return _insert_all(source, iter_groups, _get_expand(state_dir, dedup))
+
+
+def _insert_all(source, iter_groups, expand):
+    """Inserts the string generated by expand for each IterGroup in turn"""
     for iter_group in iter_groups:
-        template = iter_group.template
-        # Normal IterGroup
-        if isinstance(iter_group, IterGroup):
-            if iter_group.combine_iters:
-                template = combined_dispatcher(template, iter_group.iterables)
-            else:
-                template = dispatch_iterations(template, iter_group.iterables)
-        # Removal IterGroup
-        else:
-            if iter_group.combine_iters:
-                template = combined_removal_dispatcher(
-                    template, iter_group.insertion_iterables,
-                    iter_group.removal_iterables)
-            else:
-                template = removal_dispatcher(template,
-                                              iter_group.insertion_iterables,
-                                              iter_group.removal_iterables)
         source = insert_in_source(source, iter_group.insertion_point,
-                                  template.template)
+                                  expand(iter_group))
     return source
 
 
+def _get_expand(state_dir, dedup=None, label=None):
+    """Returns the function generating the string for an IterGroup, which
+    leaves out repeats if a DedupRegistry is given, or generates
+    incrementally if a state_dir is given. label identifies the generation in
+    the report of the registry."""
+    if dedup is not None:
+        return lambda iter_group: expand_iter_group_dedup(
+            iter_group, dedup, label)
+    if state_dir is None:
+        return expand_iter_group
+    make_dirs(state_dir)
+    return lambda iter_group: expand_iter_group_incremental(
+        iter_group, state_dir)
+
+
+def generate_bindings(iter_group, form=BindingForm.dict):
+    """Yields the bindings of keys to values which generate_source would
+    substitute into the template of iter_group, an IterGroup or
+    RemovalIterGroup, for each copy of the template in the order they are
+    generated. Combined and removal groups are handled as by generate_source,
+    and removed copies are left out. Nothing is substituted into a template.
+
+    form is a BindingForm. BindingForm.dict yields a dict of each key and its
+    value, BindingForm.tuple yields a tuple of the values in the order of the
+    keys returned by binding_keys, and BindingForm.raw yields a tuple of the
+    output tuple of each insertion Iterable before it is joined.
+
+    Values are given as output by the Iterables. Where a value itself holds a
+    ${} key, generate_source would substitute it again with later Iterables."""
+    return iterate_bindings(iter_group, form)
+
+
+def binding_keys(iter_group):
+    """Returns the list of keys bound by iter_group, in the order of the values
+    in its BindingForm.tuple bindings"""
+    return get_binding_keys(iter_group)
+
+
 def generate_file(input_file_name,
                   output_file_name,
                   iter_groups,
                   format_generated=False,
-                  format_script=""):
+                  format_script="",
+                  lock=False,
+                  cache_dir=None,
+                  state_dir=None,
+                  check=False,
+                  manifest=False,
+                  dedup=None,
+                  checkpoint_dir=None,
+                  checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
     """Reads from file_name.in then generates and inserts strings into the read
     source, after which the result is written to file_name
 
@@ -72,10 +138,461 @@ def generate_file(input_file_name,
     substituting ${} keys in the string Template with the output of the Iterable
     object.
 
+    If lock is True, or a cache_dir is given, generation is safe to run from
+    several processes at once. See _generate_file_locked.
+
+    state_dir is used for incremental generation as by generate_source.
+
+    If manifest is True, a manifest of hashes of the input, the output and each
+    IterGroup is written next to the output, which lets a later check skip
+    generating the IterGroups which haven't changed.
+
+    If check is True, nothing is written. The output is generated and compared
+    with the existing output file a piece at a time, stopping at the first
+    difference, and a CheckResult of whether the output is stale, and which
+    insertion points are stale if known, is returned instead of the source.
+
+    dedup is used as by generate_source, with output_file_name identifying the
+    generation in its report. As the output then depends on what was
+    generated before, it can't be used with lock, cache_dir or check.
+
+    If a checkpoint_dir is given, the generated strings are kept in it as they
+    are generated, recording a checkpoint at least every checkpoint_interval
+    seconds. If generation is interrupted, running it again with the same input
+    and iter_groups resumes from the last checkpoint, and writes the same
+    output as an uninterrupted run. The checkpoints are removed once the output
+    is written. checkpoint_dir can't be used with lock, cache_dir, state_dir,
+    check or dedup.
+
     More extensive explanation is contained within the internal documentation"""
-    source = read_from_file(input_file_name)
-    source = generate_source(source, iter_groups)
+    if dedup is not None and (lock or cache_dir is not None or check):
+        raise ValueError('dedup can\'t be used with lock, cache_dir or check')
+    if checkpoint_dir is not None and (lock or cache_dir is not None
+                                       or state_dir is not None or check
+                                       or dedup is not None):
+        raise ValueError('checkpoint_dir can\'t be used with lock, cache_dir, '
+                         'state_dir, check or dedup')
+    input_source = read_from_file(input_file_name)
+    iter_groups = list(iter_groups)
+    if check:
+        return check_output(input_source, output_file_name, iter_groups,
+                            format_generated, format_script)
+    if lock or cache_dir is not None:
+        source = _generate_file_locked(input_source, output_file_name,
+                                       iter_groups, format_generated,
+                                       format_script, cache_dir, state_dir)
+        if manifest:
+            _write_manifest(input_source, output_file_name, iter_groups,
+                            format_generated, format_script, None)
+        return source
+    spans = None
+    checkpoint_path = None
+    if checkpoint_dir is not None:
+        checkpoint_path = get_checkpoint_path(checkpoint_dir, output_file_name)
+        source = generate_checkpointed(input_source, iter_groups,
+                                       checkpoint_path, checkpoint_interval)
+    else:
+        expand = _get_expand(state_dir, dedup, output_file_name)
+        if manifest:
+            source, spans = generate_with_spans(input_source, iter_groups,
+                                                expand)
+        else:
+            source = _insert_all(input_source, iter_groups, expand)
     write_to_file(output_file_name, source)
     if format_generated:
         clang_format(output_file_name, format_script)
+        # Offsets in the output are changed by formatting
+        spans = None
+    if manifest:
+        _write_manifest(input_source, output_file_name, iter_groups,
+                        format_generated, format_script, spans)
+    if checkpoint_path is not None:
+        clear_checkpoint(checkpoint_path)
     return source
+
+
+def _run_job(job):
+    """Runs generate_file for a tuple of its positional arguments and a dict of
+    its keyword arguments"""
+    args, kwargs = job
+    return generate_file(*args, **kwargs)
+
+
+def generate_files(jobs,
+                   format_generated=False,
+                   format_script="",
+                   workers=None,
+                   check=False,
+                   manifest=False,
+                   dedup=None):
+    """Runs generate_file for each job in jobs, a list of tuples of form
+    (input_file_name, output_file_name, iter_groups), across workers processes.
+    workers defaults to the number of CPUs, and with 1 worker the jobs are run
+    in this process. The IterGroups of each job are pickled to the worker
+    processes, so any Itermodes registered with register_itermode must also be
+    registered in the workers.
+
+    When run from a recipe of make -jN, a job is only started once a job slot
+    is free in the make jobserver, so the jobs share make's slots rather than
+    adding to them. Otherwise at most workers jobs run at once.
+
+    With a DedupRegistry given as dedup, the jobs are run in order in this
+    process, so repeats are dropped from later jobs.
+
+    Returns the list of results of generate_file in the order of jobs, which
+    are CheckResults if check is True. See report_stale."""
+    kwargs = {
+        'format_generated': format_generated,
+        'format_script': format_script,
+        'check': check,
+        'manifest': manifest
+    }
+    if dedup is not None:
+        kwargs['dedup'] = dedup
+        workers = 1
+    jobs = [((input_file_name, output_file_name, list(iter_groups)), kwargs)
+            for input_file_name, output_file_name, iter_groups in jobs]
+    if workers == 1 or len(jobs) < 2:
+        return [_run_job(job) for job in jobs]
+    jobserver = get_jobserver()
+    if jobserver is None:
+        with ProcessPoolExecutor(workers) as executor:
+            return list(executor.map(_run_job, jobs))
+    # The executor is shut down first, so every job still running has given
+    # back its slot before the jobserver is closed
+    with jobserver, ProcessPoolExecutor(workers) as executor:
+        return _map_with_tokens(executor, jobserver, _run_job, jobs)
+
+
+def _map_with_tokens(executor, jobserver, func, tasks):
+    """Submits func with each of tasks to executor once a job slot is free in
+    jobserver, and gives the slot back when it is done. Returns the list of
+    results in the order of tasks."""
+    futures = []
+    for task in tasks:
+        token = jobserver.acquire()
+        try:
+            future = executor.submit(func, task)
+        except BaseException:
+            jobserver.release(token)
+            raise
+        future.add_done_callback(
+            lambda _, token=token: jobserver.release(token))
+        futures.append(future)
+    return [future.result() for future in futures]
+
+
+def generate_files_distributed(jobs,
+                               queue_dir,
+                               format_generated=False,
+                               format_script="",
+                               lease_seconds=DEFAULT_LEASE_SECONDS,
+                               task_rows=DEFAULT_TASK_ROWS,
+                               take_part=True):
+    """Runs generate_file for each job in jobs, a list of tuples of form
+    (input_file_name, output_file_name, iter_groups), with the generation
+    shared between the workers of the work queue in queue_dir, a directory on
+    a filesystem shared by every host taking part. Workers are started on any
+    host with python -m py_gen worker queue_dir.
+
+    The string generated by each IterGroup is split into tasks of about
+    task_rows copies of its template, or a single task where its copies can't
+    be generated separately, which are added to the queue as a run. A worker
+    holds a lease on a task while it runs it, and a task whose worker hasn't
+    renewed its lease for lease_seconds, such as one on a host which failed, is
+    taken over by another worker. If take_part is True this process also runs
+    tasks while it waits. The generated strings are then inserted into each
+    input in order, and the outputs written and formatted by this process.
+
+    The IterGroups are pickled to the queue, so any Itermodes registered with
+    register_itermode must also be registered in the workers, see the --import
+    option of the worker. Returns the list of generated sources in the order of
+    jobs."""
+    jobs = [(input_file_name, output_file_name, list(iter_groups))
+            for input_file_name, output_file_name, iter_groups in jobs]
+    tasks = []
+    task_counts = []
+    for _, _, iter_groups in jobs:
+        for iter_group in iter_groups:
+            group_tasks = split_iter_group(iter_group, task_rows)
+            tasks.extend(group_tasks)
+            task_counts.append(len(group_tasks))
+    run_dir = create_run(queue_dir, tasks, lease_seconds)
+    try:
+        results = iter(wait_for_run(run_dir, take_part=take_part))
+    finally:
+        remove_run(run_dir)
+    task_counts = iter(task_counts)
+    sources = []
+    for input_file_name, output_file_name, iter_groups in jobs:
+        source = read_from_file(input_file_name)
+        for iter_group in iter_groups:
+            generated = ''.join(
+                next(results) for _ in range(next(task_counts)))
+            source = insert_in_source(source, iter_group.insertion_point,
+                                      generated)
+        write_to_file(output_file_name, source)
+        if format_generated:
+            clang_format(output_file_name, format_script)
+        sources.append(source)
+    return sources
+
+
+def report_stale(results, stream=None):
+    """Writes a line to stream, stdout by default, for each stale CheckResult in
+    results, listing the stale insertion points where they are known.
+    Returns an exit code, 1 if any result is stale and 0 otherwise."""
+    if stream is None:
+        stream = sys.stdout
+    exit_code = 0
+    for result in results:
+        if not result.stale:
+            continue
+        exit_code = 1
+        line = 'stale: ' + result.output_file_name
+        if result.stale_insertion_points:
+            line += ' (' + ', '.join(result.stale_insertion_points) + ')'
+        stream.write(line + '\n')
+    return exit_code
+
+
+def _write_manifest(input_source, output_file_name, iter_groups,
+                    format_generated, format_script, spans):
+    """Writes the manifest of the output written to output_file_name"""
+    write_manifest(
+        output_file_name,
+        make_manifest(input_source, iter_groups,
+                      read_from_file(output_file_name), format_generated,
+                      format_script, spans))
+
+
+def _write_output(output_file_name, source, format_generated, format_script):
+    """Atomically replaces output_file_name with source, formatting it first
+    if format_generated is True"""
+    prepare = None
+    if format_generated:
+        prepare = lambda temp_name: clang_format(temp_name, format_script)
+    write_file_atomic(output_file_name, source, prepare)
+
+
+def _output_record(generation, output_file_name):
+    """Returns the lock record identifying output_file_name as the result of
+    generation, which no longer matches if the file is changed"""
+    stat = os.stat(output_file_name)
+    return ' '.join([generation, str(stat.st_mtime_ns), str(stat.st_size)])
+
+
+def _generate_file_locked(source, output_file_name, iter_groups,
+                          format_generated, format_script, cache_dir,
+                          state_dir):
+    """Generates source into output_file_name while holding a cross-process
+    lock on it, and replaces it atomically so it is never seen part written.
+
+    Without a cache_dir, a record of the last generation is kept in the lock
+    file, and if the output is unchanged since the same generation it is reused
+    rather than generated again. With a cache_dir, each generation is stored in
+    it by a hash of the input and iter_groups under a lock of its own. The
+    first process to take that lock generates, and any process waiting on it
+    or run later reuses the stored result.
+
+    Returns the generated source, or the content of the output file where a
+    previous output file is reused."""
+    generation = hash_generation(source, iter_groups, format_generated,
+                                 format_script)
+    if cache_dir is None:
+        with file_lock(output_file_name) as lock_file:
+            if (os.path.exists(output_file_name) and read_lock_record(lock_file)
+                    == _output_record(generation, output_file_name)):
+                return read_from_file(output_file_name)
+            source = generate_source(source, iter_groups, state_dir)
+            _write_output(output_file_name, source, format_generated,
+                          format_script)
+            write_lock_record(lock_file,
+                              _output_record(generation, output_file_name))
+            return source
+    make_dirs(cache_dir)
+    entry = os.path.join(cache_dir, generation)
+    with file_lock(entry):
+        if os.path.exists(entry + '.out'):
+            source = read_from_file(entry + '.source')
+            with file_lock(output_file_name):
+                write_file_atomic(output_file_name,
+                                  read_from_file(entry + '.out'))
+            return source
+        source = generate_source(source, iter_groups, state_dir)
+        write_file_atomic(entry + '.source', source)
+        with file_lock(output_file_name):
+            _write_output(output_file_name, source, format_generated,
+                          format_script)
+            output_source = read_from_file(output_file_name)
+        # The output is stored last, as its presence marks a complete entry
+        write_file_atomic(entry + '.out', output_source)
+        return source
+
+
+def generate_file_mapped(input_file_name,
+                         output_file_name,
+                         iter_groups,
+                         format_generated=False,
+                         format_script=""):
+    """Bytes mode version of generate_file for large input files. The input file
+    is memory mapped and the output is written as slices of the mapped input
+    interleaved with the generated strings, so the unchanged parts of the input
+    are never decoded or copied.
+
+    Input bytes are copied through as they are, so unlike generate_file line
+    endings are not translated. Where the insertions can't be made directly in
+    the mapped input, for example if a generated string contains a later
+    insertion point, the input is read and generated as by generate_file.
+
+    Returns the number of bytes written"""
+    insertions = [(iter_group.insertion_point, expand_iter_group(iter_group))
+                  for iter_group in iter_groups]
+    size = None
+    # Writing over a mapped input would truncate it while it is being read
+    if not (os.path.exists(output_file_name)
+            and os.path.samefile(input_file_name, output_file_name)):
+        with map_file(input_file_name) as buffer:
+            buffers = splice_in_buffer(buffer, insertions)
+            if buffers is not None:
+                write_vectored(output_file_name, buffers)
+                size = sum(len(chunk) for chunk in buffers)
+            # Release the slices of the mapped input before it is closed
+            del buffers
+    if size is None:
+        source = read_from_file(input_file_name)
+        for insertion_point, replacement_string in insertions:
+            source = insert_in_source(source, insertion_point,
+                                      replacement_string)
+        write_to_file(output_file_name, source)
+        size = len(source.encode('utf-8'))
+    if format_generated:
+        clang_format(output_file_name, format_script)
+    return size
+
+
+def generate_file_parallel(input_file_name,
+                           output_file_name,
+                           iter_groups,
+                           format_generated=False,
+                           format_script="",
+                           workers=None,
+                           chunk_size=DEFAULT_CHUNK_SIZE):
+    """Version of generate_file for very large outputs, which are rendered by
+    workers processes straight into the output file. The exact size of each
+    generated string is computed first, without generating it where it can be
+    summed from the lengths of the values, then the output file is created at
+    its final size and memory mapped, and each worker renders chunks of about
+    chunk_size bytes of the generated strings at their offsets in it. workers
+    defaults to the number of CPUs, and with 1 worker the chunks are rendered
+    in this process. As with generate_files, any Itermodes registered with
+    register_itermode must also be registered in the workers, and when run
+    from a recipe of make -jN a chunk is only started once a job slot is free
+    in the make jobserver, so the workers share make's slots.
+
+    The output is written as UTF-8 without translating line endings, as by
+    generate_file_mapped, and replaces output_file_name once complete. Where
+    the insertions depend on each other, for example if a generated string
+    contains a later insertion point, the output is generated as by
+    generate_file.
+
+    Returns the number of bytes written"""
+    source = read_from_file(input_file_name)
+    jobserver = None if workers == 1 else get_jobserver()
+    if workers == 1:
+        size = render_parallel(source, iter_groups, output_file_name, map,
+                               chunk_size)
+    elif jobserver is None:
+        with ProcessPoolExecutor(workers) as executor:
+            size = render_parallel(source, iter_groups, output_file_name,
+                                   executor.map, chunk_size)
+    else:
+        with jobserver, ProcessPoolExecutor(workers) as executor:
+            size = render_parallel(
+                source, iter_groups, output_file_name,
+                partial(_map_with_tokens, executor, jobserver), chunk_size)
+    if size is None:
+        for iter_group in iter_groups:
+            source = insert_in_source(source, iter_group.insertion_point,
+                                      expand_iter_group(iter_group))
+        write_to_file(output_file_name, source)
+        size = len(source.encode('utf-8'))
+    if format_generated:
+        clang_format(output_file_name, format_script)
+    return size
+
+
+def generate_sharded_files(input_file_name,
+                           output_file_names,
+                           iter_groups,
+                           shard_mode=ShardMode.hash,
+                           format_generated=False,
+                           format_script=""):
+    """Splits the copies of the template of each IterGroup in iter_groups
+    between the files in output_file_names, each of which is written with the
+    input source and the copies in its shard inserted. Copies are kept in the
+    order they are generated in each shard.
+
+    shard_mode is a ShardMode. With ShardMode.hash, the default, the shard of
+    each copy is given by a consistent hash of the keys and values bound in
+    it, so adding or removing values only changes the shards which gain or
+    lose copies, and adding an output file only moves the copies assigned to
+    it. With ShardMode.position the copies are split in order into runs of
+    about the same length.
+
+    As with generate_file with lock=True, a record of the last generation of
+    each output is kept in its lock file, and outputs which would be generated
+    the same as before are left as they are, so a build only recompiles the
+    shards which changed.
+
+    Returns the list of the output file names which were written"""
+    source = read_from_file(input_file_name)
+    shard_sources = generate_shard_sources(source, iter_groups,
+                                           len(output_file_names), shard_mode)
+    written = []
+    for output_file_name, shard_source in zip(output_file_names,
+                                              shard_sources):
+        generation = hash_generation(shard_source, [], format_generated,
+                                     format_script)
+        with file_lock(output_file_name) as lock_file:
+            if (os.path.exists(output_file_name) and read_lock_record(lock_file)
+                    == _output_record(generation, output_file_name)):
+                continue
+            _write_output(output_file_name, shard_source, format_generated,
+                          format_script)
+            write_lock_record(lock_file,
+                              _output_record(generation, output_file_name))
+        written.append(output_file_name)
+    return written
+
+
+def generate_file_guarded(file_name,
+                          iter_groups,
+                          format_generated=False,
+                          format_script="",
+                          comment="//",
+                          check=False):
+    """Generates code in place in file_name, without a separate input file.
+    Generated code is kept between begin and end marker comments, which start
+    with comment and record the insertion point and spec_hash of the IterGroup
+    generating the code. When run again, only the regions whose IterGroup has
+    changed are generated and replaced, the rest of the file is copied through.
+
+    On the first run file_name should contain the insertion points, each alone
+    on its line. The file is only written, and formatted, if it has changed.
+
+    If check is True, nothing is generated or written, and a CheckResult of the
+    insertion points whose regions are missing or have a different spec_hash
+    is returned.
+
+    Returns the updated source"""
+    source = read_from_file(file_name)
+    if check:
+        stale = find_stale_insertion_points(source, iter_groups, comment)
+        return CheckResult(file_name, bool(stale), stale)
+    updated_source = update_guarded_source(source, iter_groups, comment)
+    if updated_source != source:
+        write_to_file(file_name, updated_source)
+        if format_generated:
+            clang_format(file_name, format_script)
+    return updated_source
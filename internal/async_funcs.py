@@ -0,0 +1,56 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import asyncio
+import shlex
+from .funcs import read_from_file, write_to_file
+
+# Coroutine versions of the file IO and formatting functions in funcs.py. File
+# IO is run in the default executor of the event loop so that it doesn't block
+# the loop, and formatting runs as an asynchronous subprocess.
+
+
+async def read_from_file_async(file_name):
+    """Reads from the given file name without blocking the event loop
+    Returns the read file"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, read_from_file, file_name)
+
+
+async def write_to_file_async(file_name, file_source):
+    """Discard writes file_source to file_name without blocking the event
+    loop"""
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, write_to_file, file_name, file_source)
+
+
+async def clang_format_async(file_name, clang_format_script):
+    """Calls the input clang formatting script in an asynchronous subprocess.
+    Provides the input filename as the last arguement to the script. The script
+    is split into a command and its arguments as a shell would, but is not run
+    through a shell."""
+    args = shlex.split(clang_format_script) + [str(file_name)]
+    try:
+        process = await asyncio.create_subprocess_exec(*args)
+        returncode = await process.wait()
+    except OSError as oserror:
+        print("Call to " + clang_format_script + " failed")
+        print(str(oserror))
+        return
+    if returncode != 0:
+        print("Call to " + clang_format_script + " failed")
+        print("Exit code: " + str(returncode))
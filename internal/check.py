@@ -0,0 +1,337 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+from ..iter_classes import EmitMode
+from .funcs import (read_from_file, write_to_file, insert_in_source,
+                    clang_format)
+from .iters import (expand_iter_group, get_insertion_iterables,
+                    iterate_expansion, join_output)
+from .locking import write_file_atomic
+from .modes import iterate_outputs
+from .scaffold import CreatedInsertionPoint, index_scaffold
+
+# Checking an output compares what generate_file would write with the existing
+# output file, without writing it. The generated strings are compared with the
+# file piece by piece in file order, as they are generated, and generation
+# stops at the first difference. Only a group which could create a later
+# insertion point, so changing the output before the difference, is generated
+# past it.
+# A manifest written next to an output records hashes of the input, output and
+# each IterGroup, and the offsets of each generated string in the output. If
+# the input and output are unchanged since, only the IterGroups whose spec_hash
+# changed have to be generated and compared, and none if no IterGroup changed.
+
+# The number of characters compared at once where an occurrence of a group is
+# compared with an earlier one
+_CHUNK_SIZE = 1 << 16
+
+CheckResult = namedtuple('CheckResult',
+                         ['output_file_name', 'stale', 'stale_insertion_points'])
+
+
+class _DependentInsertion(Exception):
+    """Raised when a generated string creates a later insertion point, so the
+    output can't be compared piece by piece"""
+
+
+def hash_text(text):
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def get_manifest_file_name(output_file_name):
+    return output_file_name + '.manifest'
+
+
+def make_manifest(source, iter_groups, output, format_generated,
+                  format_script, spans):
+    """Returns the manifest of output, generated from source with
+    iter_groups. spans holds the offsets of each group's generated strings in
+    output, or is None if they aren't known."""
+    return {
+        'input': hash_text(source),
+        'output': hash_text(output),
+        'format': [bool(format_generated), format_script],
+        'groups': [[iter_group.insertion_point,
+                    iter_group.spec_hash()] for iter_group in iter_groups],
+        'spans': spans
+    }
+
+
+def write_manifest(output_file_name, manifest):
+    write_file_atomic(get_manifest_file_name(output_file_name),
+                      json.dumps(manifest))
+
+
+def read_manifest(output_file_name):
+    """Returns the manifest kept for output_file_name, or None if there isn't
+    one"""
+    try:
+        with open(get_manifest_file_name(output_file_name), 'r') as manifest:
+            return json.load(manifest)
+    except (OSError, IOError, ValueError):
+        return None
+
+
+def generate_with_spans(source, iter_groups, expand=expand_iter_group):
+    """Generates source with iter_groups as generate_source, generating each
+    group's string with expand. Returns a tuple of the generated source and
+    the offsets of each group's strings in it, or None in place of the offsets
+    where the insertions depend on each other."""
+    index = index_scaffold(
+        source, [iter_group.insertion_point for iter_group in iter_groups])
+    expanded = []
+
+    def expand_all():
+        for iter_group in iter_groups:
+            expanded.append(expand(iter_group))
+            yield expanded[-1]
+
+    if index is not None:
+        rendered = index.render_spans(expand_all())
+        if rendered is not None:
+            return rendered
+    for position, iter_group in enumerate(iter_groups):
+        if position < len(expanded):
+            replacement_string = expanded[position]
+        else:
+            replacement_string = expand(iter_group)
+        source = insert_in_source(source, iter_group.insertion_point,
+                                  replacement_string)
+    return source, None
+
+
+def generate_formatted(source, iter_groups, output_file_name, format_script):
+    """Returns source generated with iter_groups and formatted by
+    format_script, using a temporary file named as output_file_name"""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        temp_name = os.path.join(temp_dir, os.path.basename(output_file_name))
+        write_to_file(temp_name,
+                      generate_with_spans(source, iter_groups)[0])
+        clang_format(temp_name, format_script)
+        return read_from_file(temp_name)
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+def compare_changed_groups(source, iter_groups, existing, changed, spans):
+    """Compares the generated strings of the groups at the indexes in changed
+    with the existing output at the offsets in spans, where every other group
+    and the input are unchanged since spans were recorded. Returns the list of
+    stale insertion points, or None if the groups can't be compared alone."""
+    index = index_scaffold(
+        source, [iter_group.insertion_point for iter_group in iter_groups])
+    if index is None or len(spans) != len(iter_groups):
+        return None
+    stale = []
+    for position in changed:
+        occurrences = [region for region in index.regions
+                       if region[2] == position]
+        if len(occurrences) != len(spans[position]):
+            return None
+        replacement = index.indent(position,
+                                   expand_iter_group(iter_groups[position]))
+        if replacement is None:
+            return None
+        if any(end - start != len(replacement)
+               or not existing.startswith(replacement, start)
+               for start, end in spans[position]):
+            stale.append(iter_groups[position].insertion_point)
+    return stale
+
+
+def _may_create(index, position, iter_group):
+    """Returns whether the string generated for iter_group, inserted at the
+    insertion point at position in index, could create a later insertion
+    point, without generating it. It can't where each later insertion point
+    holds a character found in none of the text the string and its borders
+    are made of: the template and segment texts, the joined outputs of the
+    insertion iterables, the source around each occurrence and the
+    indentation."""
+    points = index.get_later_points(position)
+    if not points:
+        return False
+    if (iter_group.emit_mode is not EmitMode.expanded
+            or iter_group.derived_keys):
+        return True
+    characters = set(iter_group.template.template + ' ')
+    for segment in iter_group.segments:
+        characters.update(segment.segment + segment.otherwise)
+    for iterable in get_insertion_iterables(iter_group):
+        for output in iterate_outputs(iterable):
+            characters.update(join_output(iterable, output))
+    overlap = max(len(point) for point in points) - 1
+    for start, end, region_index in index.regions:
+        if region_index == position:
+            characters.update(index.source[max(0, start - overlap):start] +
+                              index.source[end:end + overlap])
+    return any(set(point) <= characters for point in points)
+
+
+def _iterate_replacement(index, position, iter_group):
+    """Yields the indented replacement for the insertion point at position in
+    index a piece at a time, as iter_group is generated. Raises
+    _DependentInsertion if it creates a later insertion point."""
+    try:
+        for piece in index.iterate_indented(position,
+                                            iterate_expansion(iter_group)):
+            yield piece
+    except CreatedInsertionPoint:
+        raise _DependentInsertion()
+
+
+def _compare_replacement(index, position, iter_group, existing, offset):
+    """Compares the replacement for the insertion point at position with
+    existing at offset, generating it a piece at a time and stopping at the
+    first difference. Returns the length of the replacement, or None if it
+    differs."""
+    start = offset
+    for piece in _iterate_replacement(index, position, iter_group):
+        if not existing.startswith(piece, offset):
+            return None
+        offset += len(piece)
+    return offset - start
+
+
+def _matches_span(existing, offset, start, length):
+    """Returns whether existing holds the same text at offset as in the span
+    of length at start, compared a chunk at a time"""
+    if offset + length > len(existing):
+        return False
+    for chunk_start in range(0, length, _CHUNK_SIZE):
+        chunk_end = min(length, chunk_start + _CHUNK_SIZE)
+        if not existing.startswith(
+                existing[start + chunk_start:start + chunk_end],
+                offset + chunk_start):
+            return False
+    return True
+
+
+def compare_pieces(source, iter_groups, existing):
+    """Compares the output generated from source with the existing output, a
+    piece at a time in file order, generating each group as it is first
+    reached and stopping at the first difference. Returns None if they match,
+    or the list of stale insertion points, which is empty where a literal part
+    of the input differs."""
+    insertion_points = [iter_group.insertion_point for iter_group in iter_groups]
+    index = index_scaffold(source, insertion_points)
+    if index is None:
+        raise _DependentInsertion()
+    # The offset and length of the first occurrence of each group compared,
+    # which later occurrences are compared with
+    spans = {}
+    stale = None
+    offset = len(index.segments[0])
+    if not existing.startswith(index.segments[0]):
+        stale = []
+    else:
+        for (_, _, position), segment in zip(index.regions,
+                                             index.segments[1:]):
+            if position in spans:
+                length = spans[position][1]
+                if not _matches_span(existing, offset, spans[position][0],
+                                     length):
+                    length = None
+            else:
+                length = _compare_replacement(index, position,
+                                              iter_groups[position], existing,
+                                              offset)
+                if length is not None:
+                    spans[position] = (offset, length)
+            if length is None:
+                stale = [insertion_points[position]]
+                break
+            offset += length
+            if not existing.startswith(segment, offset):
+                stale = []
+                break
+            offset += len(segment)
+        else:
+            if offset != len(existing):
+                stale = []
+    if stale is not None:
+        # A group not compared in full could still create a later insertion
+        # point, which would change the output before the difference, so
+        # those which might are generated to find out
+        for position in set(region[2] for region in index.regions):
+            if position not in spans and _may_create(
+                    index, position, iter_groups[position]):
+                for _ in _iterate_replacement(index, position,
+                                              iter_groups[position]):
+                    pass
+    return stale
+
+
+def matches_manifest(manifest, source, existing, insertion_points,
+                     format_generated, format_script):
+    """Returns whether manifest was written for the input source, the existing
+    output, the insertion points and the formatting options"""
+    try:
+        return (manifest['input'] == hash_text(source)
+                and manifest['format'] == [bool(format_generated),
+                                           format_script]
+                and manifest['output'] == hash_text(existing)
+                and [point for point, _ in manifest['groups']
+                     ] == insertion_points)
+    except (TypeError, KeyError, ValueError):
+        return False
+
+
+def check_output(source, output_file_name, iter_groups, format_generated=False,
+                 format_script=""):
+    """Checks whether output_file_name holds the output of generating source
+    with iter_groups, as written by generate_file. Returns a CheckResult."""
+    iter_groups = list(iter_groups)
+    insertion_points = [iter_group.insertion_point for iter_group in iter_groups]
+    if not os.path.exists(output_file_name):
+        return CheckResult(output_file_name, True, insertion_points)
+    existing = read_from_file(output_file_name)
+    manifest = read_manifest(output_file_name)
+    changed = []
+    if matches_manifest(manifest, source, existing, insertion_points,
+                        format_generated, format_script):
+        changed = [
+            position for position, iter_group in enumerate(iter_groups)
+            if iter_group.spec_hash() != manifest['groups'][position][1]
+        ]
+        if not changed:
+            return CheckResult(output_file_name, False, [])
+        if manifest['spans'] is not None:
+            stale = compare_changed_groups(source, iter_groups, existing,
+                                           changed, manifest['spans'])
+            if stale is not None:
+                return CheckResult(output_file_name, bool(stale), stale)
+    if not format_generated:
+        try:
+            stale = compare_pieces(source, iter_groups, existing)
+            return CheckResult(output_file_name, stale is not None,
+                               stale or [])
+        except _DependentInsertion:
+            output = generate_with_spans(source, iter_groups)[0]
+    else:
+        output = generate_formatted(source, iter_groups, output_file_name,
+                                    format_script)
+    if output == existing:
+        return CheckResult(output_file_name, False, [])
+    return CheckResult(output_file_name, True,
+                       [insertion_points[position] for position in changed])
@@ -0,0 +1,189 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from itertools import islice
+from .funcs import hash_generation, insert_in_source, make_dirs
+from .iters import expand_iter_group
+from .locking import write_file_atomic
+from .parallel import compile_group
+
+# A checkpointed generation keeps the generated string of each group in a
+# directory of its own in the checkpoint directory, named after the output
+# file. The string of each completed group is kept in a file named after its
+# index, and the copies generated so far for the group in progress are
+# appended to a partial file. A state file records the hash of the generation,
+# the number of completed groups, and the rank of the next copy of the group in
+# progress together with the length of the partial file at that rank.
+# The state is only replaced once what it records has been written, so a
+# generation interrupted at any point resumes from its last checkpoint. A
+# partial file longer than recorded, written after the last checkpoint, is cut
+# back to the recorded length. A completed group is written to the partial file
+# which is then renamed to its group file, so a group file only exists once
+# complete, and a group file the state doesn't record as completed, left by a
+# generation interrupted before recording it, is recorded when resuming.
+# Only groups whose copies can be generated separately are checkpointed within
+# the group. Others, such as combined groups, are generated in full between
+# checkpoints.
+
+# Default number of seconds between checkpoints
+DEFAULT_CHECKPOINT_INTERVAL = 30.0
+
+# Number of copies generated between checks of the time
+_CHECK_ROWS = 1024
+
+_STATE_FILE_NAME = 'state.json'
+_PARTIAL_FILE_NAME = 'partial'
+
+
+def get_checkpoint_path(checkpoint_dir, output_file_name):
+    """Returns the directory the checkpoints of output_file_name are kept in"""
+    digest = hashlib.sha1(
+        os.path.abspath(output_file_name).encode('utf-8')).hexdigest()
+    return os.path.join(checkpoint_dir,
+                        os.path.basename(output_file_name) + '.' + digest[:16])
+
+
+def _group_file_name(path, index):
+    return os.path.join(path, 'group_' + str(index))
+
+
+def read_checkpoint(path, generation):
+    """Returns the state last recorded in path for generation, or None if
+    there is none"""
+    try:
+        with open(os.path.join(path, _STATE_FILE_NAME), 'r') as state_file:
+            state = json.load(state_file)
+    except (IOError, OSError, ValueError):
+        return None
+    if state.get('generation') != generation:
+        return None
+    return state
+
+
+def write_checkpoint(path, state):
+    write_file_atomic(os.path.join(path, _STATE_FILE_NAME), json.dumps(state))
+
+
+def _sync(output_file):
+    """Makes sure what was written to output_file is on disk before a
+    checkpoint records it"""
+    output_file.flush()
+    os.fsync(output_file.fileno())
+
+
+def _record_completed(path, state, index):
+    state.update(completed=index + 1, rank=0, length=0)
+    write_checkpoint(path, state)
+
+
+def _finish_group(path, state, index, generated=None):
+    """Records the group at index as completed, taking its generated string
+    from the partial file unless generated is given"""
+    partial_file_name = os.path.join(path, _PARTIAL_FILE_NAME)
+    if generated is not None:
+        with open(partial_file_name, 'wb') as partial_file:
+            partial_file.write(generated.encode('utf-8'))
+            _sync(partial_file)
+    elif not os.path.exists(partial_file_name):
+        open(partial_file_name, 'wb').close()
+    os.replace(partial_file_name, _group_file_name(path, index))
+    _record_completed(path, state, index)
+
+
+def iterate_checkpoints(source, iter_groups, path, interval):
+    """Generates the string of each of iter_groups into path, resuming from the
+    last checkpoint recorded for the same source and iter_groups, and recording
+    a checkpoint at least every interval seconds. Yields the state after each
+    checkpoint is recorded."""
+    generation = hash_generation(source, iter_groups)
+    state = read_checkpoint(path, generation)
+    if state is None:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        make_dirs(path)
+        state = {'generation': generation, 'completed': 0, 'rank': 0,
+                 'length': 0}
+        write_checkpoint(path, state)
+    partial_file_name = os.path.join(path, _PARTIAL_FILE_NAME)
+    last_checkpoint = time.time()
+    for index in range(state['completed'], len(iter_groups)):
+        if os.path.exists(_group_file_name(path, index)):
+            _record_completed(path, state, index)
+            last_checkpoint = time.time()
+            yield state
+            continue
+        iter_group = iter_groups[index]
+        compiled = compile_group(iter_group)
+        if compiled is None:
+            _finish_group(path, state, index, expand_iter_group(iter_group))
+            last_checkpoint = time.time()
+            yield state
+            continue
+        # Drop anything written after the last checkpoint
+        if state['rank']:
+            with open(partial_file_name, 'r+b') as partial_file:
+                partial_file.truncate(state['length'])
+        elif os.path.exists(partial_file_name):
+            os.remove(partial_file_name)
+        rank = state['rank']
+        rows = compiled.iterate_ranks(rank)
+        with open(partial_file_name, 'ab') as partial_file:
+            while True:
+                copies = [
+                    compiled.render_row(row)
+                    for row in islice(rows, _CHECK_ROWS)
+                ]
+                if not copies:
+                    _sync(partial_file)
+                    break
+                partial_file.write(''.join(copies).encode('utf-8'))
+                rank += len(copies)
+                if time.time() - last_checkpoint < interval:
+                    continue
+                _sync(partial_file)
+                state.update(rank=rank, length=partial_file.tell())
+                write_checkpoint(path, state)
+                last_checkpoint = time.time()
+                yield state
+        _finish_group(path, state, index)
+        last_checkpoint = time.time()
+        yield state
+
+
+def generate_checkpointed(source, iter_groups, path,
+                          interval=DEFAULT_CHECKPOINT_INTERVAL):
+    """Returns source generated with iter_groups as by generate_source,
+    checkpointing the generation in path as it goes. Resumes from the last
+    checkpoint in path if it is for the same source and iter_groups."""
+    for _ in iterate_checkpoints(source, iter_groups, path, interval):
+        pass
+    for index, iter_group in enumerate(iter_groups):
+        with open(_group_file_name(path, index), 'rb') as group_file:
+            generated = group_file.read().decode('utf-8')
+        source = insert_in_source(source, iter_group.insertion_point,
+                                  generated)
+    return source
+
+
+def clear_checkpoint(path):
+    """Removes the checkpoints kept in path once the output is complete"""
+    shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,316 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import sys
+from collections import namedtuple
+from itertools import product
+from ..iter_classes import EmitMode
+from .incremental import is_splittable
+from .iters import (expand_iter_group, get_derive, get_insertion_iterables,
+                    get_output_lists, get_render, get_substitutions,
+                    is_separable, iterate_rows, merge_substitutions)
+from .tables import emit_xmacro
+
+# A DedupRegistry is shared by the generation of several groups, or several
+# files, and drops each copy of a template whose instantiation was already
+# emitted. Instantiations are kept by the template and the key and comma_list
+# of each insertion iterable, and within those by a fingerprint of the output
+# of each iterable, with any aliased values replaced by their canonical value.
+# Each different output is given an id once, and the fingerprint packs the id
+# of each output into a single int, so fingerprinting a copy only sums ints
+# and no string is built or hashed for it.
+
+# Bits of a fingerprint used for the output of each iterable
+_ID_BITS = 32
+
+DroppedInstantiation = namedtuple('DroppedInstantiation', [
+    'label', 'insertion_point', 'binding', 'first_label',
+    'first_insertion_point'
+])
+
+
+class DedupRegistry(object):
+    """Records the instantiations emitted during a generation run, so that
+    repeats of an instantiation in later copies, groups or files are dropped.
+    aliases is a list of tuples of values which are equivalent, such as
+    ('int32_t', 'int'). Copies differing only by equivalent values are
+    repeats, and the first emitted keeps its own spelling. A registry isn't
+    safe to share between threads or processes."""
+
+    def __init__(self, aliases=()):
+        self.aliases = {}
+        for equivalent in aliases:
+            equivalent = tuple(equivalent)
+            for value in equivalent[1:]:
+                self.aliases[value] = equivalent[0]
+        self.output_ids = {}
+        self.emitted = {}
+        self.dropped = []
+
+    def get_signature(self, iter_group):
+        """Returns the part of the fingerprint shared by every copy of the
+        template of iter_group"""
+        return (iter_group.template.template,
+                tuple((iterable.key, iterable.comma_list,
+                       iterable.bind_elements)
+                      for iterable in get_insertion_iterables(iter_group)),
+                iter_group.derived_keys, iter_group.segments)
+
+    def get_emitted(self, iter_group):
+        """Returns the dict of the fingerprints emitted with the template and
+        keys of iter_group and where each was first emitted"""
+        return self.emitted.setdefault(self.get_signature(iter_group), {})
+
+    def get_output_id(self, output, position):
+        """Returns the id of the output tuple, with aliased values replaced by
+        their canonical value, shifted for the iterable at position. The sum
+        of the ids of one output of each iterable is the fingerprint of a
+        copy of a template."""
+        aliases = self.aliases
+        if aliases:
+            output = tuple(aliases.get(value, value) for value in output)
+        output_id = self.output_ids.setdefault(output, len(self.output_ids))
+        if output_id >> _ID_BITS:
+            raise OverflowError('Too many different outputs to fingerprint')
+        return output_id << (_ID_BITS * position)
+
+    def get_fingerprint(self, outputs):
+        return sum(
+            self.get_output_id(output, position)
+            for position, output in enumerate(outputs))
+
+    def drop(self, label, iter_group, first, outputs, output_lists=None):
+        """Records the copy of the template of iter_group with outputs as
+        dropped, as a repeat of the instantiation emitted at first. If
+        output_lists are given, outputs holds the index of the output in each
+        list instead, so no tuple of outputs is made until it is reported."""
+        self.dropped.append((label, iter_group, first, outputs, output_lists))
+
+    def report(self):
+        """Returns a list of a DroppedInstantiation for each dropped copy, in
+        the order they were dropped, holding where it was dropped from, its
+        binding of keys to values and where the same instantiation was first
+        emitted"""
+        report = []
+        for label, iter_group, first, outputs, output_lists in self.dropped:
+            if output_lists is not None:
+                outputs = tuple(output_list[index] for output_list, index in
+                                zip(output_lists, outputs))
+            report.append(
+                DroppedInstantiation(
+                    label, iter_group.insertion_point,
+                    merge_substitutions(get_insertion_iterables(iter_group),
+                                        outputs), first[0], first[1]))
+        return report
+
+    def write_report(self, stream=None):
+        """Writes a line for each dropped copy to stream, stdout by default.
+        Returns the number of dropped copies."""
+        if stream is None:
+            stream = sys.stdout
+        for dropped in self.report():
+            binding = ', '.join(key + '=' + value
+                                for key, value in dropped.binding.items())
+            stream.write('dropped: ' + _describe(dropped.label,
+                                                 dropped.insertion_point) +
+                         ' (' + binding + '), first emitted at ' +
+                         _describe(dropped.first_label,
+                                   dropped.first_insertion_point) + '\n')
+        return len(self.dropped)
+
+
+def _describe(label, insertion_point):
+    if label is None:
+        return insertion_point
+    return label + ' ' + insertion_point
+
+
+def compile_template(template, iterables):
+    """Returns a list of the literal parts of template and, between them, a
+    tuple of each key it substitutes, the text of the key and the positions of
+    the iterables which may bind it, earliest first"""
+    parts = []
+    position = 0
+    text = template.template
+    for match in template.pattern.finditer(text):
+        parts.append(text[position:match.start()])
+        key = match.group('named') or match.group('braced')
+        parts.append((key, match.group(), [
+            index for index, iterable in enumerate(iterables)
+            if key == iterable.key or (iterable.bind_elements
+                                       and key.startswith(iterable.key + '_'))
+        ]))
+        position = match.end()
+    parts.append(text[position:])
+    return parts
+
+
+def render_row(parts, substitutions, indexes):
+    """Returns the copy of the compiled template with the substitutions of the
+    output at each of indexes of its iterable"""
+    pieces = [parts[0]]
+    for position in range(1, len(parts), 2):
+        key, original, candidates = parts[position]
+        value = original
+        for index in candidates:
+            value = substitutions[index][indexes[index]].get(key)
+            if value is not None:
+                break
+            value = original
+        pieces.append(value)
+        pieces.append(parts[position + 1])
+    return ''.join(pieces)
+
+
+def compile_format(parts, substitutions, derived=()):
+    """Returns a tuple of a format string for the compiled template and a
+    list of (iterable position, values) for each of its fields, where values
+    holds the value substituted at the field for each output of the iterable.
+    A field at one of the keys in derived, the derived keys of the group,
+    which no iterable binds is given as (None, key) instead, as its value
+    depends on the whole copy.
+    Returns None if a key is bound by different iterables for different
+    outputs, as then no single iterable gives its value."""
+    format_string = parts[0].replace('{', '{{').replace('}', '}}')
+    fields = []
+    for position in range(1, len(parts), 2):
+        key, original, candidates = parts[position]
+        literal = original
+        for index in candidates:
+            values = [output.get(key) for output in substitutions[index]]
+            if all(value is not None for value in values):
+                fields.append((index, values))
+                literal = None
+                break
+            if any(value is not None for value in values):
+                return None
+        if literal is not None and key in derived:
+            fields.append((None, key))
+            literal = None
+        if literal is None:
+            format_string += '{}'
+        else:
+            format_string += literal.replace('{', '{{').replace('}', '}}')
+        format_string += parts[position + 1].replace('{', '{{').replace(
+            '}', '}}')
+    return format_string, fields
+
+
+def expand_uncombined(iter_group, registry, label):
+    """Generates the string for an uncombined iter_group as
+    expand_iter_group_dedup does, rendering each copy from the substitutions
+    of each output, which are made once. Returns None if the copies can't be
+    substituted separately or the group has derived keys or segments."""
+    template = iter_group.template
+    if iter_group.derived_keys or iter_group.segments:
+        return None
+    output_lists = get_output_lists(iter_group)
+    if not is_splittable(template) or any(
+            template.delimiter in value for outputs in output_lists
+            for output in outputs for value in output):
+        return None
+    iterables = get_insertion_iterables(iter_group)
+    emitted = registry.get_emitted(iter_group)
+    location = (label, iter_group.insertion_point)
+    parts = compile_template(template, iterables)
+    substitutions = [[get_substitutions(iterable, output) for output in outputs]
+                     for iterable, outputs in zip(iterables, output_lists)]
+    # Products of the output indexes and ids, with the first iterable varying
+    # fastest as by dispatch_iterations
+    indexes = product(
+        *[range(len(outputs)) for outputs in reversed(output_lists)])
+    ids = product(*[[
+        registry.get_output_id(output, position) for output in outputs
+    ] for position, outputs in reversed(list(enumerate(output_lists)))])
+    compiled = compile_format(parts, substitutions)
+    if compiled is None:
+        render = lambda row: render_row(parts, substitutions, row)
+    else:
+        format_string, fields = compiled
+        render = lambda row: format_string.format(
+            *[values[row[index]] for index, values in fields])
+    generated = []
+    for row, row_ids in zip(indexes, ids):
+        fingerprint = sum(row_ids)
+        first = emitted.get(fingerprint)
+        row = row[::-1]
+        if first is None:
+            emitted[fingerprint] = location
+            generated.append(render(row))
+        else:
+            registry.drop(label, iter_group, first, row, output_lists)
+    return ''.join(generated)
+
+
+def _bind(iterables, outputs, derive):
+    """Returns the dict of keys and values bound by outputs, including the
+    values of any derived keys"""
+    substitutions = merge_substitutions(iterables, outputs)
+    if derive is not None:
+        substitutions.update(derive(substitutions))
+    return substitutions
+
+
+def expand_iter_group_dedup(iter_group, registry, label=None):
+    """Generates the string for iter_group as expand_iter_group does, leaving
+    out the copies of its template which registry has already emitted. label
+    identifies the generation, such as the output file, in the report of
+    registry. Where the copies can't be substituted separately, such as those
+    of a combined group which aren't separable, as by is_separable, every
+    copy is generated and recorded as emitted. Copies of groups with derived
+    keys or segments are rendered a copy at a time."""
+    template = iter_group.template
+    iterables = get_insertion_iterables(iter_group)
+    if (not iter_group.combine_iters
+            and iter_group.emit_mode is EmitMode.expanded):
+        generated = expand_uncombined(iter_group, registry, label)
+        if generated is not None:
+            return generated
+    emitted = registry.get_emitted(iter_group)
+    location = (label, iter_group.insertion_point)
+    if iter_group.emit_mode is EmitMode.expanded and (
+            not (iter_group.combine_iters or iter_group.derived_keys
+                 or iter_group.segments) or not is_separable(iter_group)):
+        for outputs, kept in iterate_rows(iter_group):
+            if kept:
+                emitted.setdefault(registry.get_fingerprint(outputs),
+                                   location)
+        return expand_iter_group(iter_group)
+    kept_outputs = []
+    kept = False
+    for outputs, kept in iterate_rows(iter_group):
+        if not kept:
+            continue
+        fingerprint = registry.get_fingerprint(outputs)
+        first = emitted.get(fingerprint)
+        if first is None:
+            emitted[fingerprint] = location
+            kept_outputs.append(outputs)
+        else:
+            registry.drop(label, iter_group, first, outputs)
+    if iter_group.emit_mode is EmitMode.xmacro:
+        derive = get_derive(iter_group)
+        return emit_xmacro(template, iter_group.table_name,
+                           (_bind(iterables, outputs, derive)
+                            for outputs in kept_outputs))
+    render = get_render(iter_group)
+    generated = [render(outputs) for outputs in kept_outputs]
+    # Combined groups end with the unsubstituted template when the last
+    # combination is removed or there are none, as by the dispatchers
+    if iter_group.combine_iters and not kept:
+        generated.append(template.template)
+    return ''.join(generated)
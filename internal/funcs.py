@@ -15,7 +15,25 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import hashlib
+import mmap
+import os
+import re
 import subprocess
+from contextlib import contextmanager
+
+# Bytes which str.splitlines treats as line breaks and which can't occur inside
+# a multi-byte UTF-8 character
+_LINE_BREAK_BYTES = [b'\n', b'\r', b'\x0b', b'\x0c', b'\x1c', b'\x1d', b'\x1e']
+_LINE_BREAK = re.compile(b'[\n\r\x0b\x0c\x1c\x1d\x1e]')
+
+# Largest number of buffers passed to a single os.writev call
+try:
+    _IOV_MAX = os.sysconf('SC_IOV_MAX')
+except (AttributeError, ValueError, OSError):
+    _IOV_MAX = 1024
+if _IOV_MAX <= 0:
+    _IOV_MAX = 1024
 
 
 def get_space_count(line):
@@ -62,6 +80,17 @@ def write_to_file(file_name, file_source):
         output_file.write(file_source)
 
 
+def make_dirs(directory):
+    """Creates directory if it doesn't exist, allowing for another process
+    creating it at the same time"""
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+
+
 def clang_format(file_name, clang_format_script):
     """Calls the input clang formatting script in a subprocess shell call.
     Provides the input filename as the only arguement to the script."""
@@ -71,3 +100,156 @@ def clang_format(file_name, clang_format_script):
     except subprocess.CalledProcessError as cperror:
         print("Call to " + clang_format_script + " failed")
         print("Exit code: " + str(cperror.returncode))
+
+
+@contextmanager
+def map_file(file_name):
+    """Memory maps file_name read only. Yields the mapped buffer, or an empty
+    bytes object for an empty file as those can't be mapped."""
+    with open(file_name, 'rb') as input_file:
+        if os.fstat(input_file.fileno()).st_size == 0:
+            yield b''
+            return
+        mapped = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped
+        finally:
+            mapped.close()
+
+
+def find_all(buffer, sub):
+    """Returns the offsets of each occurrence of the non-empty bytes sub in
+    buffer, scanning left to right without overlaps as str.replace does"""
+    offsets = []
+    offset = buffer.find(sub)
+    while offset != -1:
+        offsets.append(offset)
+        offset = buffer.find(sub, offset + len(sub))
+    return offsets
+
+
+def get_line_bounds(buffer, offset):
+    """Returns the start and end offsets of the line in buffer containing
+    offset, not including the line break. Only looks at as much of the buffer
+    as is needed to find the surrounding line breaks."""
+    start = offset
+    window = 256
+    while start > 0:
+        low = max(0, start - window)
+        chunk = buffer[low:start]
+        last_break = max(chunk.rfind(line_break)
+                         for line_break in _LINE_BREAK_BYTES)
+        if last_break != -1:
+            start = low + last_break + 1
+            break
+        start = low
+        window *= 2
+    match = _LINE_BREAK.search(buffer, offset)
+    end = match.start() if match else len(buffer)
+    return start, end
+
+
+def write_vectored(file_name, buffers):
+    """Discard writes the concatenation of the bytes-like objects in buffers to
+    file_name without joining them first. Uses os.writev where available, and
+    falls back to one write per buffer otherwise."""
+    with open(file_name, 'wb') as output_file:
+        if not hasattr(os, 'writev'):
+            for buffer in buffers:
+                output_file.write(buffer)
+            return
+        fd = output_file.fileno()
+        pending = [memoryview(buffer) for buffer in buffers if len(buffer)]
+        index = 0
+        while index < len(pending):
+            written = os.writev(fd, pending[index:index + _IOV_MAX])
+            # Skip past fully written buffers and trim a partially written one
+            while written:
+                size = pending[index].nbytes
+                if written >= size:
+                    written -= size
+                    index += 1
+                else:
+                    pending[index] = pending[index].cast('B')[written:]
+                    written = 0
+
+
+def splice_in_buffer(buffer, insertions):
+    """Bytes version of calling insert_in_source on buffer for each
+    (insertion_point, replacement_string) pair in insertions, in order.
+    Returns a list of slices of buffer interleaved with the indented and UTF-8
+    encoded replacement strings, whose concatenation is the result, so the
+    unchanged parts of buffer are never copied.
+    Returns None if the insertions can't be made independently of each other,
+    which is the case if an insertion point overlaps another or contains a line
+    break, if an earlier replacement would change the line an insertion point
+    is indented from, or if a replacement would create a later insertion
+    point."""
+    points = [insertion_point.encode('utf-8')
+              for insertion_point, _ in insertions]
+    # Replaced regions as tuples of (start, end, replacement, insertion index)
+    regions = []
+    for index, (_, replacement_string) in enumerate(insertions):
+        point = points[index]
+        if not point or _LINE_BREAK.search(point):
+            return None
+        offsets = find_all(buffer, point)
+        for offset in offsets:
+            if any(start < offset + len(point) and offset < end
+                   for start, end, _, _ in regions):
+                return None
+        # Get the indentation of the last line containing the insertion point
+        space_count = 0
+        if offsets:
+            line_start, line_end = get_line_bounds(buffer, offsets[-1])
+            if any(start < line_end and line_start < end
+                   for start, end, _, _ in regions):
+                return None
+            try:
+                line = buffer[line_start:line_end].decode('utf-8')
+            except UnicodeDecodeError:
+                return None
+            if len(line.splitlines()) > 1:
+                return None
+            space_count = get_space_count(line)
+        replacement = add_spaces_to_lines(space_count,
+                                          replacement_string).encode('utf-8')
+        regions.extend((offset, offset + len(point), replacement, index)
+                       for offset in offsets)
+    # Check no replacement contains or borders on text forming a later
+    # insertion point
+    for start, end, replacement, index in regions:
+        for point in points[index + 1:]:
+            overlap = len(point) - 1
+            if point in replacement:
+                return None
+            if not overlap:
+                continue
+            before = buffer[max(0, start - overlap):start]
+            after = buffer[end:end + overlap]
+            if (point in before + replacement[:overlap]
+                    or point in replacement[-overlap:] + after):
+                return None
+    regions.sort()
+    # Only export the buffer once nothing can raise, so a failed insertion
+    # doesn't leave a mapped input unable to close
+    view = memoryview(buffer)
+    buffers = []
+    position = 0
+    for start, end, replacement, _ in regions:
+        buffers.append(view[position:start])
+        buffers.append(replacement)
+        position = end
+    buffers.append(view[position:])
+    return buffers
+
+
+def hash_generation(source, iter_groups, *options):
+    """Returns a hex digest identifying the generation of source with
+    iter_groups and any further options affecting the output. Unlike hash(),
+    the digest is stable between processes."""
+    digest = hashlib.sha1(source.encode('utf-8'))
+    for iter_group in iter_groups:
+        digest.update(iter_group.spec_hash().encode('utf-8'))
+    digest.update(repr(options).encode('utf-8'))
+    return digest.hexdigest()
@@ -0,0 +1,151 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import re
+from collections import namedtuple
+from .funcs import add_spaces_to_lines, get_space_count
+from .iters import expand_iter_group
+
+# Guarded regions keep generated code in the output file between a begin and an
+# end marker comment. The begin marker records the insertion point and the
+# spec_hash of the IterGroup that generated the region, so a region only has to
+# be generated again when its IterGroup changes.
+
+GuardedRegion = namedtuple(
+    'GuardedRegion', ['start', 'end', 'indent', 'insertion_point', 'spec_hash'])
+
+
+def begin_marker(comment, insertion_point, spec_hash):
+    """Returns the marker line starting a guarded region, without indentation"""
+    return comment + ' py_gen begin ' + insertion_point + ' ' + spec_hash
+
+
+def end_marker(comment, insertion_point):
+    """Returns the marker line ending a guarded region, without indentation"""
+    return comment + ' py_gen end ' + insertion_point
+
+
+def guard_block(comment, indent, iter_group, generated):
+    """Returns the guarded region for iter_group holding the generated string.
+    The first line is not indented, as it replaces text which already is."""
+    body = ''
+    if generated:
+        body = indent + add_spaces_to_lines(len(indent), generated)
+        if not body.endswith('\n'):
+            body += '\n'
+    return (begin_marker(comment, iter_group.insertion_point,
+                         iter_group.spec_hash()) + '\n' + body + indent +
+            end_marker(comment, iter_group.insertion_point))
+
+
+def find_guarded_regions(source, comment):
+    """Returns a GuardedRegion for each guarded region in source. The start and
+    end of each region exclude the indentation of the begin marker and the line
+    break after the end marker."""
+    begin = re.compile(
+        r'^(?P<indent>[ \t]*)' + re.escape(comment) +
+        r' py_gen begin (?P<point>.+) (?P<hash>[0-9a-f]{40})[ \t]*$',
+        re.MULTILINE)
+    regions = []
+    position = 0
+    while True:
+        match = begin.search(source, position)
+        if not match:
+            return regions
+        point = match.group('point')
+        end = re.compile(r'^[ \t]*' + re.escape(end_marker(comment, point)) +
+                         r'[ \t]*$', re.MULTILINE).search(source, match.end())
+        if not end:
+            raise ValueError('Guarded region for ' + point +
+                             ' has no end marker')
+        regions.append(
+            GuardedRegion(match.start() + len(match.group('indent')),
+                          end.end(), match.group('indent'), point,
+                          match.group('hash')))
+        position = end.end()
+
+
+def find_stale_regions(source, regions, iter_group):
+    """Returns a tuple of the guarded regions for the insertion point of
+    iter_group whose spec_hash doesn't match it, and the offsets of any of its
+    insertion points outside of a guarded region"""
+    insertion_point = iter_group.insertion_point
+    spec_hash = iter_group.spec_hash()
+    stale = [
+        region for region in regions
+        if region.insertion_point == insertion_point
+        and region.spec_hash != spec_hash
+    ]
+    unguarded = []
+    offset = source.find(insertion_point)
+    while insertion_point and offset != -1:
+        if not any(region.start <= offset < region.end for region in regions):
+            unguarded.append(offset)
+        offset = source.find(insertion_point, offset + len(insertion_point))
+    return stale, unguarded
+
+
+def find_stale_insertion_points(source, iter_groups, comment):
+    """Returns the insertion points of iter_groups which update_guarded_source
+    would generate again, without generating them"""
+    regions = find_guarded_regions(source, comment)
+    return [
+        iter_group.insertion_point for iter_group in iter_groups
+        if any(find_stale_regions(source, regions, iter_group))
+    ]
+
+
+def update_guarded_source(source, iter_groups, comment):
+    """Generates the guarded regions of source for each IterGroup in iter_groups.
+    Regions whose spec_hash matches their IterGroup are copied through without
+    being generated. Insertion points outside of any region, which must be the
+    only text on their line, are replaced by a new guarded region.
+    Returns the updated source."""
+    regions = find_guarded_regions(source, comment)
+    edits = []
+    for iter_group in iter_groups:
+        insertion_point = iter_group.insertion_point
+        stale, unguarded = find_stale_regions(source, regions, iter_group)
+        if not stale and not unguarded:
+            continue
+        generated = expand_iter_group(iter_group)
+        for region in stale:
+            edits.append((region.start, region.end,
+                          guard_block(comment, region.indent, iter_group,
+                                      generated)))
+        for offset in unguarded:
+            line_start = source.rfind('\n', 0, offset) + 1
+            line_end = source.find('\n', offset)
+            if line_end == -1:
+                line_end = len(source)
+            line = source[line_start:line_end]
+            if line.strip() != insertion_point:
+                raise ValueError('Insertion point ' + insertion_point +
+                                 ' must be the only text on its line')
+            indent = line[:get_space_count(line)]
+            edits.append((offset, offset + len(insertion_point),
+                          guard_block(comment, indent, iter_group,
+                                      generated)))
+    edits.sort()
+    pieces = []
+    position = 0
+    for start, end, replacement in edits:
+        pieces.append(source[position:start])
+        pieces.append(replacement)
+        position = end
+    pieces.append(source[position:])
+    return ''.join(pieces)
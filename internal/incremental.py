@@ -0,0 +1,234 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import hashlib
+import json
+import os
+from itertools import accumulate
+from ..iter_classes import EmitMode, stable_name
+from .iters import (expand_iter_group, get_insertion_iterables,
+                    get_output_lists, get_render)
+from .locking import write_file_atomic
+
+# Incremental generation keeps the generated string of an uncombined group in a
+# state file, along with the outputs of each insertion iterable and the length
+# of each row, a row being the template substituted with one output of each
+# iterable. The rows are generated in a grid with the first iterable varying
+# fastest, so when the group is generated again the rows whose outputs were
+# generated before are runs of the previous string, which are copied, and only
+# the rows using new outputs are substituted.
+# A row only depends on the template and on how each iterable binds its
+# outputs, so state files are named by a hash of those, and changes to vals,
+# Itermodes, iter_modifiers or removal iterables keep the state.
+
+
+def get_render_key(iter_group):
+    """Returns the parts of iter_group which its rows depend on, as a list
+    which is kept unchanged when stored as JSON. Derived keys and segments are
+    identified by the qualified name of their function, as by their
+    spec_hash, so a ValueError is raised for lambdas and nested functions."""
+    render_key = [
+        iter_group.template.template,
+        type(iter_group.template).__name__,
+        [[iterable.key, iterable.comma_list, iterable.bind_elements]
+         for iterable in get_insertion_iterables(iter_group)]
+    ]
+    if iter_group.derived_keys:
+        render_key.append([
+            [derived_key.key] +
+            list(stable_name(derived_key.func, 'Derived key function')) +
+            [list(derived_key.arg_keys)]
+            for derived_key in iter_group.derived_keys
+        ])
+    if iter_group.segments:
+        render_key.append([
+            [segment.key] + list(stable_name(segment.guard, 'Segment guard')) +
+            [list(segment.arg_keys), segment.segment, segment.otherwise]
+            for segment in iter_group.segments
+        ])
+    return render_key
+
+
+def is_splittable(template):
+    """Returns whether the generation of template can be split into rows
+    substituted independently. This is not the case if the template has
+    escaped or invalid delimiters, which can form new keys between the
+    repeated substitutions of dispatch_iterations."""
+    return all(
+        match.group('named') or match.group('braced')
+        for match in template.pattern.finditer(template.template))
+
+
+class GroupState(object):
+    """The generated string of a group, the outputs of each insertion iterable
+    it was generated from, and the length of each of its rows"""
+
+    def __init__(self, output_lists, generated, lengths):
+        self.output_lists = output_lists
+        self.generated = generated
+        self.lengths = lengths
+
+    def is_consistent(self):
+        """Returns whether the lengths match the output lists and string"""
+        rows = 1
+        for outputs in self.output_lists:
+            rows *= len(outputs)
+        return (len(self.lengths) == rows
+                and sum(self.lengths) == len(self.generated))
+
+
+def expand_rows(iter_group, state):
+    """Generates the string for an uncombined iter_group, copying the rows
+    generated before from state, a GroupState or None.
+    Returns a tuple of the new GroupState and the number of rows substituted,
+    or None if the group can't be generated by rows."""
+    template = iter_group.template
+    if (iter_group.emit_mode is not EmitMode.expanded
+            or iter_group.combine_iters or not is_splittable(template)):
+        return None
+    iterables = get_insertion_iterables(iter_group)
+    render = get_render(iter_group)
+    output_lists = [[tuple(output) for output in outputs]
+                    for outputs in get_output_lists(iter_group)]
+    if any(template.delimiter in value for outputs in output_lists
+           for output in outputs for value in output):
+        return None
+    if state is not None and (
+            len(state.output_lists) != len(output_lists)
+            or not state.is_consistent()):
+        state = None
+    if state is None:
+        state = GroupState([[] for _ in output_lists], '', [])
+    offsets = [0] + list(accumulate(state.lengths))
+    # Old row strides and output indexes of each iterable, and whether the
+    # outputs of every iterable before it are unchanged
+    strides = [1]
+    for outputs in state.output_lists:
+        strides.append(strides[-1] * len(outputs))
+    indexes = [
+        dict((output, index) for index, output in enumerate(outputs))
+        for outputs in state.output_lists
+    ]
+    unchanged_before = [True]
+    for outputs, old_outputs in zip(output_lists, state.output_lists):
+        unchanged_before.append(unchanged_before[-1]
+                                and outputs == old_outputs)
+    pieces = []
+    lengths = []
+    # The pending run of old rows to copy, and the number of rows substituted
+    run = [0, 0]
+    substituted = [0]
+
+    def flush():
+        start, end = run
+        if start != end:
+            pieces.append(state.generated[offsets[start]:offsets[end]])
+            lengths.extend(state.lengths[start:end])
+        run[0] = run[1] = 0
+
+    def copy(start, end):
+        if run[0] == run[1] or run[1] != start:
+            flush()
+            run[0] = start
+        run[1] = end
+
+    def emit(level, base, outputs):
+        """Generates the rows for each output of the iterables before level,
+        with outputs holding the outputs of the iterables from level on. base
+        is the first old row with those outputs, or None if there is none."""
+        if level == 0:
+            if base is not None:
+                copy(base, base + 1)
+                return
+            flush()
+            row = render(outputs)
+            pieces.append(row)
+            lengths.append(len(row))
+            substituted[0] += 1
+            return
+        index = level - 1
+        for output in output_lists[index]:
+            outputs[index] = output
+            old_index = None
+            if base is not None:
+                old_index = indexes[index].get(output)
+            if old_index is None:
+                emit(index, None, outputs)
+                continue
+            start = base + old_index * strides[index]
+            if unchanged_before[index]:
+                copy(start, start + strides[index])
+            else:
+                emit(index, start, outputs)
+
+    emit(len(output_lists), 0 if state.lengths else None,
+         [None] * len(output_lists))
+    flush()
+    return GroupState(output_lists, ''.join(pieces), lengths), substituted[0]
+
+
+def get_state_file_name(state_dir, render_key):
+    """Returns the name of the state file for groups with render_key"""
+    digest = hashlib.sha1(json.dumps(render_key).encode('utf-8')).hexdigest()
+    return os.path.join(state_dir, digest + '.state')
+
+
+def read_state(file_name, render_key):
+    """Returns the GroupState kept in the state file file_name, or None if
+    there is no state file or it was written for another render_key"""
+    try:
+        with open(file_name, 'r', newline='') as state_file:
+            header = json.loads(state_file.readline())
+            if header['render_key'] != render_key:
+                return None
+            return GroupState([[tuple(output) for output in outputs]
+                               for outputs in header['output_lists']],
+                              state_file.read(), header['lengths'])
+    except (OSError, IOError, ValueError, KeyError, TypeError):
+        return None
+
+
+def write_state(file_name, render_key, state):
+    """Replaces the state file file_name with render_key and the GroupState
+    state. The file is a line of JSON followed by the generated string, so the
+    string doesn't have to be escaped. Line breaks are written and read
+    untranslated, so carriage returns in the string are kept."""
+    header = json.dumps({
+        'render_key': render_key,
+        'output_lists': state.output_lists,
+        'lengths': state.lengths
+    })
+    write_file_atomic(file_name, header + '\n' + state.generated,
+                      newline='')
+
+
+def expand_iter_group_incremental(iter_group, state_dir):
+    """Generates the string for iter_group as expand_iter_group, substituting
+    only the rows not generated before by a group with the same template and
+    keys, as kept in state_dir, and keeping the state of this generation.
+    Combined groups, and groups which can't be split into rows, are generated
+    in full. Returns the generated string."""
+    render_key = get_render_key(iter_group)
+    file_name = get_state_file_name(state_dir, render_key)
+    previous = read_state(file_name, render_key)
+    expanded = expand_rows(iter_group, previous)
+    if expanded is None:
+        return expand_iter_group(iter_group)
+    state, _ = expanded
+    if previous is None or state.output_lists != previous.output_lists:
+        write_state(file_name, render_key, state)
+    return state.generated
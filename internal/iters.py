@@ -15,177 +15,388 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+from functools import lru_cache
 from itertools import (combinations, combinations_with_replacement,
                        permutations, product)
 from string import Template
-from ..iter_classes import Itermode, Iterable
+from ..iter_classes import BindingForm, EmitMode, IterGroup, LengthPolicy
+from .modes import count_outputs, get_vals, iterate_outputs
+from .tables import emit_xmacro
+
+# Slot of the joined output of an iterable, see get_slot
+_JOINED = -1
 
 # Each gen function calls the method safe_substitute on the input template with
-# each result of the combinatoric generator method. The combinatoric generators
-# are methods provided by python for generating combinations, permutations and
-# products of a set of values. The results of the calls to safe_substitute are
-# appended in order to a string, which is returned as a new template.
+# each output of an Iterable. The outputs are generated by the functions
+# registered for the Itermode of the Iterable in modes.py, which for the
+# original Itermodes are the combinatoric generators provided by python for
+# generating combinations, permutations and products of a set of values. The
+# results of the calls to safe_substitute are appended in order to a string,
+# which is returned as a new template. Rather than calling safe_substitute for
+# every output, the template is split once into its literal text and the slots
+# of the keys the iterable binds, and each copy only replaces the slots whose
+# values changed since the previous output, see render_slots.
+# Groups with derived keys or conditional segments are generated a copy of the
+# template at a time, as the values of a derived key, and the text chosen for a
+# segment, depend on the outputs of several iterables. The text of each segment
+# is chosen first, then each copy is substituted with each iterable in turn, as
+# by substitute_combined, then with the derived keys.
+# Combined groups without derived keys or segments substitute each combination
+# into all the text generated so far, so a value holding the delimiter, such
+# as '$$' or '${key}', can be substituted again by later combinations. Text
+# which no later combination can change is set aside as soon as it is
+# generated, see iterate_accumulated, so a combination is normally only
+# substituted into its own copy of the template.
+
+
+def join_output(iterable, output):
+    """Joins one output tuple of iterable into the string inserted at its key"""
+    if iterable.comma_list:
+        return ', '.join(output)
+    return ''.join(output)
+
+
+def get_substitutions(iterable, output):
+    """Returns the dict of keys and values to substitute into a template for
+    one output tuple of iterable. This is the joined output at iterable.key
+    and, if iterable.bind_elements is set, each element of the output at
+    iterable.key_0, iterable.key_1 and so on."""
+    substitutions = {iterable.key: join_output(iterable, output)}
+    if iterable.bind_elements:
+        key = iterable.key + '_'
+        for index, element in enumerate(output):
+            substitutions[key + str(index)] = element
+    return substitutions
+
+
+def get_slot(iterable, key):
+    """Returns the slot of the output of iterable substituted at key, which is
+    the index of the element for an element key, _JOINED for the key of the
+    joined output, or None if iterable doesn't bind key"""
+    if key == iterable.key:
+        return _JOINED
+    if not iterable.bind_elements or not key.startswith(iterable.key + '_'):
+        return None
+    index = key[len(iterable.key) + 1:]
+    if index and all(digit in '0123456789' for digit in index):
+        if str(int(index)) == index:
+            return int(index)
+    return None
+
+
+def compile_slots(template, iterable):
+    """Returns a list of the literal parts of template and, between them, a
+    tuple of the slot, as by get_slot, and the text of each key of template
+    which iterable binds. The literal parts are the text safe_substitute
+    leaves unchanged, with escaped delimiters replaced and the keys iterable
+    doesn't bind kept."""
+    parts = []
+    literal = []
+    position = 0
+    text = template.template
+    for match in template.pattern.finditer(text):
+        literal.append(text[position:match.start()])
+        position = match.end()
+        key = match.group('named') or match.group('braced')
+        slot = None
+        if key is not None:
+            slot = get_slot(iterable, key)
+        if slot is not None:
+            parts.append(''.join(literal))
+            parts.append((slot, match.group()))
+            literal = []
+        elif match.group('escaped') is not None:
+            literal.append(template.delimiter)
+        else:
+            literal.append(match.group())
+    literal.append(text[position:])
+    parts.append(''.join(literal))
+    return parts
+
+
+def render_slots(parts, iterable, outputs):
+    """Yields the template compiled by compile_slots substituted with each
+    output tuple of outputs, as by safe_substitute with get_substitutions.
+    Only the slots whose elements changed since the previous output are
+    replaced, and the text before the first of them is reused from the
+    previous copy. Consecutive outputs of the built in Itermodes mostly differ
+    in their last elements, and those of grayProduct in a single element, so
+    most of each copy is unchanged."""
+    pieces = [
+        part[1] if position % 2 else part
+        for position, part in enumerate(parts)
+    ]
+    slot_positions = {}
+    for position in range(1, len(parts), 2):
+        slot_positions.setdefault(parts[position][0], []).append(position)
+    joined_positions = slot_positions.pop(_JOINED, [])
+    end = len(pieces)
+    # head is the joined pieces before head_end
+    head = ''
+    head_end = 0
+    previous = None
+    for output in outputs:
+        if previous is not None and len(output) == len(previous):
+            changed = [
+                index for index, element in enumerate(output)
+                if element != previous[index]
+            ]
+        else:
+            # Keys of elements missing from output are left unsubstituted
+            changed = range(max(len(output), len(previous or ())))
+            previous = None
+        first = end
+        for index in changed:
+            positions = slot_positions.get(index)
+            if positions is None:
+                continue
+            first = min(first, positions[0])
+            for position in positions:
+                if index < len(output):
+                    pieces[position] = output[index]
+                else:
+                    pieces[position] = parts[position][1]
+        if joined_positions and (changed or previous is None):
+            first = min(first, joined_positions[0])
+            joined = join_output(iterable, output)
+            for position in joined_positions:
+                pieces[position] = joined
+        if first < head_end:
+            head = ''.join(pieces[:first])
+            head_end = first
+        elif first > head_end:
+            head += ''.join(pieces[head_end:first])
+            head_end = first
+        yield head + ''.join(pieces[head_end:])
+        previous = output
+
+
+def substitute_outputs(template, iterable, outputs):
+    """Inserts each output tuple of iterable in outputs into the template. The
+    result is returned as a new string Template."""
+    parts = compile_slots(template, iterable)
+    return Template(''.join(render_slots(parts, iterable, outputs)))
+
+
+def gen_iterable(template, iterable):
+    """Generates the outputs of the given iterable for its Itermode and inserts
+    them in the template. The result is returned as a new string Template."""
+    return substitute_outputs(template, iterable, iterate_outputs(iterable))
 
 
 def gen_combinations(template, iterable):
     """Generates combinations based on the given iterable and inserts them in
     the template. The result is returned as a new string Template."""
-    result_str = ''
-    key = iterable.key
-    for comb in combinations(iterable.vals, r=iterable.iter_modifier):
-        if iterable.comma_list:
-            comb = ', '.join(comb)
-        else:
-            comb = ''.join(comb)
-        result_str += template.safe_substitute(**{key: comb})
-    return Template(result_str)
+    return substitute_outputs(
+        template, iterable, combinations(
+            get_vals(iterable), r=iterable.iter_modifier))
 
 
 def gen_combinations_with_replacement(template, iterable):
     """Generates combinations with replacement based on the given iterable and
     inserts them in the template. The result is returned as a new string
     Template."""
-    result_str = ''
-    key = iterable.key
-    for combWR in combinations_with_replacement(
-            iterable.vals, r=iterable.iter_modifier):
-        if iterable.comma_list:
-            combWR = ', '.join(combWR)
-        else:
-            combWR = ''.join(combWR)
-        result_str += template.safe_substitute(**{key: combWR})
-    return Template(result_str)
+    return substitute_outputs(
+        template, iterable,
+        combinations_with_replacement(
+            get_vals(iterable), r=iterable.iter_modifier))
 
 
 def gen_permutations(template, iterable):
     """Generates permutations based on the given iterable and inserts them in
     the template. The result is returned as a new string Template."""
-    result_str = ''
-    key = iterable.key
-    for perm in permutations(iterable.vals, r=iterable.iter_modifier):
-        if iterable.comma_list:
-            perm = ', '.join(perm)
-        else:
-            perm = ''.join(perm)
-        result_str += template.safe_substitute(**{key: perm})
-    return Template(result_str)
+    return substitute_outputs(
+        template, iterable, permutations(
+            get_vals(iterable), r=iterable.iter_modifier))
 
 
 def gen_product(template, iterable):
     """Generates products based on the given iterable and inserts them in the
     template. The result is returned as a new string Template."""
-    result_str = ''
-    key = iterable.key
-    for prod in product(iterable.vals, repeat=iterable.iter_modifier):
-        if iterable.comma_list:
-            prod = ', '.join(prod)
-        else:
-            prod = ''.join(prod)
-        result_str += template.safe_substitute(**{key: prod})
-    return Template(result_str)
+    return substitute_outputs(
+        template, iterable, product(
+            get_vals(iterable), repeat=iterable.iter_modifier))
 
 
 def dispatch_iterations(template, iterables):
-    """Iterates through the input list of iterables in order, checking the
-    Itermode of each iterable and dispatching the template and iterable to the
-    correct gen method. The generated template is used as the template for the
-    next iteration, and so on. Once all iterables have been used the resulting
+    """Iterates through the input list of iterables in order, generating the
+    outputs of each iterable for its Itermode and inserting them in the
+    template. The generated template is used as the template for the next
+    iteration, and so on. Once all iterables have been used the resulting
     template is returned."""
     result_template = template
-    # Iterate over each iterable in
     for iterable in iterables:
-        iterT = iterable.itermode
-        # Check the Itermode of the iterable and dispatch the correct call
-        if iterT is Itermode.combinations:
-            result_template = gen_combinations(result_template, iterable)
-        elif iterT is Itermode.combinationsWR:
-            result_template = gen_combinations_with_replacement(
-                result_template, iterable)
-        elif iterT is Itermode.permutations:
-            result_template = gen_permutations(result_template, iterable)
-        elif iterT is Itermode.product:
-            result_template = gen_product(result_template, iterable)
-        else:
-            print('Dispatch for Itermode ' + iterT + ' is not supported')
+        result_template = gen_iterable(result_template, iterable)
     return result_template
 
 
+def join_outputs(iterable, outputs):
+    """Builds and returns tuple of the input iterables key, and a list of each
+    output tuple in outputs joined into a string."""
+    return (iterable.key, [join_output(iterable, output) for output in outputs])
+
+
+def gen_iterable_list(iterable):
+    """Builds and returns tuple of the input iterables key, and a list of all
+    the outputs generated by the iterable for its Itermode."""
+    return join_outputs(iterable, iterate_outputs(iterable))
+
+
 def gen_combinations_list(iterable):
     """Builds and returns tuple of the input iterables key, and a list of all
     the combinations generated by the iterable."""
-    comb_list = []
-    for comb in combinations(iterable.vals, r=iterable.iter_modifier):
-        if iterable.comma_list:
-            comb_list.append(', '.join(comb))
-        else:
-            comb_list.append(''.join(comb))
-    return (iterable.key, comb_list)
+    return join_outputs(
+        iterable, combinations(get_vals(iterable), r=iterable.iter_modifier))
 
 
 def gen_combinations_with_replacement_list(iterable):
     """Builds and returns tuple of the input iterables key, and a list of all
     the combinations with replacement generated by the iterable."""
-    combWR_list = []
-    for combWR in combinations_with_replacement(
-            iterable.vals, r=iterable.iter_modifier):
-        if iterable.comma_list:
-            combWR_list.append(', '.join(combWR))
-        else:
-            combWR_list.append(''.join(combWR))
-    return (iterable.key, combWR_list)
+    return join_outputs(
+        iterable,
+        combinations_with_replacement(
+            get_vals(iterable), r=iterable.iter_modifier))
 
 
 def gen_permutations_list(iterable):
     """Builds and returns tuple of the input iterables key, and a list of all
     the permutations generated by the iterable."""
-    perm_list = []
-    for perm in permutations(iterable.vals, r=iterable.iter_modifier):
-        if iterable.comma_list:
-            perm_list.append(', '.join(perm))
-        else:
-            perm_list.append(''.join(perm))
-    return (iterable.key, perm_list)
+    return join_outputs(
+        iterable, permutations(get_vals(iterable), r=iterable.iter_modifier))
 
 
 def gen_product_list(iterable):
     """Builds and returns tuple of the input iterables key, and a list of all
     the products generated by the iterable."""
-    prod_list = []
-    for prod in product(iterable.vals, repeat=iterable.iter_modifier):
-        if iterable.comma_list:
-            prod_list.append(', '.join(prod))
-        else:
-            prod_list.append(''.join(prod))
-    return (iterable.key, prod_list)
+    return join_outputs(
+        iterable, product(get_vals(iterable), repeat=iterable.iter_modifier))
 
 
-def combined_dispatcher(template, iterables):
-    """Iterates through the input list of iterables, collecting all of their
-    outputs in a list of tuples of form (iterable.key, [output1, output2,...]).
-    Then iterates over the output lists in parallel, substituting the first
-    result of each, then the second, and so on. Returns the resulting template.
-    """
-    iter_list = []
-    for iterable in iterables:
-        iterT = iterable.itermode
-        if iterT is Itermode.combinations:
-            iter_list.append(gen_combinations_list(iterable))
-        if iterT is Itermode.combinationsWR:
-            iter_list.append(gen_combinations_with_replacement_list(iterable))
-        if iterT is Itermode.permutations:
-            iter_list.append(gen_permutations_list(iterable))
-        if iterT is Itermode.product:
-            iter_list.append(gen_product_list(iterable))
-    template_str = template.template
+def cycle_outputs(iterable):
+    """Yields the outputs of iterable, restarting its generator each time it is
+    exhausted. iterable must produce at least one output."""
+    while True:
+        for output in iterate_outputs(iterable):
+            yield output
+
+
+def iterate_combined(iterables, length_policy=LengthPolicy.strict):
+    """Yields a tuple of the first output of each iterable, then the second
+    output of each iterable, and so on. The generators of the iterables are run
+    in parallel rather than stored, and how iterables producing different
+    numbers of outputs are handled is set by length_policy."""
+    if length_policy is LengthPolicy.cycle:
+        counts = [count_outputs(iterable) for iterable in iterables]
+        if not counts or min(counts) == 0:
+            return
+        generators = [cycle_outputs(iterable) for iterable in iterables]
+        for _ in range(max(counts)):
+            yield tuple(next(generator) for generator in generators)
+        return
+    generators = [iterate_outputs(iterable) for iterable in iterables]
+    exhausted = object()
+    while True:
+        outputs = tuple(next(generator, exhausted) for generator in generators)
+        if any(output is exhausted for output in outputs):
+            if (length_policy is LengthPolicy.strict
+                    and any(output is not exhausted for output in outputs)):
+                raise ValueError('Combined iterables produced different '
+                                 'numbers of outputs')
+            return
+        yield outputs
+
+
+def substitute_combined(template, iterables, outputs):
+    """Substitutes one output of each iterable into the template, an iterable
+    at a time. Returns the resulting string."""
     res = template
-    iter_count = len(iter_list[0][1])
-    for index in range(0, iter_count):
-        for iterable in iter_list:
-            res = Template(
-                res.safe_substitute(**{iterable[0]: iterable[1][index]}))
-        if index != iter_count - 1:
-            res = Template(res.template + template_str)
-    return res
+    for iterable, output in zip(iterables, outputs):
+        res = Template(res.safe_substitute(get_substitutions(iterable,
+                                                             output)))
+    return res.template
+
+
+def is_settled(text, iterables):
+    """Returns whether substituting outputs of iterables into text, as by
+    substitute_combined, leaves it unchanged, however much text is appended to
+    it first. This is the case when text holds no escaped delimiter, which
+    safe_substitute would unescape, no key bound by one of iterables, and no
+    delimiter appended text could make part of such a key."""
+    for match in Template.pattern.finditer(text):
+        if match.group('escaped') is not None:
+            return False
+        if match.group('invalid') is not None:
+            rest = text[match.start() + 1:]
+            if not rest or (rest.startswith('{') and '}' not in rest):
+                return False
+            continue
+        if match.group('named') is not None and match.end() == len(text):
+            return False
+        key = match.group('named') or match.group('braced')
+        if any(get_slot(iterable, key) is not None for iterable in iterables):
+            return False
+    return True
+
+
+def iterate_accumulated(template, iterables, rows):
+    """Yields the text generated by substituting combinations of outputs of
+    iterables into template, in consecutive pieces. rows yields a tuple of
+    (outputs, kept) for each combination, and those not kept are left out.
+    As originally, each kept combination is substituted into the whole text
+    generated so far, and a copy of the template is appended after it if any
+    combination follows, so values holding the delimiter can be substituted
+    again by later combinations. Text is yielded once is_settled, so a
+    combination is normally only substituted into its own copy of the
+    template. Yields nothing if there are no combinations."""
+    active = template.template
+    substituted = False
+    follows = False
+    for outputs, kept in rows:
+        if follows:
+            active += template.template
+            follows = False
+        if not kept:
+            continue
+        # The first combination is substituted into the input template, and
+        # later ones into the text generated so far
+        active = substitute_combined(
+            Template(active) if substituted else template, iterables, outputs)
+        substituted = True
+        follows = True
+        if is_settled(active, iterables):
+            yield active
+            active = ''
+    if substituted:
+        yield active
+
+
+def accumulate_combined(template, iterables, rows):
+    """Returns the template generated as by iterate_accumulated, or the input
+    template if there are no combinations"""
+    pieces = list(iterate_accumulated(template, iterables, rows))
+    if not pieces:
+        return template
+    return Template(''.join(pieces))
+
+
+def combined_dispatcher(template, iterables,
+                        length_policy=LengthPolicy.strict):
+    """Iterates over the outputs of the input list of iterables in parallel,
+    substituting the first result of each, then the second, and so on, as by
+    accumulate_combined. Only one output of each iterable is held at once.
+    Returns the resulting template, which is the unsubstituted input template
+    if there are no outputs."""
+    return accumulate_combined(
+        template, iterables,
+        ((outputs, True)
+         for outputs in iterate_combined(iterables, length_policy)))
+
+
+def get_removal_list(removal_iterables):
+    """Returns the set of joined outputs of removal_iterables"""
+    return set(
+        join_output(iterable, output) for iterable in removal_iterables
+        for output in iterate_outputs(iterable))
 
 
 def removal_dispatcher(template, in_iterables, removal_iterables):
@@ -195,102 +406,442 @@ def removal_dispatcher(template, in_iterables, removal_iterables):
     'removal_iterables'. Safe substitutes the output after removal into the
     template, one iterable at a time."""
     # Build the removal list
-    removal_list = []
-    for iterable in removal_iterables:
-        iterT = iterable.itermode
-        if iterT is Itermode.combinations:
-            for output in gen_combinations_list(iterable)[1]:
-                removal_list.append(output)
-        if iterT is Itermode.combinationsWR:
-            for output in gen_combinations_with_replacement_list(iterable)[1]:
-                removal_list.append(output)
-        if iterT is Itermode.permutations:
-            for output in gen_permutations_list(iterable)[1]:
-                removal_list.append(output)
-        if iterT is Itermode.product:
-            for output in gen_product_list(iterable)[1]:
-                removal_list.append(output)
+    removal_list = get_removal_list(removal_iterables)
     # Iterate over the in_iterables
     res = template
     res_str = template.template
     for iterable in in_iterables:
         res = Template(res_str)
-        output_list = []
-        iterT = iterable.itermode
-        if iterT is Itermode.combinations:
-            for output in gen_combinations_list(iterable)[1]:
-                output_list.append(output)
-        if iterT is Itermode.combinationsWR:
-            for output in gen_combinations_with_replacement_list(iterable)[1]:
-                output_list.append(output)
-        if iterT is Itermode.permutations:
-            for output in gen_permutations_list(iterable)[1]:
-                output_list.append(output)
-        if iterT is Itermode.product:
-            for output in gen_product_list(iterable)[1]:
-                output_list.append(output)
-        # Remove anything generated that is also contained in the removal list
-        output_list = [x for x in output_list if x not in removal_list]
         res_str = ''
-        # Safe substitute the remaining outputs
-        for output in output_list:
-            res_str += res.safe_substitute(**{iterable.key: output})
+        for output in iterate_outputs(iterable):
+            # Skip anything generated that is also contained in the removal
+            # list, and safe substitute the remaining outputs
+            if join_output(iterable, output) not in removal_list:
+                res_str += res.safe_substitute(
+                    get_substitutions(iterable, output))
     res = Template(res_str)
     return res
 
 
-def combined_removal_dispatcher(template, in_iterables, removal_iterables):
+def combined_removal_dispatcher(template,
+                                in_iterables,
+                                removal_iterables,
+                                length_policy=LengthPolicy.strict):
     """First iterates through the list of iterables 'removal_iterables'. Stores
-    each output from these iterables for later. Then iterates through the list
-    'in_iterables', saving their outputs in the form (key, [output, output,..]).
-    Next, iterates over the output lists in parallel, ignoring any combination
-    which includes an element of the removal list. The non-removed combined
-    outputs are safe substituted into the template, which is finally returned.
+    each output from these iterables for later. Then iterates over the outputs
+    of 'in_iterables' in parallel, ignoring any combination which includes an
+    element of the removal list. The non-removed combined outputs are safe
+    substituted into the template as by accumulate_combined, which is finally
+    returned.
+    If the last combination is removed, the result ends with the unsubstituted
+    template, as when there are no combinations at all.
     """
     # Build the removal list
-    removal_list = []
-    for iterable in removal_iterables:
-        iterT = iterable.itermode
-        if iterT is Itermode.combinations:
-            for output in gen_combinations_list(iterable)[1]:
-                removal_list.append(output)
-        if iterT is Itermode.combinationsWR:
-            for output in gen_combinations_with_replacement_list(iterable)[1]:
-                removal_list.append(output)
-        if iterT is Itermode.permutations:
-            for output in gen_permutations_list(iterable)[1]:
-                removal_list.append(output)
-        if iterT is Itermode.product:
-            for output in gen_product_list(iterable)[1]:
-                removal_list.append(output)
-    # Build the iterable list in form [(key, [output, output, ...]),...]
-    iter_list = []
-    for iterable in in_iterables:
-        iterT = iterable.itermode
-        if iterT is Itermode.combinations:
-            iter_list.append(gen_combinations_list(iterable))
-        if iterT is Itermode.combinationsWR:
-            iter_list.append(gen_combinations_with_replacement_list(iterable))
-        if iterT is Itermode.permutations:
-            iter_list.append(gen_permutations_list(iterable))
-        if iterT is Itermode.product:
-            iter_list.append(gen_product_list(iterable))
-    # Lambda that checks if any element of list a is in list b
-    any_in = lambda a, b: any(i in b for i in a)
-    template_str = template.template
-    res = template
-    # Loop over generated iterable list
-    iter_count = len(iter_list[0][1])
-    for index in range(0, iter_count):
-        test_list = []
-        output_list = []
-        for iterable in iter_list:
-            test_list.append(iterable[1][index])
-            output_list.append(iterable)
-        if not any_in(test_list, removal_list):
-            for iterable in output_list:
-                res = Template(
-                    res.safe_substitute(**{iterable[0]: iterable[1][index]}))
-            if index != iter_count - 1:
-                res = Template(res.template + template_str)
-    return res
+    removal_list = get_removal_list(removal_iterables)
+    rows = ((outputs,
+             not any(
+                 join_output(iterable, output) in removal_list
+                 for iterable, output in zip(in_iterables, outputs)))
+            for outputs in iterate_combined(in_iterables, length_policy))
+    return accumulate_combined(template, in_iterables, rows)
+
+
+def merge_substitutions(iterables, outputs):
+    """Returns the substitutions of one output of each iterable as a single
+    dict. Where iterables share a key, the earliest iterable's value is kept,
+    as it is the first to be substituted."""
+    substitutions = {}
+    for iterable, output in zip(iterables, outputs):
+        for key, value in get_substitutions(iterable, output).items():
+            substitutions.setdefault(key, value)
+    return substitutions
+
+
+def _get_args(kind, key, arg_keys, substitutions, values=None):
+    """Returns the list of the values of arg_keys in substitutions, or in
+    values if not bound in substitutions, to call the function of the derived
+    key or segment at key with"""
+    args = []
+    for arg_key in arg_keys:
+        value = substitutions.get(arg_key)
+        if value is None and values is not None:
+            value = values.get(arg_key)
+        if value is None:
+            raise ValueError(kind + ' ' + repr(key) + ' uses ' +
+                             repr(arg_key) + ', which isn\'t bound')
+        args.append(value)
+    return args
+
+
+def get_derive(iter_group):
+    """Returns a function taking the dict of keys and values bound in a copy
+    of the template of iter_group and returning a dict of the value of each of
+    its derived keys not bound by an iterable, or None if iter_group has no
+    derived keys. The function of each derived key is only called once for
+    each different set of arguments, up to its cache_size."""
+    if not iter_group.derived_keys:
+        return None
+    derived = [(derived_key.key, derived_key.arg_keys,
+                lru_cache(maxsize=derived_key.cache_size)(derived_key.func))
+               for derived_key in iter_group.derived_keys]
+
+    def derive(substitutions):
+        values = {}
+        for key, arg_keys, func in derived:
+            if key in substitutions or key in values:
+                continue
+            value = func(*_get_args('Derived key', key, arg_keys,
+                                    substitutions, values))
+            if not isinstance(value, str):
+                raise TypeError('Derived key ' + repr(key) + ' must have a '
+                                'str value, got ' + repr(value))
+            values[key] = value
+        return values
+
+    return derive
+
+
+def choose_segments(template, segments, choice):
+    """Returns template with the key of each of segments replaced by its
+    segment text where choice, a tuple of a bool for each segment, is True,
+    and by its otherwise text where it is False"""
+    texts = dict(
+        (segment.key, segment.segment if chosen else segment.otherwise)
+        for segment, chosen in zip(segments, choice))
+
+    def replace(match):
+        return texts.get(match.group('named') or match.group('braced'),
+                         match.group())
+
+    return type(template)(template.pattern.sub(replace, template.template))
+
+
+def get_choose(iter_group):
+    """Returns a function taking the dict of keys and values bound in a copy
+    of the template of iter_group, including its derived keys, and returning
+    a tuple of whether the guard of each of its segments holds, or None if
+    iter_group has no segments. Each guard is only called once for each
+    different set of arguments, up to its cache_size."""
+    if not iter_group.segments:
+        return None
+    guards = [(segment.key, segment.arg_keys,
+               lru_cache(maxsize=segment.cache_size)(segment.guard))
+              for segment in iter_group.segments]
+
+    def choose(substitutions):
+        return tuple(
+            bool(guard(*_get_args('Segment', key, arg_keys, substitutions)))
+            for key, arg_keys, guard in guards)
+
+    return choose
+
+
+def get_render(iter_group):
+    """Returns a function returning the copy of the template of iter_group for
+    one output of each insertion iterable. The text of each segment of the
+    template is chosen, then the outputs are substituted as by
+    substitute_combined, and finally the values of the derived keys. The
+    template with the segments chosen is only made once for each choice."""
+    template = iter_group.template
+    iterables = get_insertion_iterables(iter_group)
+    derive = get_derive(iter_group)
+    choose = get_choose(iter_group)
+    if derive is None and choose is None:
+        return lambda outputs: substitute_combined(template, iterables,
+                                                   outputs)
+    templates = {}
+
+    def render(outputs):
+        substitutions = merge_substitutions(iterables, outputs)
+        derived = {}
+        if derive is not None:
+            derived = derive(substitutions)
+        row_template = template
+        if choose is not None:
+            substitutions.update(derived)
+            choice = choose(substitutions)
+            row_template = templates.get(choice)
+            if row_template is None:
+                row_template = choose_segments(template, iter_group.segments,
+                                               choice)
+                templates[choice] = row_template
+        res = substitute_combined(row_template, iterables, outputs)
+        if not derived:
+            return res
+        return Template(res).safe_substitute(derived)
+
+    return render
+
+
+def row_dispatcher(iter_group):
+    """Renders each copy of the template of iter_group which isn't removed
+    with get_render, for groups with derived keys or segments. Where the
+    copies can be compiled to format strings, as by compile_group, they are
+    rendered from those instead, so no template is substituted for any copy.
+    As by the other dispatchers, a combined group ends with the unsubstituted
+    template when its last combination is removed or there are none. Returns
+    the generated string."""
+    # Imported here as internal.parallel depends on internal.iters
+    from .parallel import compile_group
+    compiled = compile_group(iter_group)
+    if compiled is not None:
+        return compiled.render(0, len(compiled.output_lists[-1]))
+    render = get_render(iter_group)
+    generated = []
+    kept = False
+    for outputs, kept in iterate_rows(iter_group):
+        if kept:
+            generated.append(render(outputs))
+    if iter_group.combine_iters and not kept:
+        generated.append(iter_group.template.template)
+    return ''.join(generated)
+
+
+def get_insertion_iterables(iter_group):
+    """Returns the iterables whose outputs are substituted into the template of
+    an IterGroup or RemovalIterGroup"""
+    if isinstance(iter_group, IterGroup):
+        return iter_group.iterables
+    return iter_group.insertion_iterables
+
+
+def get_output_lists(iter_group):
+    """Returns a list of the outputs of each insertion iterable of an uncombined
+    iter_group, leaving out any outputs removed by its removal iterables"""
+    removal_list = set()
+    if not isinstance(iter_group, IterGroup):
+        removal_list = get_removal_list(iter_group.removal_iterables)
+    return [[
+        output for output in iterate_outputs(iterable)
+        if join_output(iterable, output) not in removal_list
+    ] for iterable in get_insertion_iterables(iter_group)]
+
+
+def iterate_rows(iter_group):
+    """Yields a tuple of (outputs, kept) for each copy of the template of
+    iter_group, where outputs holds one output of each insertion iterable, in
+    the order the copies are generated. For uncombined groups the outputs of
+    the first iterable vary fastest, matching the repeated expansion of
+    dispatch_iterations, and removed outputs are never used so kept is always
+    True. For combined groups every combination is yielded, with kept False
+    for those removed by the removal iterables."""
+    if not iter_group.combine_iters:
+        output_lists = get_output_lists(iter_group)
+        for outputs in product(*reversed(output_lists)):
+            yield tuple(reversed(outputs)), True
+        return
+    iterables = get_insertion_iterables(iter_group)
+    removal_list = set()
+    if not isinstance(iter_group, IterGroup):
+        removal_list = get_removal_list(iter_group.removal_iterables)
+    for outputs in iterate_combined(iterables, iter_group.length_policy):
+        yield (outputs,
+               all(
+                   join_output(iterable, output) not in removal_list
+                   for iterable, output in zip(iterables, outputs)))
+
+
+def get_row_keys(iterables, outputs):
+    """Returns the keys bound by one output of each of iterables, in the order
+    of the iterables. Each key is only listed once, for the earliest iterable
+    binding it, as that is the value substituted."""
+    keys = []
+    for iterable, output in zip(iterables, outputs):
+        keys.extend(key for key in get_substitutions(iterable, output)
+                    if key not in keys)
+    return keys
+
+
+def get_kept_rows(iter_group):
+    """Returns an iterator over the outputs of each copy of the template of
+    iter_group which isn't removed"""
+    return (outputs for outputs, kept in iterate_rows(iter_group) if kept)
+
+
+def is_separable(iter_group):
+    """Returns whether the copies of the template of iter_group which aren't
+    removed, each generated on its own by get_render and joined, give what
+    expand_iter_group generates. Copies of a group without derived keys or
+    segments may not be, as later substitutions also apply to the copies
+    before them: those of a combined group are only separable where every
+    copy is settled, as by is_settled, and those of other groups where the
+    template is splittable, as by is_splittable, and no value holds the
+    delimiter."""
+    if iter_group.derived_keys or iter_group.segments:
+        return True
+    template = iter_group.template
+    if not iter_group.combine_iters:
+        # Imported here as internal.incremental depends on internal.iters
+        from .incremental import is_splittable
+        return is_splittable(template) and not any(
+            template.delimiter in value
+            for outputs in get_output_lists(iter_group) for output in outputs
+            for value in output)
+    if type(template) is not Template:
+        return False
+    iterables = get_insertion_iterables(iter_group)
+    render = get_render(iter_group)
+    return all(
+        is_settled(render(outputs), iterables)
+        for outputs in get_kept_rows(iter_group))
+
+
+def get_binding_keys(iter_group):
+    """Returns the keys bound by iter_group, in the order of the values of its
+    BindingForm.tuple bindings. Element keys of iterables with bind_elements
+    set are those of the first copy of the template, or left out if the group
+    generates no copies."""
+    iterables = get_insertion_iterables(iter_group)
+    for outputs in get_kept_rows(iter_group):
+        break
+    else:
+        outputs = [()] * len(iterables)
+    keys = get_row_keys(iterables, outputs)
+    keys.extend(derived_key.key for derived_key in iter_group.derived_keys
+                if derived_key.key not in keys)
+    return keys
+
+
+def iterate_bindings(iter_group, form=BindingForm.dict):
+    """Yields the bindings of each copy of the template iter_group generates,
+    in the order they are generated, leaving out any removed copies. The form
+    of the bindings is set by form, a BindingForm.
+    dict bindings hold each key and the value substituted at it. tuple
+    bindings hold the values in the order of get_binding_keys, and are built
+    without a dict for each copy, so every output of an iterable with
+    bind_elements set must have the same length. raw bindings are the output
+    tuple of each insertion iterable, before being joined, without the values
+    of derived keys."""
+    if not isinstance(form, BindingForm):
+        raise TypeError('form must be a BindingForm')
+    iterables = get_insertion_iterables(iter_group)
+    rows = get_kept_rows(iter_group)
+    derive = get_derive(iter_group)
+    if form is BindingForm.raw:
+        for outputs in rows:
+            yield outputs
+        return
+    if form is BindingForm.dict:
+        for outputs in rows:
+            substitutions = merge_substitutions(iterables, outputs)
+            if derive is not None:
+                substitutions.update(derive(substitutions))
+            yield substitutions
+        return
+    if derive is not None:
+        # The derived values are looked up by key, so each copy is bound as a
+        # dict
+        keys = get_binding_keys(iter_group)
+        for outputs in rows:
+            substitutions = merge_substitutions(iterables, outputs)
+            substitutions.update(derive(substitutions))
+            if (len(substitutions) != len(keys)
+                    or not all(key in substitutions for key in keys)):
+                raise ValueError('Outputs of an iterable with '
+                                 'bind_elements set must have the same '
+                                 'length to be yielded as tuples')
+            yield tuple(substitutions[key] for key in keys)
+        return
+    # From the first copy, the plan records for each iterable whether its
+    # joined output and which of its elements are bound to keys not already
+    # bound by an earlier iterable
+    plan = None
+    for outputs in rows:
+        if plan is None:
+            plan = []
+            keys = set()
+            for iterable, output in zip(iterables, outputs):
+                joined = iterable.key not in keys
+                keys.add(iterable.key)
+                elements = []
+                if iterable.bind_elements:
+                    for index in range(len(output)):
+                        element_key = iterable.key + '_' + str(index)
+                        if element_key not in keys:
+                            elements.append(index)
+                            keys.add(element_key)
+                plan.append((joined, elements, len(output)))
+        values = []
+        for iterable, output, (joined, elements, length) in zip(
+                iterables, outputs, plan):
+            if joined:
+                values.append(join_output(iterable, output))
+            if iterable.bind_elements:
+                if len(output) != length:
+                    raise ValueError('Outputs of an iterable with '
+                                     'bind_elements set must have the same '
+                                     'length to be yielded as tuples')
+                values.extend(output[index] for index in elements)
+        yield tuple(values)
+
+
+def iterate_expansion(iter_group):
+    """Yields the string expand_iter_group generates for iter_group in
+    consecutive pieces, generating each piece only as it is asked for. The
+    copies of the template are yielded as they are generated where they are
+    separable, as by is_separable, and the settled text of a combined group
+    as by iterate_accumulated. Otherwise, and for EmitMode.xmacro, the whole
+    string is a single piece."""
+    template = iter_group.template
+    if iter_group.emit_mode is EmitMode.xmacro:
+        yield expand_iter_group(iter_group)
+        return
+    if iter_group.combine_iters and not (iter_group.derived_keys
+                                         or iter_group.segments):
+        empty = True
+        for piece in iterate_accumulated(template,
+                                         get_insertion_iterables(iter_group),
+                                         iterate_rows(iter_group)):
+            empty = False
+            yield piece
+        if empty:
+            yield template.template
+        return
+    # Imported here as internal.parallel depends on internal.iters
+    from .parallel import compile_group
+    compiled = compile_group(iter_group)
+    if compiled is not None:
+        for rank in range(len(compiled.output_lists[-1])):
+            yield compiled.render(rank, rank + 1)
+        return
+    if not is_separable(iter_group):
+        yield expand_iter_group(iter_group)
+        return
+    render = get_render(iter_group)
+    kept = False
+    for outputs, kept in iterate_rows(iter_group):
+        if kept:
+            yield render(outputs)
+    if iter_group.combine_iters and not kept:
+        yield template.template
+
+
+def expand_iter_group(iter_group):
+    """Dispatches the template and iterables of an IterGroup or
+    RemovalIterGroup to the dispatcher for its type and combine mode, or emits
+    an X-macro table of its outputs for EmitMode.xmacro. Returns the generated
+    string."""
+    template = iter_group.template
+    if iter_group.emit_mode is EmitMode.xmacro:
+        return emit_xmacro(template, iter_group.table_name,
+                           iterate_bindings(iter_group))
+    if iter_group.derived_keys or iter_group.segments:
+        return row_dispatcher(iter_group)
+    # Normal IterGroup
+    if isinstance(iter_group, IterGroup):
+        if iter_group.combine_iters:
+            template = combined_dispatcher(template, iter_group.iterables,
+                                           iter_group.length_policy)
+        else:
+            template = dispatch_iterations(template, iter_group.iterables)
+    # Removal IterGroup
+    else:
+        if iter_group.combine_iters:
+            template = combined_removal_dispatcher(
+                template, iter_group.insertion_iterables,
+                iter_group.removal_iterables, iter_group.length_policy)
+        else:
+            template = removal_dispatcher(template,
+                                          iter_group.insertion_iterables,
+                                          iter_group.removal_iterables)
+    return template.template
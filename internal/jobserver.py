@@ -0,0 +1,167 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import re
+import select
+import stat
+import threading
+
+# When run from a recipe of make -jN, py_gen shares make's job slots through
+# the GNU make jobserver. make passes the jobserver in MAKEFLAGS, either as a
+# pair of inherited pipe file descriptors, --jobserver-auth=R,W or
+# --jobserver-fds=R,W for make before 4.2, or as a named pipe,
+# --jobserver-auth=fifo:PATH from make 4.4. Each byte in the pipe is a token
+# for one job slot beyond the implicit slot every job already holds. A token
+# is taken by reading a byte and must be given back by writing the same byte
+# once the work it was taken for is done, even if that work fails.
+
+_JOBSERVER_AUTH = re.compile(r'--jobserver-(?:auth|fds)=(\S+)')
+
+
+def parse_makeflags(makeflags):
+    """Returns the jobserver named in makeflags, as a tuple of ('fifo', path)
+    or ('fds', read_fd, write_fd), or None if it names none. Only the last
+    jobserver option is used, as by make."""
+    auths = _JOBSERVER_AUTH.findall(makeflags)
+    if not auths:
+        return None
+    auth = auths[-1]
+    if auth.startswith('fifo:'):
+        return ('fifo', auth[len('fifo:'):])
+    fds = auth.split(',')
+    try:
+        read_fd, write_fd = int(fds[0]), int(fds[1])
+    except (IndexError, ValueError):
+        return None
+    if read_fd < 0 or write_fd < 0:
+        return None
+    return ('fds', read_fd, write_fd)
+
+
+def _is_pipe(fd):
+    try:
+        return stat.S_ISFIFO(os.fstat(fd).st_mode)
+    except OSError:
+        return False
+
+
+class Jobserver(object):
+    """A client of a GNU make jobserver. acquire takes a job slot and returns
+    its token, and release gives it back. The first slot taken is the
+    implicit slot of this process, whose token is None."""
+
+    def __init__(self, read_fd, write_fd, owns_fds=False):
+        self.read_fd = read_fd
+        self.write_fd = write_fd
+        self.owns_fds = owns_fds
+        self._lock = threading.Lock()
+        self._implicit_free = True
+        # Wakes threads waiting for a token when the implicit slot is freed
+        self._wake_read, self._wake_write = os.pipe()
+        os.set_blocking(self._wake_read, False)
+        os.set_blocking(self._wake_write, False)
+
+    def _take_implicit(self):
+        with self._lock:
+            if self._implicit_free:
+                self._implicit_free = False
+                return True
+            return False
+
+    def acquire(self):
+        """Returns the token of a free job slot, waiting for one if none are
+        free"""
+        while not self._take_implicit():
+            # The pipe may be non-blocking, as set by make or another client
+            readable, _, _ = select.select([self.read_fd, self._wake_read], [],
+                                           [])
+            if self._wake_read in readable:
+                try:
+                    os.read(self._wake_read, 1024)
+                except (BlockingIOError, InterruptedError):
+                    pass
+            if self.read_fd not in readable:
+                continue
+            try:
+                token = os.read(self.read_fd, 1)
+            except (BlockingIOError, InterruptedError):
+                continue
+            if not token:
+                raise OSError('The make jobserver was closed')
+            return token
+        return None
+
+    def release(self, token):
+        """Gives back the job slot of token"""
+        if token is None:
+            with self._lock:
+                self._implicit_free = True
+            try:
+                os.write(self._wake_write, b'.')
+            except BlockingIOError:
+                # The pipe is full of wake ups not yet seen
+                pass
+            return
+        while True:
+            try:
+                os.write(self.write_fd, token)
+                return
+            except (BlockingIOError, InterruptedError):
+                select.select([], [self.write_fd], [])
+
+    def close(self):
+        if self._wake_read is not None:
+            os.close(self._wake_read)
+            os.close(self._wake_write)
+            self._wake_read = self._wake_write = None
+        if self.owns_fds:
+            os.close(self.read_fd)
+            if self.write_fd != self.read_fd:
+                os.close(self.write_fd)
+            self.owns_fds = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def get_jobserver(environ=None):
+    """Returns a Jobserver for the jobserver named in the MAKEFLAGS of
+    environ, os.environ by default, or None if there isn't a usable one. A
+    jobserver passed as file descriptors is only usable if the recipe was
+    marked as recursive, with + or $(MAKE), as make closes them otherwise."""
+    if environ is None:
+        environ = os.environ
+    auth = parse_makeflags(environ.get('MAKEFLAGS', ''))
+    if auth is None:
+        return None
+    if auth[0] == 'fifo':
+        try:
+            fd = os.open(auth[1], os.O_RDWR)
+        except OSError:
+            return None
+        if not _is_pipe(fd):
+            os.close(fd)
+            return None
+        return Jobserver(fd, fd, True)
+    _, read_fd, write_fd = auth
+    if not (_is_pipe(read_fd) and _is_pipe(write_fd)):
+        return None
+    return Jobserver(read_fd, write_fd)
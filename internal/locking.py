@@ -0,0 +1,111 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+# Cross-process advisory locks are taken on a separate file next to the locked
+# path, named path + '.lock'. Lock files are never removed, as removing one
+# while another process waits on it would let a third process lock a new file
+# of the same name at the same time.
+
+# Permissions of a file written atomically where there is no file to keep them
+# from, as mkstemp creates files only their owner can read
+DEFAULT_FILE_MODE = 0o644
+
+
+@contextmanager
+def file_lock(path):
+    """Holds an exclusive advisory lock for path, blocking until it can be
+    taken. Yields the open lock file, which is kept between runs and can be used
+    to record what was last done under the lock."""
+    with open(path + '.lock', 'a+') as lock_file:
+        if fcntl is not None:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX)
+        else:
+            while True:
+                try:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    time.sleep(0.05)
+        try:
+            yield lock_file
+        finally:
+            lock_file.flush()
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_UN)
+            else:
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+def read_lock_record(lock_file):
+    """Returns the record last written to the lock file yielded by file_lock"""
+    lock_file.seek(0)
+    return lock_file.read()
+
+
+def write_lock_record(lock_file, record):
+    """Replaces the record kept in the lock file yielded by file_lock"""
+    lock_file.seek(0)
+    lock_file.truncate()
+    lock_file.write(record)
+
+
+def copy_file_mode(temp_name, file_name):
+    """Gives temp_name the permissions of file_name, or DEFAULT_FILE_MODE if
+    there is no file_name. The umask isn't read, as that can only be done by
+    changing it for every thread of the process."""
+    try:
+        mode = os.stat(file_name).st_mode & 0o7777
+    except OSError:
+        mode = DEFAULT_FILE_MODE
+    os.chmod(temp_name, mode)
+
+
+def write_file_atomic(file_name, file_source, prepare=None,
+                      newline=None):
+    """Writes file_source to a temporary file next to file_name, then renames it
+    over file_name, so readers only ever see a complete file. prepare is called
+    with the name of the temporary file before the rename, which keeps the
+    extension of file_name. The permissions of an existing file_name are kept.
+    newline is passed to open, so '' writes line breaks untranslated.
+    """
+    directory, base_name = os.path.split(os.path.abspath(file_name))
+    fd, temp_name = tempfile.mkstemp(prefix='.' + base_name + '.',
+                                     suffix=os.path.splitext(base_name)[1],
+                                     dir=directory)
+    try:
+        with os.fdopen(fd, 'w', newline=newline) as output_file:
+            output_file.write(file_source)
+        copy_file_mode(temp_name, file_name)
+        if prepare is not None:
+            prepare(temp_name)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
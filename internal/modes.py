@@ -0,0 +1,308 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from collections import namedtuple
+from itertools import (chain, combinations, combinations_with_replacement,
+                       islice, permutations, product)
+from math import factorial
+from ..iter_classes import Itermode
+
+# The registry maps each Itermode to a ModeSpec describing how to enumerate it.
+# Every function in a ModeSpec takes the pool of an Iterable, which is its vals
+# as prepared by the pool function, and its iter_modifier. enumerate returns an
+# iterator over the output tuples. count returns the number of outputs without
+# enumerating them, and unrank returns the output at a given index of the
+# enumeration. Both are optional, and are emulated by enumerating if missing.
+# stream_pool is also optional. It is called with vals streamed from a
+# ValueFile or ValueStream, which can only be read once, and the
+# iter_modifier, and returns a pool enumerate can read once, or None if the
+# whole pool is needed for that iter_modifier.
+
+ModeSpec = namedtuple('ModeSpec',
+                      ['enumerate', 'count', 'unrank', 'pool', 'stream_pool'])
+
+_MODES = {}
+
+
+def register_itermode(itermode, enumerate, count=None, unrank=None,
+                      pool=tuple, stream_pool=None):
+    """Registers or replaces the functions used to generate the outputs of
+    Iterables using itermode, which may be any hashable object. enumerate,
+    count and unrank are called with the pool and iter_modifier of an Iterable,
+    unrank with the index of the output to return as well. pool is called with
+    the vals of an Iterable to prepare them once before the other functions.
+    stream_pool, if given, prepares vals streamed from a file or generator for
+    an enumerate which reads them only once, see ModeSpec."""
+    if itermode is None or itermode is Itermode.uninitialised:
+        raise ValueError('Can not register ' + str(itermode))
+    _MODES[itermode] = ModeSpec(enumerate, count, unrank, pool, stream_pool)
+    # Imported here as internal.sources generates with this module
+    from .sources import clear_source_cache
+    clear_source_cache()
+
+
+def is_registered(itermode):
+    """Returns whether itermode has been registered"""
+    try:
+        return itermode in _MODES
+    except TypeError:
+        return False
+
+
+def get_mode(itermode):
+    """Returns the ModeSpec registered for itermode"""
+    try:
+        return _MODES[itermode]
+    except (KeyError, TypeError):
+        raise ValueError('Dispatch for Itermode ' + str(itermode) +
+                         ' is not supported')
+
+
+def get_vals(iterable):
+    """Returns the vals of iterable, with any value source replaced by the
+    values it generates"""
+    # Imported here as internal.sources generates with this module
+    from .sources import resolve_vals
+    return resolve_vals(iterable.vals)
+
+
+def get_pool(iterable):
+    """Returns the vals of iterable prepared for the functions of its mode"""
+    return get_mode(iterable.itermode).pool(get_vals(iterable))
+
+
+def iterate_outputs(iterable):
+    """Returns an iterator over each output of iterable as a tuple of values.
+    Values read from a ValueFile or ValueStream are streamed rather than
+    loaded where the mode of iterable can stream them."""
+    mode = get_mode(iterable.itermode)
+    if mode.stream_pool is not None:
+        # Imported here as internal.sources generates with this module
+        from .sources import has_streamed_source, open_vals
+        if has_streamed_source(iterable.vals):
+            pool = mode.stream_pool(open_vals(iterable.vals),
+                                    iterable.iter_modifier)
+            if pool is not None:
+                return mode.enumerate(pool, iterable.iter_modifier)
+    return mode.enumerate(mode.pool(get_vals(iterable)),
+                          iterable.iter_modifier)
+
+
+def count_outputs(iterable):
+    """Returns the number of outputs of iterable, enumerating them only if its
+    mode has no count function."""
+    mode = get_mode(iterable.itermode)
+    pool = mode.pool(get_vals(iterable))
+    if mode.count is not None:
+        return mode.count(pool, iterable.iter_modifier)
+    return sum(1 for _ in mode.enumerate(pool, iterable.iter_modifier))
+
+
+def slice_outputs(iterable, start, stop):
+    """Returns an iterator over the outputs of iterable with indices from start
+    up to stop, unranking each of them if its mode has an unrank function."""
+    mode = get_mode(iterable.itermode)
+    pool = mode.pool(get_vals(iterable))
+    modifier = iterable.iter_modifier
+    if mode.unrank is None:
+        return islice(mode.enumerate(pool, modifier), start, stop)
+    if mode.count is not None:
+        stop = min(stop, mode.count(pool, modifier))
+    return (mode.unrank(pool, modifier, index)
+            for index in range(start, stop))
+
+
+def _choose(n, k):
+    """Returns the binomial coefficient n choose k, or 0 if k > n"""
+    if k < 0 or k > n:
+        return 0
+    return factorial(n) // (factorial(k) * factorial(n - k))
+
+
+def _multichoose(n, k):
+    """Returns the number of multisets of size k from n elements"""
+    if k == 0:
+        return 1
+    return _choose(n + k - 1, k)
+
+
+def _arrangements(n, k):
+    """Returns the number of k-permutations of n elements"""
+    if k > n:
+        return 0
+    return factorial(n) // factorial(n - k)
+
+
+def _unrank_product(pool, r, index):
+    n = len(pool)
+    output = []
+    for _ in range(r):
+        index, digit = divmod(index, n)
+        output.append(pool[digit])
+    return tuple(reversed(output))
+
+
+def _unrank_permutations(pool, r, index):
+    remaining = list(pool)
+    output = []
+    for position in range(r):
+        block = _arrangements(len(remaining) - 1, r - position - 1)
+        digit, index = divmod(index, block)
+        output.append(remaining.pop(digit))
+    return tuple(output)
+
+
+def _unrank_combinations(pool, r, index):
+    n = len(pool)
+    output = []
+    candidate = 0
+    for position in range(r):
+        while True:
+            block = _choose(n - candidate - 1, r - position - 1)
+            if index < block:
+                break
+            index -= block
+            candidate += 1
+        output.append(pool[candidate])
+        candidate += 1
+    return tuple(output)
+
+
+def _unrank_combinations_with_replacement(pool, r, index):
+    n = len(pool)
+    output = []
+    candidate = 0
+    for position in range(r):
+        while True:
+            block = _multichoose(n - candidate, r - position - 1)
+            if index < block:
+                break
+            index -= block
+            candidate += 1
+        output.append(pool[candidate])
+    return tuple(output)
+
+
+def _enumerate_powerset(pool, r):
+    return chain.from_iterable(
+        combinations(pool, size) for size in range(r, len(pool) + 1))
+
+
+def _count_powerset(pool, r):
+    return sum(_choose(len(pool), size) for size in range(r, len(pool) + 1))
+
+
+def _unrank_powerset(pool, r, index):
+    for size in range(r, len(pool) + 1):
+        block = _choose(len(pool), size)
+        if index < block:
+            return _unrank_combinations(pool, size, index)
+        index -= block
+    raise IndexError('powerset index out of range')
+
+
+def _count_zip(pool, r):
+    return min([len(vals) for vals in pool]) if pool else 0
+
+
+def _range_pool(vals):
+    return tuple(str(value) for value in range(*vals))
+
+
+def _chain_pool(vals):
+    return tuple(chain.from_iterable(vals))
+
+
+def _stream_single(vals, r):
+    """Returns vals as a pool for product, which only reads it once for an
+    iter_modifier of 1"""
+    if r == 1:
+        return vals
+    return None
+
+
+def _enumerate_product(pool, r):
+    return product(pool, repeat=r)
+
+
+def _count_product(pool, r):
+    return len(pool)**r
+
+
+def _enumerate_gray_product(pool, r):
+    """Yields the outputs of product in reflected Gray code order, where each
+    output differs from the one before in a single element. As for product,
+    the last element changes most often. Each element sweeps through the pool
+    and back, and a step moves the last element which hasn't reached the end
+    of its sweep, reversing the sweeps of those after it."""
+    n = len(pool)
+    if n == 0 and r > 0:
+        return
+    digits = [0] * r
+    directions = [1] * r
+    yield tuple(pool[digit] for digit in digits)
+    while True:
+        position = r - 1
+        while position >= 0:
+            digit = digits[position] + directions[position]
+            if 0 <= digit < n:
+                break
+            directions[position] = -directions[position]
+            position -= 1
+        if position < 0:
+            return
+        digits[position] = digit
+        yield tuple(pool[digit] for digit in digits)
+
+
+def _unrank_gray_product(pool, r, index):
+    n = len(pool)
+    output = []
+    for position in range(r):
+        prefix = index // n**(r - position - 1)
+        digit = prefix % n
+        # The element sweeps backwards in every other block of the elements
+        # before it
+        if (prefix // n) % 2:
+            digit = n - 1 - digit
+        output.append(pool[digit])
+    return tuple(output)
+
+
+register_itermode(Itermode.product, _enumerate_product, _count_product,
+                  _unrank_product, stream_pool=_stream_single)
+register_itermode(Itermode.grayProduct, _enumerate_gray_product,
+                  _count_product, _unrank_gray_product)
+register_itermode(Itermode.permutations, permutations,
+                  lambda pool, r: _arrangements(len(pool), r),
+                  _unrank_permutations)
+register_itermode(Itermode.combinations, combinations,
+                  lambda pool, r: _choose(len(pool), r),
+                  _unrank_combinations)
+register_itermode(Itermode.combinationsWR, combinations_with_replacement,
+                  lambda pool, r: _multichoose(len(pool), r),
+                  _unrank_combinations_with_replacement)
+register_itermode(Itermode.powerset, _enumerate_powerset, _count_powerset,
+                  _unrank_powerset)
+register_itermode(Itermode.zip, lambda pool, r: zip(*pool), _count_zip,
+                  lambda pool, r, index: tuple(vals[index] for vals in pool),
+                  stream_pool=lambda vals, r: vals)
+register_itermode(Itermode.range, _enumerate_product, _count_product,
+                  _unrank_product, _range_pool)
+register_itermode(Itermode.chain, _enumerate_product, _count_product,
+                  _unrank_product, _chain_pool,
+                  lambda vals, r: _stream_single(chain.from_iterable(vals), r))
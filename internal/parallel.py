@@ -0,0 +1,461 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import mmap
+import os
+import tempfile
+from collections import namedtuple
+from itertools import islice, product
+from ..iter_classes import EmitMode
+from .dedup import compile_format, compile_template
+from .funcs import add_spaces_to_lines
+from .incremental import is_splittable
+from .iters import (expand_iter_group, get_choose, get_derive,
+                    get_insertion_iterables, get_output_lists,
+                    get_substitutions)
+from .locking import copy_file_mode
+from .scaffold import index_scaffold
+
+# A parallel render lays out the output file before generating anything into
+# it. A sizing pass finds the exact UTF-8 length of every piece of the output:
+# the literal segments of the source between insertion points, and chunks of
+# the generated string of each group. The output file is then preallocated at
+# its final size and each chunk is rendered by a worker straight into the
+# memory mapped file at its offset, so no generated string is sent back or
+# joined in one process.
+# The generated string of an uncombined expanded group is split by ranges of
+# the outputs of its last insertion iterable, which varies slowest. Each copy
+# of the template is the same literal text with one value substituted per
+# field, so the length of a chunk, and the number of line breaks its
+# indentation adds spaces after, is summed from the lengths of the values
+# without substituting any copy. Groups this doesn't apply to, such as
+# combined groups, those whose values contain the template delimiter or those
+# with derived keys or segments, are a single chunk sized by generating it once
+# in the sizing pass.
+# As workers only see their own chunk, whether a generated string creates a
+# later insertion point is checked from the edges each worker returns once all
+# have finished.
+
+# Default number of bytes of generated string rendered by a worker at once
+DEFAULT_CHUNK_SIZE = 1 << 24
+
+# Characters str.splitlines breaks lines at, other than '\r' which can join
+# with a following '\n' across the pieces of a copy
+_LINE_BREAKS = '\n\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029'
+
+# A chunk of the generated string of the group at index of iter_groups.
+# start and stop bound the outputs of the last insertion iterable generated in
+# the chunk, or are None for the whole generated string. size is the number of
+# UTF-8 bytes written once indented, and indent_first is whether the first line
+# of the chunk is indented as it follows a line break.
+Chunk = namedtuple('Chunk',
+                   ['index', 'start', 'stop', 'size', 'indent_first'])
+
+# The result of rendering a chunk: its first and last characters, as many as
+# could form a later insertion point with its neighbours, whether it is shorter
+# than that, and whether it contains a later insertion point
+ChunkEdges = namedtuple('ChunkEdges',
+                        ['head', 'tail', 'short', 'creates_insertion_point'])
+
+
+def count_breaks(string):
+    return sum(string.count(line_break) for line_break in _LINE_BREAKS)
+
+
+def _encoded_length(string):
+    return len(string.encode('utf-8'))
+
+
+class _CompiledGroup(object):
+    """The format string and field values of an uncombined expanded group whose
+    copies can be generated and sized separately.
+    If the group has derived keys or segments, derive and choose are as
+    returned by get_derive and get_choose, and substitutions holds the
+    substitutions of each output of each iterable, which the derived values
+    and segment choices of a copy are computed from. segments holds the key
+    of each segment and the format string and fields of its segment and
+    otherwise texts. The fields of derived keys and segments are given as
+    (None, key)."""
+
+    def __init__(self, output_lists, format_string, fields, derive=None,
+                 choose=None, substitutions=None, segments=()):
+        self.output_lists = output_lists
+        self.format_string = format_string
+        self.fields = fields
+        self.derive = derive
+        self.choose = choose
+        self.substitutions = substitutions
+        self.segments = segments
+
+    def render_row(self, row):
+        """Returns the copy of the template for the output at each index of
+        row, given in order of the insertion iterables"""
+        if self.derive is None and self.choose is None:
+            return self.format_string.format(
+                *[values[row[index]] for index, values in self.fields])
+        bound = {}
+        for index, substitutions in enumerate(self.substitutions):
+            for key, value in substitutions[row[index]].items():
+                bound.setdefault(key, value)
+        derived = {}
+        if self.derive is not None:
+            derived = self.derive(bound)
+        if self.choose is not None:
+            bound.update(derived)
+            choice = self.choose(bound)
+            for (key, branches), chosen in zip(self.segments, choice):
+                format_string, fields = branches[0 if chosen else 1]
+                derived[key] = _format_row(format_string, fields, row, derived)
+        return _format_row(self.format_string, self.fields, row, derived)
+
+    def iterate_rows(self, start, stop):
+        """Yields the index of each output of each iterable for each copy with
+        an output of the last iterable from start to stop, in generated order,
+        the first iterable varying fastest"""
+        ranges = [range(len(outputs)) for outputs in self.output_lists[:-1]]
+        for row in product(range(start, stop), *reversed(ranges)):
+            yield row[::-1]
+
+    def render(self, start, stop):
+        return ''.join(
+            self.render_row(row) for row in self.iterate_rows(start, stop))
+
+    def count_rows(self):
+        count = 1
+        for outputs in self.output_lists:
+            count *= len(outputs)
+        return count
+
+    def iterate_ranks(self, rank):
+        """Yields the rows of each copy from the copy at rank in generated
+        order onwards"""
+        rest = self.count_rows() // len(self.output_lists[-1])
+        rows = self.iterate_rows(rank // rest, len(self.output_lists[-1]))
+        return islice(rows, rank % rest, None)
+
+
+def _format_row(format_string, fields, row, derived):
+    return format_string.format(*[
+        derived[values] if index is None else values[row[index]]
+        for index, values in fields
+    ])
+
+
+def _compile_text(template, iterables, substitutions, derived):
+    """Returns a tuple of the format string and fields of template as by
+    compile_format, or None if it can't be compiled"""
+    if not is_splittable(template):
+        return None
+    compiled = compile_format(compile_template(template, iterables),
+                              substitutions, derived)
+    if compiled is None or '\r' in compiled[0]:
+        return None
+    return compiled
+
+
+def compile_group(iter_group):
+    """Returns a _CompiledGroup for iter_group, or None if its copies can't be
+    generated separately or sized from the lengths of their values"""
+    template = iter_group.template
+    if (iter_group.combine_iters
+            or iter_group.emit_mode is not EmitMode.expanded
+            or not is_splittable(template)):
+        return None
+    iterables = get_insertion_iterables(iter_group)
+    output_lists = get_output_lists(iter_group)
+    if not output_lists or not all(output_lists):
+        return None
+    if any(template.delimiter in value or '\r' in value
+           for outputs in output_lists for output in outputs
+           for value in output):
+        return None
+    substitutions = [[
+        get_substitutions(iterable, output) for output in outputs
+    ] for iterable, outputs in zip(iterables, output_lists)]
+    derived = [derived_key.key for derived_key in iter_group.derived_keys]
+    segment_keys = [segment.key for segment in iter_group.segments]
+    # The keys of segments are replaced before any iterable is substituted,
+    # so their fields can't be taken from an iterable
+    if segment_keys and any(
+            key in output for outputs in substitutions for output in outputs
+            for key in segment_keys):
+        return None
+    compiled = _compile_text(template, iterables, substitutions,
+                             derived + segment_keys)
+    if compiled is None:
+        return None
+    segments = []
+    for segment in iter_group.segments:
+        branches = tuple(
+            _compile_text(type(template)(text), iterables, substitutions,
+                          derived)
+            for text in [segment.segment, segment.otherwise])
+        if None in branches:
+            return None
+        segments.append((segment.key, branches))
+    return _CompiledGroup(output_lists, compiled[0], compiled[1],
+                          get_derive(iter_group), get_choose(iter_group),
+                          substitutions, segments)
+
+
+def _size_outputs(compiled):
+    """Returns a list of a tuple of (UTF-8 length, line break count, ends with
+    a line break) for the copies using each output of the last iterable, or
+    None if a copy can be empty so a chunk doesn't end with its last copy, or
+    the group has derived keys or segments, whose values are only known once a
+    copy is rendered"""
+    if compiled.derive is not None or compiled.choose is not None:
+        return None
+    counts = [len(outputs) for outputs in compiled.output_lists]
+    last = len(counts) - 1
+    rest = 1
+    for count in counts[:-1]:
+        rest *= count
+    literal = compiled.format_string.format(*([''] * len(compiled.fields)))
+    length = rest * _encoded_length(literal)
+    breaks = rest * count_breaks(literal)
+    last_lengths = [0] * counts[last]
+    last_breaks = [0] * counts[last]
+    for index, values in compiled.fields:
+        lengths = [_encoded_length(value) for value in values]
+        value_breaks = [count_breaks(value) for value in values]
+        if index == last:
+            for output_index in range(counts[last]):
+                last_lengths[output_index] += rest * lengths[output_index]
+                last_breaks[output_index] += rest * value_breaks[output_index]
+        else:
+            repeats = rest // counts[index]
+            length += repeats * sum(lengths)
+            breaks += repeats * sum(value_breaks)
+    sizes = []
+    final_row = [count - 1 for count in counts]
+    for output_index in range(counts[last]):
+        final_row[last] = output_index
+        final_copy = compiled.render_row(final_row)
+        if not final_copy:
+            return None
+        sizes.append((length + last_lengths[output_index],
+                      breaks + last_breaks[output_index],
+                      count_breaks(final_copy[-1]) > 0))
+    return sizes
+
+
+def plan_chunks(index, iter_group, space_count, chunk_size):
+    """Returns a list of the Chunks of the generated string of iter_group, at
+    index of the groups, indented by space_count. The outputs of the last
+    iterable are split into chunks of about chunk_size bytes. Returns None if
+    iter_group must be generated to be sized."""
+    compiled = compile_group(iter_group)
+    if compiled is None:
+        return None
+    sizes = _size_outputs(compiled)
+    if sizes is None:
+        return None
+    chunks = []
+    start = 0
+    length = breaks = 0
+    after_break = False
+    for output_index, (output_length, output_breaks,
+                       ends_with_break) in enumerate(sizes):
+        length += output_length
+        breaks += output_breaks
+        if length < chunk_size and output_index + 1 < len(sizes):
+            continue
+        # Spaces follow each line break but one the chunk ends with, and
+        # start the chunk if the previous one ended with a line break
+        size = (length + space_count * (breaks - ends_with_break) +
+                space_count * after_break)
+        chunks.append(
+            Chunk(index, start, output_index + 1, size, after_break))
+        start = output_index + 1
+        length = breaks = 0
+        after_break = ends_with_break
+    return chunks
+
+
+def render_chunk(iter_group, chunk, space_count):
+    """Returns the indented string of chunk of the generated string of
+    iter_group"""
+    if chunk.start is None:
+        generated = expand_iter_group(iter_group)
+    else:
+        generated = compile_group(iter_group).render(chunk.start, chunk.stop)
+    generated = add_spaces_to_lines(space_count, generated)
+    if chunk.indent_first:
+        generated = ' ' * space_count + generated
+    return generated
+
+
+def size_chunk(iter_group, chunk, space_count):
+    """Returns the UTF-8 length of the indented string of chunk"""
+    return _encoded_length(render_chunk(iter_group, chunk, space_count))
+
+
+def _write_at(output_file, offset, data):
+    """Writes data at offset of output_file through a memory map of the part
+    of the file holding it"""
+    start = offset - offset % mmap.ALLOCATIONGRANULARITY
+    mapped = mmap.mmap(output_file.fileno(), offset + len(data) - start,
+                       offset=start)
+    try:
+        mapped[offset - start:offset - start + len(data)] = data
+    finally:
+        mapped.close()
+
+
+def write_chunk(task):
+    """Renders a chunk into the output file at each of its offsets. task is a
+    tuple of (output file name, iter_group, chunk, space count, offsets, later
+    insertion points). Returns the ChunkEdges of the chunk."""
+    (output_file_name, iter_group, chunk, space_count, offsets,
+     later_points) = task
+    generated = render_chunk(iter_group, chunk, space_count)
+    data = generated.encode('utf-8')
+    if len(data) != chunk.size:
+        raise RuntimeError('Chunk of ' + iter_group.insertion_point +
+                           ' was sized as ' + str(chunk.size) +
+                           ' bytes but generated ' + str(len(data)))
+    if data:
+        with open(output_file_name, 'r+b') as output_file:
+            for offset in offsets:
+                _write_at(output_file, offset, data)
+    overlap = max([len(point) for point in later_points] or [1]) - 1
+    return ChunkEdges(generated[:overlap], generated[-overlap:]
+                      if overlap else '', len(generated) < overlap,
+                      any(point in generated for point in later_points))
+
+
+def _size_task(task):
+    iter_group, chunk, space_count = task
+    return size_chunk(iter_group, chunk, space_count)
+
+
+def _creates_insertion_point(points, overlap, before, edges, after):
+    """Returns whether a point in points, of at most overlap + 1 characters, is
+    formed in or across the borders of the chunks of a generated string, given
+    the ChunkEdges of each chunk and the source just before and after it"""
+    window = before
+    for chunk_edges in edges:
+        if chunk_edges.creates_insertion_point:
+            return True
+        if any(point in window + chunk_edges.head for point in points):
+            return True
+        if chunk_edges.short:
+            window = (window + chunk_edges.head)[-overlap:]
+        else:
+            window = chunk_edges.tail
+    return any(point in window + after for point in points)
+
+
+def render_parallel(source, iter_groups, output_file_name, map_tasks,
+                    chunk_size):
+    """Generates source with iter_groups into output_file_name as UTF-8, as
+    insert_in_source would for each group in turn. Chunks of about chunk_size
+    bytes are rendered into the preallocated output by calling map_tasks, which
+    behaves as the builtin map, with write_chunk and a list of tasks.
+    Returns the number of bytes written, or None, without writing
+    output_file_name, if the insertions depend on each other."""
+    insertion_points = [
+        iter_group.insertion_point for iter_group in iter_groups
+    ]
+    index = index_scaffold(source, insertion_points)
+    if index is None:
+        return None
+    group_chunks = []
+    unsized = []
+    for group_index, iter_group in enumerate(iter_groups):
+        space_count = index.space_counts[group_index]
+        chunks = plan_chunks(group_index, iter_group, space_count, chunk_size)
+        if chunks is None:
+            chunks = [Chunk(group_index, None, None, None, False)]
+            unsized.append((iter_group, chunks[0], space_count))
+        group_chunks.append(chunks)
+    # Groups which can't be sized from their values are generated to be sized,
+    # which also raises any error generating them does
+    for (iter_group, chunk, space_count), size in zip(
+            unsized, map_tasks(_size_task, unsized)):
+        group_chunks[chunk.index] = [chunk._replace(size=size)]
+    # Lay out the literal segments and each occurrence of each group
+    segments = [segment.encode('utf-8') for segment in index.segments]
+    replacement_sizes = [
+        sum(chunk.size for chunk in chunks) for chunks in group_chunks
+    ]
+    segment_offsets = [0]
+    occurrences = [[] for _ in iter_groups]
+    position = len(segments[0])
+    for (_, _, group_index), segment in zip(index.regions, segments[1:]):
+        occurrences[group_index].append(position)
+        position += replacement_sizes[group_index]
+        segment_offsets.append(position)
+        position += len(segment)
+    total_size = position
+    directory, base_name = os.path.split(os.path.abspath(output_file_name))
+    fd, temp_name = tempfile.mkstemp(prefix='.' + base_name + '.',
+                                     dir=directory)
+    try:
+        with os.fdopen(fd, 'r+b') as output_file:
+            output_file.truncate(total_size)
+            for offset, segment in zip(segment_offsets, segments):
+                if segment:
+                    _write_at(output_file, offset, segment)
+        tasks = []
+        for group_index, chunks in enumerate(group_chunks):
+            if not occurrences[group_index]:
+                continue
+            later_points = tuple(set(insertion_points[group_index + 1:]))
+            chunk_offset = 0
+            for chunk in chunks:
+                tasks.append((temp_name, iter_groups[group_index], chunk,
+                              index.space_counts[group_index], [
+                                  offset + chunk_offset
+                                  for offset in occurrences[group_index]
+                              ], later_points))
+                chunk_offset += chunk.size
+        edges = list(map_tasks(write_chunk, tasks))
+        if _creates_later_insertion_points(index, tasks, edges):
+            os.remove(temp_name)
+            return None
+        copy_file_mode(temp_name, output_file_name)
+        os.replace(temp_name, output_file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+    return total_size
+
+
+def _creates_later_insertion_points(index, tasks, edges):
+    """Returns whether the generated string of a group, rendered by tasks with
+    edges, creates a later insertion point in it or across its borders with
+    the source at any of its occurrences"""
+    group_edges = {}
+    for task, chunk_edges in zip(tasks, edges):
+        group_edges.setdefault(task[2].index, []).append(chunk_edges)
+    for group_index, chunk_edges in group_edges.items():
+        points = set(index.insertion_points[group_index + 1:])
+        if not points:
+            continue
+        overlap = max(len(point) for point in points) - 1
+        for start, end, region_index in index.regions:
+            if region_index != group_index:
+                continue
+            before = index.source[max(0, start - overlap):start]
+            after = index.source[end:end + overlap]
+            if _creates_insertion_point(points, overlap, before, chunk_edges,
+                                        after):
+                return True
+    return False
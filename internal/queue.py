@@ -0,0 +1,328 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import json
+import os
+import pickle
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import uuid
+from .funcs import make_dirs
+from .iters import expand_iter_group
+from .parallel import compile_group
+
+# A work queue is a directory on a filesystem shared by every host taking
+# part. A coordinator adds a run to it, a directory holding a file for each
+# task, and workers on any host take the tasks of every run in turn.
+# A worker takes a task by creating its lease file, which only one worker can
+# create, and touches the lease while it works so its modification time shows
+# the worker is alive. A lease which hasn't been touched for the lease time of
+# the run has expired, and any worker may take the task over by renaming the
+# lease away, which again only one worker can do, and creating its own. The
+# result of a task is written to a temporary file and renamed into place, so
+# it is only seen complete. Tasks are deterministic, so if a worker whose
+# lease expired finishes anyway its result is the same.
+# A run is ready once its run file is written, which is done after its tasks,
+# and is removed by its coordinator once it has read every result.
+# Lease times are compared with the modification times of lease files, so the
+# clocks of the hosts should agree to well within the lease time.
+
+# Default number of seconds a lease lasts without being touched
+DEFAULT_LEASE_SECONDS = 60.0
+
+# Default number of copies of a template generated in one task
+DEFAULT_TASK_ROWS = 1 << 16
+
+_RUN_FILE_NAME = 'run.json'
+
+
+def get_worker_id():
+    """Returns an id for this process which is unique across hosts"""
+    return (socket.gethostname() + '.' + str(os.getpid()) + '.' +
+            uuid.uuid4().hex[:8])
+
+
+def _runs_dir(queue_dir):
+    return os.path.join(queue_dir, 'runs')
+
+
+def _task_path(run_dir, task_id):
+    return os.path.join(run_dir, 'tasks', task_id)
+
+
+def _lease_path(run_dir, task_id):
+    return os.path.join(run_dir, 'leases', task_id)
+
+
+def _result_path(run_dir, task_id):
+    return os.path.join(run_dir, 'results', task_id)
+
+
+def _error_path(run_dir, task_id):
+    return os.path.join(run_dir, 'results', task_id + '.error')
+
+
+def _write_atomic(file_name, data):
+    """Writes the bytes data to a temporary file next to file_name and renames
+    it over file_name"""
+    directory, base_name = os.path.split(file_name)
+    fd, temp_name = tempfile.mkstemp(prefix='.' + base_name + '.',
+                                     dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as output_file:
+            output_file.write(data)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        if os.path.exists(temp_name):
+            os.remove(temp_name)
+        raise
+
+
+def split_iter_group(iter_group, task_rows=DEFAULT_TASK_ROWS):
+    """Returns a list of tasks generating the string of iter_group between
+    them, in order. A task is a tuple of (iter_group, start, stop), where start
+    and stop bound the outputs of the last insertion iterable it generates the
+    copies of, or are None for every copy. Groups whose copies can't be
+    generated separately are a single task."""
+    compiled = compile_group(iter_group)
+    if compiled is None:
+        return [(iter_group, None, None)]
+    last_count = len(compiled.output_lists[-1])
+    step = max(1, task_rows // (compiled.count_rows() // last_count))
+    return [(iter_group, start, min(start + step, last_count))
+            for start in range(0, last_count, step)]
+
+
+def run_task(task):
+    """Returns the part of the generated string of a group made by task"""
+    iter_group, start, stop = task
+    if start is None:
+        return expand_iter_group(iter_group)
+    return compile_group(iter_group).render(start, stop)
+
+
+def create_run(queue_dir, tasks, lease_seconds=DEFAULT_LEASE_SECONDS):
+    """Adds a run of tasks to the queue in queue_dir, and returns its
+    directory. Tasks are identified by their index in tasks."""
+    run_dir = os.path.join(_runs_dir(queue_dir), uuid.uuid4().hex)
+    for name in ['tasks', 'leases', 'results']:
+        make_dirs(os.path.join(run_dir, name))
+    task_ids = [str(index).zfill(8) for index in range(len(tasks))]
+    for task_id, task in zip(task_ids, tasks):
+        _write_atomic(_task_path(run_dir, task_id), pickle.dumps(task))
+    _write_atomic(
+        os.path.join(run_dir, _RUN_FILE_NAME),
+        json.dumps({
+            'lease_seconds': lease_seconds,
+            'task_count': len(tasks)
+        }).encode('utf-8'))
+    return run_dir
+
+
+def read_run(run_dir):
+    """Returns the run file of run_dir as a dict, or None if the run isn't
+    ready or has been removed"""
+    try:
+        with open(os.path.join(run_dir, _RUN_FILE_NAME), 'r') as run_file:
+            return json.load(run_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def take_lease(run_dir, task_id, worker_id, lease_seconds):
+    """Takes the lease of a task for worker_id if it is free or has expired.
+    Returns whether it was taken."""
+    lease_path = _lease_path(run_dir, task_id)
+    for _ in range(2):
+        try:
+            fd = os.open(lease_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            try:
+                if time.time() - os.stat(lease_path).st_mtime < lease_seconds:
+                    return False
+                # Only one of the workers finding the lease expired renames it
+                expired_path = lease_path + '.' + worker_id
+                os.rename(lease_path, expired_path)
+                os.remove(expired_path)
+            except OSError:
+                return False
+            continue
+        except OSError:
+            # The run was removed
+            return False
+        with os.fdopen(fd, 'w') as lease_file:
+            lease_file.write(worker_id)
+        return True
+    return False
+
+
+def _touch_lease(lease_path, interval, done):
+    """Touches the lease at lease_path every interval seconds until done is
+    set"""
+    while not done.wait(interval):
+        try:
+            os.utime(lease_path, None)
+        except OSError:
+            return
+
+
+def work_on(run_dir, task_id, lease_seconds, worker_id):
+    """Runs a task whose lease worker_id holds, writing its result or the
+    exception it raised, then gives the lease up unless another worker has
+    taken it over"""
+    lease_path = _lease_path(run_dir, task_id)
+    done = threading.Event()
+    toucher = threading.Thread(target=_touch_lease,
+                               args=(lease_path, lease_seconds / 4.0, done))
+    toucher.daemon = True
+    toucher.start()
+    try:
+        with open(_task_path(run_dir, task_id), 'rb') as task_file:
+            task = pickle.load(task_file)
+        try:
+            result = run_task(task).encode('utf-8')
+        except Exception as error:
+            try:
+                data = pickle.dumps(error)
+            except Exception:
+                data = pickle.dumps(RuntimeError(repr(error)))
+            _write_atomic(_error_path(run_dir, task_id), data)
+        else:
+            _write_atomic(_result_path(run_dir, task_id), result)
+    finally:
+        done.set()
+        toucher.join()
+        try:
+            with open(lease_path, 'r') as lease_file:
+                holder = lease_file.read()
+            if holder == worker_id:
+                os.remove(lease_path)
+        except OSError:
+            pass
+
+
+def _is_finished(run_dir, task_id):
+    return (os.path.exists(_result_path(run_dir, task_id))
+            or os.path.exists(_error_path(run_dir, task_id)))
+
+
+def claim_task(queue_dir, worker_id, run_dirs=None):
+    """Takes the lease of the first unfinished task of a ready run in
+    queue_dir, or of run_dirs if given, which isn't leased by a live worker.
+    Returns a tuple of the arguments of work_on for the task, or None if there
+    is no such task."""
+    if run_dirs is None:
+        try:
+            run_names = sorted(os.listdir(_runs_dir(queue_dir)))
+        except OSError:
+            return None
+        run_dirs = [
+            os.path.join(_runs_dir(queue_dir), name) for name in run_names
+        ]
+    for run_dir in run_dirs:
+        run = read_run(run_dir)
+        if run is None:
+            continue
+        try:
+            finished = set(os.listdir(os.path.join(run_dir, 'results')))
+        except OSError:
+            continue
+        for index in range(run['task_count']):
+            task_id = str(index).zfill(8)
+            if task_id in finished or task_id + '.error' in finished:
+                continue
+            if not take_lease(run_dir, task_id, worker_id,
+                              run['lease_seconds']):
+                continue
+            # The task may have finished since the results were listed
+            if not _is_finished(run_dir, task_id):
+                return run_dir, task_id, run['lease_seconds'], worker_id
+            try:
+                os.remove(_lease_path(run_dir, task_id))
+            except OSError:
+                pass
+    return None
+
+
+def work(queue_dir,
+         worker_id=None,
+         idle_timeout=None,
+         poll_interval=0.5,
+         run_dirs=None):
+    """Takes and runs tasks from the queue in queue_dir, or only from run_dirs
+    if given, until none has been found for idle_timeout seconds, or forever
+    if idle_timeout is None. Returns the number of tasks run."""
+    if worker_id is None:
+        worker_id = get_worker_id()
+    count = 0
+    idle_since = time.time()
+    while True:
+        claimed = claim_task(queue_dir, worker_id, run_dirs)
+        if claimed is not None:
+            try:
+                work_on(*claimed)
+            except OSError:
+                # The run may have been removed once another worker finished
+                # the task
+                if read_run(claimed[0]) is not None:
+                    raise
+            count += 1
+            idle_since = time.time()
+            continue
+        if (idle_timeout is not None
+                and time.time() - idle_since >= idle_timeout):
+            return count
+        time.sleep(poll_interval)
+
+
+def wait_for_run(run_dir, worker_id=None, take_part=True, poll_interval=0.1):
+    """Waits for every task of the run in run_dir to finish, running tasks in
+    this process too if take_part is True, and returns the list of results in
+    order. Raises the exception of the first task which raised one."""
+    if worker_id is None:
+        worker_id = get_worker_id()
+    run = read_run(run_dir)
+    task_ids = [str(index).zfill(8) for index in range(run['task_count'])]
+    while not all(_is_finished(run_dir, task_id) for task_id in task_ids):
+        claimed = None
+        if take_part:
+            claimed = claim_task(None, worker_id, [run_dir])
+        if claimed is not None:
+            work_on(*claimed)
+        else:
+            time.sleep(poll_interval)
+    results = []
+    for task_id in task_ids:
+        if os.path.exists(_error_path(run_dir, task_id)):
+            with open(_error_path(run_dir, task_id), 'rb') as error_file:
+                raise pickle.load(error_file)
+        with open(_result_path(run_dir, task_id), 'rb') as result_file:
+            results.append(result_file.read().decode('utf-8'))
+    return results
+
+
+def remove_run(run_dir):
+    """Removes a run once its results have been read. Its run file is removed
+    first so workers stop taking its tasks."""
+    try:
+        os.remove(os.path.join(run_dir, _RUN_FILE_NAME))
+    except OSError:
+        pass
+    shutil.rmtree(run_dir, ignore_errors=True)
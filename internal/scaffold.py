@@ -0,0 +1,241 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import itertools
+from bisect import bisect_right
+from .funcs import add_spaces_to_lines, find_all, get_space_count
+
+# A scaffold index records where a list of insertion points occur in a source,
+# the indentation each is inserted with and the literal segments of the source
+# between them, so that the result of calling insert_in_source for each
+# insertion point in turn can be built by joining the segments and the indented
+# replacement strings. An index can only be built where the insertion points
+# don't depend on each other's replacements, and rendering with it checks no
+# replacement creates a later insertion point. A replacement can also be
+# indented and checked a piece at a time as it is generated, see
+# iterate_indented.
+
+
+class CreatedInsertionPoint(Exception):
+    """Raised when a replacement creates an occurrence of a later insertion
+    point"""
+
+
+class ScaffoldIndex(object):
+    """The literal segments of a source and the insertion points between them.
+    regions is a list of (start, end, insertion index) for each occurrence of
+    an insertion point, in order of start, and space_counts holds the
+    indentation of each insertion point."""
+
+    def __init__(self, source, insertion_points, regions, space_counts):
+        self.source = source
+        self.insertion_points = insertion_points
+        self.regions = regions
+        self.space_counts = space_counts
+        self.segments = []
+        position = 0
+        for start, end, _ in regions:
+            self.segments.append(source[position:start])
+            position = end
+        self.segments.append(source[position:])
+
+    def get_later_points(self, index):
+        """Returns the set of insertion points after the one at index"""
+        return set(self.insertion_points[index + 1:])
+
+    def crosses_borders(self, index, head, tail, length):
+        """Returns whether a replacement of the given length for the insertion
+        point at index would create an occurrence of a later insertion point
+        across its borders with the source. head and tail are the first and
+        last characters of the replacement, at least as many as a later
+        insertion point is long, less one, or all of it if it is shorter."""
+        for point in self.get_later_points(index):
+            overlap = len(point) - 1
+            if not overlap:
+                continue
+            for start, end, region_index in self.regions:
+                if region_index != index:
+                    continue
+                before = self.source[max(0, start - overlap):start]
+                after = self.source[end:end + overlap]
+                if length < overlap:
+                    windows = [before + head + after]
+                else:
+                    windows = [
+                        before + head[:overlap],
+                        tail[len(tail) - overlap:] + after
+                    ]
+                if any(point in window for window in windows):
+                    return True
+        return False
+
+    def creates_insertion_point(self, index, replacement):
+        """Returns whether inserting replacement for the insertion point at
+        index would create an occurrence of a later insertion point, in the
+        replacement or across its borders with the source"""
+        if any(point in replacement for point in self.get_later_points(index)):
+            return True
+        return self.crosses_borders(index, replacement, replacement,
+                                    len(replacement))
+
+    def indent(self, index, replacement_string):
+        """Returns replacement_string indented for the insertion point at
+        index, or None if it would create a later insertion point"""
+        replacement = add_spaces_to_lines(self.space_counts[index],
+                                          replacement_string)
+        if self.creates_insertion_point(index, replacement):
+            return None
+        return replacement
+
+    def iterate_indented(self, index, pieces):
+        """Yields the replacement for the insertion point at index, given as
+        consecutive pieces of the replacement string, indented as by indent a
+        piece at a time. Raises CreatedInsertionPoint as soon as the
+        replacement creates a later insertion point."""
+        prefix = ' ' * self.space_counts[index]
+        points = self.get_later_points(index)
+        overlap = max([len(point) for point in points] or [1]) - 1
+        head = ''
+        tail = ''
+        length = 0
+        line_start = False
+        held = ''
+        for piece in itertools.chain(pieces, [None]):
+            if piece is None:
+                # The end of the replacement, where a held '\r' ends a line
+                text = held
+            else:
+                # A trailing '\r' is held back, as a '\n' may follow it
+                text = held + piece
+                held = text[-1:] if text.endswith('\r') else ''
+                text = text[:len(text) - len(held)]
+            if not text:
+                continue
+            lines = text.splitlines(True)
+            indented = ''.join(
+                prefix + line if line_number or line_start else line
+                for line_number, line in enumerate(lines))
+            line_start = lines[-1].splitlines() != [lines[-1]]
+            window = tail + indented
+            if any(point in window for point in points):
+                raise CreatedInsertionPoint()
+            if len(head) < overlap:
+                head += indented[:overlap - len(head)]
+            tail = window[max(0, len(window) - overlap):]
+            length += len(indented)
+            yield indented
+        if not length:
+            # An empty replacement fails as it does in insert_in_source
+            add_spaces_to_lines(self.space_counts[index], '')
+        if self.crosses_borders(index, head, tail, length):
+            raise CreatedInsertionPoint()
+
+    def render_spans(self, replacement_strings):
+        """Returns a tuple of the source with each insertion point replaced by
+        the replacement string at the same index, indented as by
+        insert_in_source, and a list of the [start, end] offsets in it of each
+        occurrence of each replacement. Returns None if a replacement creates
+        a later insertion point. replacement_strings can be a generator, and is
+        only read as far as the replacement creating an insertion point."""
+        replacements = []
+        for index, replacement_string in enumerate(replacement_strings):
+            replacement = self.indent(index, replacement_string)
+            if replacement is None:
+                return None
+            replacements.append(replacement)
+        pieces = [self.segments[0]]
+        spans = [[] for _ in replacements]
+        position = len(self.segments[0])
+        for (_, _, index), segment in zip(self.regions, self.segments[1:]):
+            replacement = replacements[index]
+            spans[index].append([position, position + len(replacement)])
+            pieces.append(replacement)
+            pieces.append(segment)
+            position += len(replacement) + len(segment)
+        return ''.join(pieces), spans
+
+    def render(self, replacement_strings):
+        """Returns the source rendered as by render_spans, or None if a
+        replacement creates a later insertion point"""
+        rendered = self.render_spans(replacement_strings)
+        if rendered is None:
+            return None
+        return rendered[0]
+
+    def iterate_pieces(self, get_replacement):
+        """Yields a tuple of (insertion index, string) for each piece of the
+        rendered source in order, with an index of None for the literal
+        segments. get_replacement is called with the index of each insertion
+        point as it is reached, and returns its indented replacement."""
+        yield None, self.segments[0]
+        for (_, _, index), segment in zip(self.regions, self.segments[1:]):
+            yield index, get_replacement(index)
+            yield None, segment
+
+
+def find_in_segments(source, point, regions):
+    """Returns the offsets of point in the parts of source outside of the
+    sorted regions, as str.replace would find them once each region has been
+    replaced"""
+    offsets = []
+    position = 0
+    for start, end, _ in regions + [(len(source), len(source), None)]:
+        offsets.extend(position + offset
+                       for offset in find_all(source[position:start], point))
+        position = end
+    return offsets
+
+
+def index_scaffold(source, insertion_points):
+    """Returns a ScaffoldIndex of insertion_points in source, or None if the
+    insertions can't be made independently of each other. This is the case if
+    an insertion point is empty or contains a line break, if an earlier
+    insertion is on or just after the line an insertion point is indented
+    from, or if
+    occurrences of different insertion points are closer than the length of
+    an insertion point, as a replacement could then form one between them."""
+    lines = source.splitlines(True)
+    line_starts = [0]
+    for line in lines:
+        line_starts.append(line_starts[-1] + len(line))
+    regions = []
+    space_counts = []
+    for index, point in enumerate(insertion_points):
+        if point.splitlines() != [point]:
+            return None
+        offsets = find_in_segments(source, point, regions)
+        # Get the indentation of the last line containing the insertion point
+        space_count = 0
+        if offsets:
+            line_index = bisect_right(line_starts, offsets[-1]) - 1
+            line_start = line_starts[line_index]
+            line_end = line_starts[line_index + 1]
+            # A region starting the next line could also join a line break
+            # onto the end of the line
+            if any(start <= line_end and line_start < end
+                   for start, end, _ in regions):
+                return None
+            space_count = get_space_count(lines[line_index])
+        space_counts.append(space_count)
+        regions = sorted(regions + [(offset, offset + len(point), index)
+                                    for offset in offsets])
+    gap = max([len(point) for point in insertion_points] or [0]) - 1
+    for (_, end, _), (start, _, _) in zip(regions, regions[1:]):
+        if start - end < gap:
+            return None
+    return ScaffoldIndex(source, tuple(insertion_points), regions,
+                         space_counts)
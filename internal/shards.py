@@ -0,0 +1,117 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import hashlib
+from bisect import bisect_left
+from ..iter_classes import EmitMode, ShardMode
+from .funcs import insert_in_source
+from .iters import (get_insertion_iterables, get_kept_rows, get_render,
+                    is_separable, merge_substitutions)
+
+# Sharding splits the copies of a group's template between several outputs.
+# Each copy is generated on its own, as by get_render, and the copies of a
+# shard are kept in the order the group generates them.
+# With ShardMode.hash a copy's shard is found from a hash of the keys and
+# values bound in it on a ring of points, with several points for each shard
+# spread around the ring. A copy belongs to the shard of the first point at or
+# after its hash. As the shard of a copy only depends on its own values, adding
+# or removing values only changes the shards of the copies using them, and
+# adding a shard only moves the copies now nearest one of its points.
+
+# Number of points on the ring for each shard
+_POINTS_PER_SHARD = 64
+
+
+def _hash_text(text):
+    """Returns a 64 bit hash of text which, unlike hash(), is stable between
+    processes"""
+    return int(hashlib.sha1(text.encode('utf-8')).hexdigest()[:16], 16)
+
+
+class HashRing(object):
+    """A consistent hash ring assigning keys to shard_count shards"""
+
+    def __init__(self, shard_count):
+        points = sorted(
+            (_hash_text('shard ' + str(shard) + ' point ' + str(point)), shard)
+            for shard in range(shard_count)
+            for point in range(_POINTS_PER_SHARD))
+        self.hashes = [point_hash for point_hash, _ in points]
+        self.shards = [shard for _, shard in points]
+
+    def get_shard(self, key):
+        """Returns the shard of the string key"""
+        index = bisect_left(self.hashes, _hash_text(key))
+        return self.shards[index % len(self.shards)]
+
+
+def get_binding_key(substitutions):
+    """Returns a string identifying the dict of keys and values bound in a copy
+    of a template, independently of the order of the keys"""
+    return '\n'.join(key + '=' + substitutions[key]
+                     for key in sorted(substitutions))
+
+
+def shard_iter_group(iter_group, shard_count, shard_mode=ShardMode.hash):
+    """Returns a list of shard_count lists holding the copies of the template
+    of iter_group in each shard, as split by shard_mode. Removed copies are
+    left out. Raises ValueError if iter_group doesn't use EmitMode.expanded,
+    its copies aren't separable, as by is_separable, or shard_count isn't
+    positive."""
+    if iter_group.emit_mode is not EmitMode.expanded:
+        raise ValueError('Only groups using EmitMode.expanded can be sharded')
+    if shard_count < 1:
+        raise ValueError('shard_count must be positive, got ' +
+                         str(shard_count))
+    if not is_separable(iter_group):
+        raise ValueError('The copies of a group whose later substitutions '
+                         'apply to the copies before them can\'t be sharded')
+    iterables = get_insertion_iterables(iter_group)
+    rows = list(get_kept_rows(iter_group))
+    render = get_render(iter_group)
+    shards = [[] for _ in range(shard_count)]
+    if shard_mode is ShardMode.position:
+        for index, outputs in enumerate(rows):
+            shards[index * shard_count // len(rows)].append(render(outputs))
+        return shards
+    ring = HashRing(shard_count)
+    for outputs in rows:
+        key = get_binding_key(merge_substitutions(iterables, outputs))
+        shards[ring.get_shard(key)].append(render(outputs))
+    return shards
+
+
+def insert_shard(source, insertion_point, copies):
+    """Inserts the copies of a shard at insertion_point in source as
+    insert_in_source does, removing the insertion point if there are none"""
+    if not copies:
+        return source.replace(insertion_point, '')
+    return insert_in_source(source, insertion_point, ''.join(copies))
+
+
+def generate_shard_sources(source, iter_groups, shard_count,
+                           shard_mode=ShardMode.hash):
+    """Returns a list of shard_count copies of source, each with the copies of
+    each of iter_groups in one shard inserted"""
+    sources = [source] * shard_count
+    for iter_group in iter_groups:
+        shards = shard_iter_group(iter_group, shard_count, shard_mode)
+        sources = [
+            insert_shard(shard_source, iter_group.insertion_point, copies)
+            for shard_source, copies in zip(sources, shards)
+        ]
+    return sources
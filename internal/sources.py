@@ -0,0 +1,266 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import mmap
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from ..iter_classes import (Iterable, IterGroup, RemovalIterGroup, ValueFile,
+                            ValueStream)
+
+# An Iterable's vals can be a value source. Another Iterable or group
+# generates the values: the values of an Iterable source are its joined
+# outputs, and those of a group are each copy of its template with one row of
+# outputs substituted, leaving out removed copies. A ValueFile or ValueStream
+# reads the values from a file or a factory function.
+# A source is only loaded when an Iterable using it is first enumerated, and
+# the values are kept by the content of the source, so every Iterable using an
+# equal source, at any level of nesting, shares them. The values of a source
+# reading a ValueFile, at any level, are also kept by the size and
+# modification time of the file, so they are loaded again if it changes.
+# Where the Itermode of an Iterable can enumerate a pool it only reads once,
+# such as product with an iter_modifier of 1 or zip, the values of a ValueFile
+# or ValueStream are streamed from the source on each enumeration rather than
+# loaded.
+# The time taken to load each source, and how often its kept values were used
+# or it was streamed, is recorded and returned by get_source_loads.
+
+_MAX_CACHED_SOURCES = 256
+
+SourceLoad = namedtuple('SourceLoad',
+                        ['source', 'values', 'seconds', 'hits', 'streams'])
+
+_cache = OrderedDict()
+_loads = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def is_value_source(vals):
+    return isinstance(
+        vals, (Iterable, IterGroup, RemovalIterGroup, ValueFile, ValueStream))
+
+
+def is_streamed_source(vals):
+    """Returns whether vals is a source its values can be streamed from"""
+    return isinstance(vals, (ValueFile, ValueStream))
+
+
+def _strip_line_ending(line):
+    return line.rstrip('\r\n')
+
+
+def iterate_file_values(value_file):
+    """Yields each value of value_file, reading the file as it goes"""
+    if not value_file.mapped:
+        # Lines are split on '\n' alone, as they are from the mapped file
+        with open(value_file.file_name, 'r', encoding=value_file.encoding,
+                  newline='\n') as input_file:
+            for line in input_file:
+                value = _strip_line_ending(line)
+                if value:
+                    yield value
+        return
+    with open(value_file.file_name, 'rb') as input_file:
+        if os.fstat(input_file.fileno()).st_size == 0:
+            return
+        mapped = mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            position = 0
+            size = len(mapped)
+            while position < size:
+                end = mapped.find(b'\n', position)
+                if end == -1:
+                    end = size
+                value = _strip_line_ending(mapped[position:end].decode(
+                    value_file.encoding))
+                position = end + 1
+                if value:
+                    yield value
+        finally:
+            mapped.close()
+
+
+def iterate_source_values(source):
+    """Yields each value generated by the value source"""
+    # Imported here as internal.modes and internal.iters resolve value sources
+    from .iters import get_render, iterate_rows, join_output
+    from .modes import iterate_outputs
+    if isinstance(source, ValueFile):
+        for value in iterate_file_values(source):
+            yield value
+        return
+    if isinstance(source, ValueStream):
+        for value in source.factory():
+            yield value
+        return
+    if isinstance(source, Iterable):
+        for output in iterate_outputs(source):
+            yield join_output(source, output)
+        return
+    render = get_render(source)
+    for outputs, kept in iterate_rows(source):
+        if kept:
+            yield render(outputs)
+
+
+def iterate_value_files(source):
+    """Yields each ValueFile source reads its values from, at any level of
+    nesting"""
+    if isinstance(source, ValueFile):
+        yield source
+        return
+    if isinstance(source, ValueStream):
+        return
+    if isinstance(source, Iterable):
+        vals = [source.vals] if is_value_source(source.vals) else source.vals
+        for val in vals:
+            if is_value_source(val):
+                for value_file in iterate_value_files(val):
+                    yield value_file
+        return
+    iterables = source.iterables if isinstance(source, IterGroup) else (
+        source.insertion_iterables + source.removal_iterables)
+    for iterable in iterables:
+        for value_file in iterate_value_files(iterable):
+            yield value_file
+
+
+def _get_cache_key(source):
+    """Returns the key the values of source are kept by, which includes the
+    size and modification time of each file it reads from"""
+    stats = []
+    for value_file in iterate_value_files(source):
+        stat = os.stat(value_file.file_name)
+        stats.append((stat.st_size, stat.st_mtime_ns))
+    if not stats:
+        return source
+    return (source, tuple(stats))
+
+
+def _record(source, **counts):
+    """Adds counts to the SourceLoad of source. Must hold _cache_lock."""
+    load = _loads.get(source, SourceLoad(source, 0, 0.0, 0, 0))
+    _loads[source] = load._replace(
+        **{name: getattr(load, name) + count
+           for name, count in counts.items()})
+
+
+def get_source_values(source):
+    """Returns the tuple of values generated by the value source, generating
+    them only the first time they are asked for"""
+    key = _get_cache_key(source)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            _record(source, hits=1)
+            return _cache[key]
+    # Generated outside of the lock, as generating a nested source takes it
+    start = time.perf_counter()
+    values = tuple(iterate_source_values(source))
+    seconds = time.perf_counter() - start
+    with _cache_lock:
+        _cache[key] = values
+        while len(_cache) > _MAX_CACHED_SOURCES:
+            _cache.popitem(last=False)
+        _record(source, values=len(values), seconds=seconds)
+    return values
+
+
+def stream_source_values(source):
+    """Yields each value of a ValueFile or ValueStream from the source, or
+    from its kept values if it was loaded already"""
+    key = _get_cache_key(source)
+    with _cache_lock:
+        values = _cache.get(key)
+        _record(source, **({'hits': 1} if values is not None else
+                           {'streams': 1}))
+    if values is None:
+        values = iterate_source_values(source)
+    for value in values:
+        yield value
+
+
+def open_vals(vals):
+    """Returns vals with any ValueFile or ValueStream, in place of vals or of
+    one of its nested lists, replaced by a generator streaming its values, and
+    any other value source by its values. Nothing is read until the
+    generators are iterated."""
+    if is_streamed_source(vals):
+        return stream_source_values(vals)
+    if is_value_source(vals):
+        return get_source_values(vals)
+    return tuple(
+        stream_source_values(val) if is_streamed_source(val) else
+        get_source_values(val) if is_value_source(val) else val
+        for val in vals)
+
+
+def has_streamed_source(vals):
+    """Returns whether vals, or one of its nested lists, is a ValueFile or
+    ValueStream"""
+    return is_streamed_source(vals) or (not is_value_source(vals) and any(
+        is_streamed_source(val) for val in vals))
+
+
+def clear_source_cache():
+    """Forgets the values of every value source, such as when the outputs of a
+    registered Itermode may have changed"""
+    with _cache_lock:
+        _cache.clear()
+
+
+def get_source_loads():
+    """Returns a list of a SourceLoad for each value source loaded or streamed
+    since the loads were last reset, holding the number of values loaded, the
+    seconds taken to load them, and how many times the loaded values were
+    used again or the source was streamed"""
+    with _cache_lock:
+        return list(_loads.values())
+
+
+def reset_source_loads():
+    with _cache_lock:
+        _loads.clear()
+
+
+def write_source_loads(stream=None):
+    """Writes a line for each SourceLoad, slowest first, to stream, stdout by
+    default. Returns the total seconds spent loading sources."""
+    if stream is None:
+        stream = sys.stdout
+    loads = sorted(get_source_loads(), key=lambda load: -load.seconds)
+    for load in loads:
+        stream.write(
+            repr(load.source) + ': ' + str(load.values) +
+            ' values loaded in ' + '%.3f' % load.seconds + 's, reused ' +
+            str(load.hits) + ' times, streamed ' + str(load.streams) +
+            ' times\n')
+    return sum(load.seconds for load in loads)
+
+
+def resolve_vals(vals):
+    """Returns vals with any value source, in place of vals or of one of its
+    nested lists, replaced by the tuple of its values"""
+    if is_value_source(vals):
+        return get_source_values(vals)
+    if not any(is_value_source(val) for val in vals):
+        return vals
+    return tuple(
+        get_source_values(val) if is_value_source(val) else val
+        for val in vals)
@@ -0,0 +1,170 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+# X-macro emission writes the outputs of a group as a table macro, with one
+# X(...) entry for each set of outputs, and the template as a single row macro
+# taking the template's keys as parameters. The table is then expanded with the
+# row macro by the C preprocessor, rather than by py_gen. The table macro is
+# left defined so it can be expanded again elsewhere.
+
+# Prefix of the row macro parameters, so the keys of the template can't clash
+# with other tokens in it
+PARAMETER_PREFIX = 'py_gen_'
+
+
+def get_template_keys(template):
+    """Returns the keys used in the string Template template, in order of their
+    first use"""
+    keys = []
+    for match in template.pattern.finditer(template.template):
+        key = match.group('named') or match.group('braced')
+        if key is not None and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def check_macro_argument(value):
+    """Raises ValueError if value can't be passed as a single macro argument,
+    which is the case if it has a comma outside of parentheses, unbalanced
+    parentheses, or a line break. Commas and parentheses in string and
+    character literals are ignored."""
+    depth = 0
+    quote = None
+    escaped = False
+    for char in value:
+        if quote:
+            if escaped:
+                escaped = False
+            elif char == '\\':
+                escaped = True
+            elif char == quote:
+                quote = None
+        elif char in '"\'':
+            quote = char
+        elif char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth < 0:
+                break
+        elif char == ',' and depth == 0:
+            depth = -1
+            break
+    if depth != 0 or quote or '\n' in value or '\r' in value:
+        raise ValueError(repr(value) + ' can\'t be used as a macro argument '
+                         'of an X-macro table')
+
+
+def is_identifier_char(char):
+    return char.isalnum() or char == '_'
+
+
+def get_row_body(template, parameters):
+    """Returns the lines of the row macro body for template, with each key in
+    parameters replaced by its macro parameter. A parameter next to an
+    identifier character is pasted to it with ##, and one inside a string
+    literal is stringized with # between the parts of the literal, as the
+    preprocessor substitutes neither. Other keys are left as they would be by
+    safe_substitute. Raises ValueError for a key in a character literal."""
+    text = template.template
+    pieces = []
+    quote = None
+    escaped = False
+    position = 0
+    for match in template.pattern.finditer(text):
+        for char in text[position:match.start()]:
+            if quote:
+                if escaped:
+                    escaped = False
+                elif char == '\\':
+                    escaped = True
+                elif char == quote:
+                    quote = None
+            elif char in '"\'':
+                quote = char
+        if match.start() > position:
+            pieces.append(text[position:match.start()])
+        position = match.end()
+        key = match.group('named') or match.group('braced')
+        if key not in parameters:
+            if match.group('escaped') is not None:
+                pieces.append(template.delimiter)
+            else:
+                pieces.append(match.group())
+            continue
+        parameter = PARAMETER_PREFIX + key
+        if quote == '"':
+            pieces.append('" #' + parameter + ' "')
+            continue
+        if quote:
+            raise ValueError('Templates emitted as an X-macro can\'t use a '
+                             'key in a character literal, got ' +
+                             repr(text))
+        if pieces and is_identifier_char(pieces[-1][-1:]):
+            pieces.append('##')
+        pieces.append(parameter)
+        if is_identifier_char(text[position:position + 1]):
+            pieces.append('##')
+    pieces.append(text[position:])
+    lines = ''.join(pieces).splitlines()
+    for line in lines:
+        if line.lstrip().startswith('#'):
+            raise ValueError('Templates emitted as an X-macro can\'t contain '
+                             'preprocessor directives, got ' + repr(line))
+        if '//' in line:
+            raise ValueError('Templates emitted as an X-macro can\'t contain '
+                             'line comments, got ' + repr(line))
+    return ['    ' + line for line in lines]
+
+
+def continue_lines(first_line, lines):
+    """Returns first_line followed by lines, joined with line continuations"""
+    return ' \\\n'.join([first_line] + lines) + '\n'
+
+
+def emit_xmacro(template, table_name, bindings):
+    """Returns the X-macro table named table_name of bindings, each a dict of
+    the keys and values to substitute into template once, followed by the row
+    macro for template and the expansion of the table with it. Only keys used
+    by template are written to the table, and each of bindings must have the
+    same such keys. Raises ValueError if template or a value can't be
+    written as a macro."""
+    row_name = table_name + '_ROW'
+    keys = get_template_keys(template)
+    parameters = None
+    entries = []
+    for binding in bindings:
+        row_keys = [key for key in keys if key in binding]
+        if parameters is None:
+            parameters = row_keys
+        elif row_keys != parameters:
+            raise ValueError('Every output of a group emitted as an X-macro '
+                             'must bind the same keys, got ' +
+                             ', '.join(parameters) + ' and ' +
+                             ', '.join(row_keys))
+        for key in parameters:
+            check_macro_argument(binding[key])
+        entries.append('    X(' + ', '.join(binding[key]
+                                            for key in parameters) + ')')
+    if parameters is None:
+        parameters = []
+    body = get_row_body(template, parameters)
+    return (continue_lines('#define ' + table_name + '(X)', entries) +
+            continue_lines(
+                '#define ' + row_name + '(' + ', '.join(
+                    PARAMETER_PREFIX + key for key in parameters) + ')', body) +
+            table_name + '(' + row_name + ')\n' + '#undef ' + row_name + '\n')
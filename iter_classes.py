@@ -15,56 +15,357 @@
 #   See the License for the specific language governing permissions and
 #   limitations under the License.
 
+import hashlib
+import re
 from enum import Enum
+from string import Template
 
 
 class Itermode(Enum):
-    """Enum of the supported combinatoric generators. Used to determine which
-    generator to use for each Iterable."""
+    """Enum of the built in combinatoric generators. Used to determine which
+    generator to use for each Iterable. Further generators can be added with
+    register_itermode."""
     product = 1
     permutations = 2
     combinations = 3
     combinationsWR = 4
     uninitialised = 5
+    powerset = 6
+    zip = 7
+    range = 8
+    chain = 9
+    grayProduct = 10
 
 
-class Iterable:
+class _FrozenSpec(object):
+    """Base class of the specification objects. Instances are immutable once
+    constructed, compare and hash by content and pickle as their constructor
+    arguments. Subclasses provide _args, the constructor arguments, and
+    _key, the content used for comparison and hashing."""
+    __slots__ = ('_hash', )
+
+    def _set(self, name, value):
+        object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError(type(self).__name__ + ' objects are immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError(type(self).__name__ + ' objects are immutable')
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._key() == other._key()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        try:
+            return self._hash
+        except AttributeError:
+            self._set('_hash', hash(self._key()))
+            return self._hash
+
+    def __reduce__(self):
+        return (type(self), self._args())
+
+    def __repr__(self):
+        return type(self).__name__ + repr(self._args())
+
+    def spec_hash(self):
+        """Returns a hex digest of the content of the object which, unlike
+        hash(), is stable between processes and python sessions."""
+        return hashlib.sha1(repr(self._key()).encode('utf-8')).hexdigest()
+
+
+class LengthPolicy(Enum):
+    """Enum of the ways a combined group handles Iterables producing different
+    numbers of outputs. strict requires every Iterable to produce the same
+    number, shortest stops once any Iterable is exhausted, and cycle restarts
+    shorter Iterables until the longest is exhausted."""
+    strict = 1
+    shortest = 2
+    cycle = 3
+
+
+class EmitMode(Enum):
+    """Enum of the ways a group's generated code is emitted. expanded inserts
+    the template once for every set of outputs, and xmacro inserts an X-macro
+    table of the outputs and a single macro instance of the template, which
+    the C preprocessor expands instead."""
+    expanded = 1
+    xmacro = 2
+
+
+class BindingForm(Enum):
+    """Enum of the forms bindings of a group are yielded in. dict yields a
+    dict of each key and the value substituted at it, tuple yields a tuple of
+    the values in the order of the group's binding keys, and raw yields a
+    tuple of the unjoined output tuple of each insertion Iterable."""
+    dict = 1
+    tuple = 2
+    raw = 3
+
+
+class ShardMode(Enum):
+    """Enum of the ways the copies of a group's template are split between
+    shards. position splits the copies into runs of consecutive copies, and
+    hash assigns each copy to a shard by a consistent hash of the values bound
+    in it, so adding or removing values only changes the shards the copies
+    using them are assigned to."""
+    position = 1
+    hash = 2
+
+
+_IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*\Z')
+
+
+def _is_value_source(vals):
+    """Returns whether vals is an Iterable or group whose generated strings are
+    used as values, or a ValueFile or ValueStream the values are read from"""
+    return isinstance(
+        vals, (Iterable, IterGroup, RemovalIterGroup, ValueFile, ValueStream))
+
+
+def _check_value_source(source):
+    """Checks a value source generates separate strings to use as values"""
+    if (isinstance(source, (IterGroup, RemovalIterGroup))
+            and source.emit_mode is not EmitMode.expanded):
+        raise ValueError('Groups used as values must use EmitMode.expanded')
+    return source
+
+
+def _freeze_vals(vals):
+    """Returns vals as a tuple, with any nested lists of values, as used by the
+    zip and chain Itermodes, also converted to tuples. vals, or any of its
+    nested lists, can instead be an Iterable or group used as a value source,
+    which is kept as it is."""
+    if _is_value_source(vals):
+        return _check_value_source(vals)
+    return tuple(
+        tuple(val) if isinstance(val, list) else
+        _check_value_source(val) if _is_value_source(val) else val
+        for val in vals)
+
+
+def _vals_key(vals):
+    """Returns the comparable content of the frozen vals of an Iterable"""
+    if _is_value_source(vals):
+        return (type(vals).__name__, vals._key())
+    return tuple(
+        _vals_key(val) if _is_value_source(val) else val for val in vals)
+
+
+def _template_key(template):
+    """Returns the comparable content of a string Template"""
+    return (type(template).__name__, template.template)
+
+
+def _check_iterables(iterables, name):
+    """Checks each element of iterables is an Iterable with a usable Itermode.
+    Returns the iterables as a tuple."""
+    iterables = tuple(iterables)
+    for iterable in iterables:
+        if not isinstance(iterable, Iterable):
+            raise TypeError(name + ' must only contain Iterable objects, got ' +
+                            repr(iterable))
+        if iterable.itermode is Itermode.uninitialised:
+            raise ValueError('Iterable ' + repr(iterable.key) +
+                             ' in ' + name + ' has no Itermode set')
+    return iterables
+
+
+def _check_combined_lengths(iterables, name, length_policy):
+    """Checks a list of iterables to be combined is not empty and, for the
+    strict length_policy, that every iterable produces the same number of
+    outputs."""
+    if not iterables:
+        raise ValueError(name + ' must not be empty when combine_iters is set')
+    if length_policy is not LengthPolicy.strict:
+        return
+    # Imported here as internal.modes depends on Itermode
+    from .internal.modes import count_outputs
+    counts = [count_outputs(iterable) for iterable in iterables]
+    if any(count != counts[0] for count in counts):
+        raise ValueError(
+            'combine_iters requires every Iterable in ' + name +
+            ' to produce the same number of outputs, got ' + ', '.join(
+                iterable.key + ': ' + str(count)
+                for iterable, count in zip(iterables, counts)))
+
+
+def _check_group(insertion_point, template, length_policy, emit_mode,
+                 table_name):
+    """Checks the insertion point, template, length policy and emission
+    arguments shared by both group types"""
+    if not isinstance(insertion_point, str):
+        raise TypeError('insertion_point must be a str, got ' +
+                        repr(insertion_point))
+    if not isinstance(template, Template):
+        raise TypeError('template must be a string Template, got ' +
+                        repr(template))
+    if not isinstance(length_policy, LengthPolicy):
+        raise TypeError('length_policy must be a LengthPolicy, got ' +
+                        repr(length_policy))
+    if not isinstance(emit_mode, EmitMode):
+        raise TypeError('emit_mode must be an EmitMode, got ' +
+                        repr(emit_mode))
+    if emit_mode is EmitMode.xmacro and not (isinstance(table_name, str)
+                                             and _IDENTIFIER.match(table_name)):
+        raise ValueError('EmitMode.xmacro requires table_name to be a C '
+                         'identifier, got ' + repr(table_name))
+
+
+def _check_derived_keys(derived_keys):
+    """Checks each element of derived_keys is a DerivedKey. Returns the
+    derived keys as a tuple."""
+    derived_keys = tuple(derived_keys)
+    for derived_key in derived_keys:
+        if not isinstance(derived_key, DerivedKey):
+            raise TypeError('derived_keys must only contain DerivedKey '
+                            'objects, got ' + repr(derived_key))
+    return derived_keys
+
+
+def _check_segments(segments, emit_mode):
+    """Checks each element of segments is a ConditionalSegment with its own
+    key, and that the group is expanded. Returns the segments as a tuple."""
+    segments = tuple(segments)
+    keys = set()
+    for segment in segments:
+        if not isinstance(segment, ConditionalSegment):
+            raise TypeError('segments must only contain ConditionalSegment '
+                            'objects, got ' + repr(segment))
+        if segment.key in keys:
+            raise ValueError('segments must each have a different key, got ' +
+                             repr(segment.key) + ' twice')
+        keys.add(segment.key)
+    if segments and emit_mode is not EmitMode.expanded:
+        raise ValueError('Groups with segments must use EmitMode.expanded')
+    return segments
+
+
+def _optional_args(*args):
+    """Returns the trailing constructor arguments of a group which are empty
+    by default, leaving out those which are empty at the end, so groups not
+    using them pickle, print and hash as they did before they were added"""
+    args = list(args)
+    while args and not args[-1]:
+        args.pop()
+    return tuple(args)
+
+
+def _optional_key(*args):
+    """Returns the comparable content of the trailing constructor arguments
+    of a group, each a tuple of specs, left out as by _optional_args"""
+    return _optional_args(*[tuple(spec._key() for spec in specs)
+                            for specs in args])
+
+
+class Iterable(_FrozenSpec):
     """Describes a set of values, a combinatoric generator to use on them, and
-    a key to insert the results into a template with."""
+    a key to insert the results into a template with. If bind_elements is True,
+    each element of a result is also inserted at its own key, key_0, key_1 and
+    so on, alongside the joined result at key.
+    vals, or one of the nested lists of vals used by the zip and chain
+    Itermodes, can be another Iterable, IterGroup or RemovalIterGroup, whose
+    generated strings are used as the values. They are generated when the
+    values are first needed, and shared by every Iterable using the same
+    source."""
+    __slots__ = ('key', 'vals', 'itermode', 'iter_modifier', 'comma_list',
+                 'bind_elements')
 
     def __init__(self,
                  key='',
-                 vals=[],
+                 vals=(),
                  itermode=Itermode.uninitialised,
                  iter_modifier=1,
-                 comma_list=False):
-        self.key = key
-        self.vals = vals
-        self.itermode = itermode
-        self.iter_modifier = iter_modifier
-        self.comma_list = comma_list
+                 comma_list=False,
+                 bind_elements=False):
+        # Imported here as internal.modes depends on Itermode
+        from .internal.modes import is_registered
+        if not (itermode is Itermode.uninitialised
+                or is_registered(itermode)):
+            raise TypeError('itermode must be an Itermode or registered with '
+                            'register_itermode, got ' + repr(itermode))
+        if (isinstance(iter_modifier, bool)
+                or not isinstance(iter_modifier, int) or iter_modifier < 0):
+            raise ValueError('iter_modifier must be a non-negative int, got ' +
+                             repr(iter_modifier))
+        self._set('key', key)
+        self._set('vals', _freeze_vals(vals))
+        self._set('itermode', itermode)
+        self._set('iter_modifier', iter_modifier)
+        self._set('comma_list', bool(comma_list))
+        self._set('bind_elements', bool(bind_elements))
+
+    def _args(self):
+        return (self.key, self.vals, self.itermode, self.iter_modifier,
+                self.comma_list, self.bind_elements)
 
+    def _key(self):
+        return (self.key, _vals_key(self.vals), self.itermode,
+                self.iter_modifier, self.comma_list, self.bind_elements)
 
-class IterGroup:
+
+class IterGroup(_FrozenSpec):
     """Groups together an insertion point, string Template, and list of
     iterables. If combine_iters == True, the iterables must all produce the same
-    number of results. combine_iters = False will use all of one Iterables
-    generations before moving on to the next Iterable. combine_iters = True will
-    use the 1->nth result of each Iterable at the same time, until all
-    generations have been exhausted."""
+    number of results, unless a different length_policy is given.
+    combine_iters = False will use all of one Iterables generations before
+    moving on to the next Iterable. combine_iters = True will use the 1->nth
+    result of each Iterable at the same time, until all generations have been
+    exhausted.
+    emit_mode sets how the generated code is emitted, see EmitMode. For
+    EmitMode.xmacro, table_name is the name of the emitted table macro.
+    derived_keys is a list of DerivedKey objects, whose values are computed
+    from the values bound in each copy of the template and substituted after
+    those of the iterables. segments is a list of ConditionalSegment objects,
+    choosing the text of parts of the template for each copy."""
+    __slots__ = ('insertion_point', 'template', 'iterables', 'combine_iters',
+                 'length_policy', 'emit_mode', 'table_name', 'derived_keys',
+                 'segments')
 
     def __init__(self,
                  insertion_point,
                  template,
                  iterables,
-                 combine_iters=False):
-        self.insertion_point = insertion_point
-        self.template = template
-        self.iterables = iterables
-        self.combine_iters = combine_iters
+                 combine_iters=False,
+                 length_policy=LengthPolicy.strict,
+                 emit_mode=EmitMode.expanded,
+                 table_name='',
+                 derived_keys=(),
+                 segments=()):
+        _check_group(insertion_point, template, length_policy, emit_mode,
+                     table_name)
+        iterables = _check_iterables(iterables, 'iterables')
+        if combine_iters:
+            _check_combined_lengths(iterables, 'iterables', length_policy)
+        self._set('insertion_point', insertion_point)
+        self._set('template', template)
+        self._set('iterables', iterables)
+        self._set('combine_iters', bool(combine_iters))
+        self._set('length_policy', length_policy)
+        self._set('emit_mode', emit_mode)
+        self._set('table_name', table_name)
+        self._set('derived_keys', _check_derived_keys(derived_keys))
+        self._set('segments', _check_segments(segments, emit_mode))
+
+    def _args(self):
+        return (self.insertion_point, self.template, self.iterables,
+                self.combine_iters, self.length_policy, self.emit_mode,
+                self.table_name) + _optional_args(self.derived_keys,
+                                                  self.segments)
 
+    def _key(self):
+        return (self.insertion_point, _template_key(self.template),
+                tuple(iterable._key() for iterable in self.iterables),
+                self.combine_iters, self.length_policy, self.emit_mode,
+                self.table_name) + _optional_key(self.derived_keys,
+                                                 self.segments)
 
-class RemovalIterGroup:
+
+class RemovalIterGroup(_FrozenSpec):
     """Groups together an insertion point, string Template, and two lists of
     iterables. The first list of iterables will be used to generate combinations
     of their inputs. Each output generated by the second list will then be
@@ -74,16 +375,260 @@ class RemovalIterGroup:
     same number of results. combine_iters = False will use all of one Iterables
     generations before moving on to the next Iterable. combine_iters = True will
     use the 1-nth result of each Iterable at the same time, until all
-    generations have been exhausted."""
+    generations have been exhausted. length_policy, emit_mode, table_name,
+    derived_keys and segments are used as by IterGroup."""
+    __slots__ = ('insertion_point', 'template', 'insertion_iterables',
+                 'removal_iterables', 'combine_iters', 'length_policy',
+                 'emit_mode', 'table_name', 'derived_keys', 'segments')
 
     def __init__(self,
                  insertion_point,
                  template,
                  insertion_iterables,
                  removal_iterables,
-                 combine_iters=False):
-        self.insertion_point = insertion_point
-        self.template = template
-        self.insertion_iterables = insertion_iterables
-        self.removal_iterables = removal_iterables
-        self.combine_iters = combine_iters
+                 combine_iters=False,
+                 length_policy=LengthPolicy.strict,
+                 emit_mode=EmitMode.expanded,
+                 table_name='',
+                 derived_keys=(),
+                 segments=()):
+        _check_group(insertion_point, template, length_policy, emit_mode,
+                     table_name)
+        insertion_iterables = _check_iterables(insertion_iterables,
+                                               'insertion_iterables')
+        removal_iterables = _check_iterables(removal_iterables,
+                                             'removal_iterables')
+        if combine_iters:
+            _check_combined_lengths(insertion_iterables, 'insertion_iterables',
+                                    length_policy)
+        self._set('insertion_point', insertion_point)
+        self._set('template', template)
+        self._set('insertion_iterables', insertion_iterables)
+        self._set('removal_iterables', removal_iterables)
+        self._set('combine_iters', bool(combine_iters))
+        self._set('length_policy', length_policy)
+        self._set('emit_mode', emit_mode)
+        self._set('table_name', table_name)
+        self._set('derived_keys', _check_derived_keys(derived_keys))
+        self._set('segments', _check_segments(segments, emit_mode))
+
+    def _args(self):
+        return (self.insertion_point, self.template, self.insertion_iterables,
+                self.removal_iterables, self.combine_iters, self.length_policy,
+                self.emit_mode, self.table_name) + _optional_args(
+                    self.derived_keys, self.segments)
+
+    def _key(self):
+        return (self.insertion_point, _template_key(self.template),
+                tuple(iterable._key() for iterable in self.insertion_iterables),
+                tuple(iterable._key() for iterable in self.removal_iterables),
+                self.combine_iters, self.length_policy, self.emit_mode,
+                self.table_name) + _optional_key(self.derived_keys,
+                                                 self.segments)
+
+
+class _FileContent(object):
+    """Stands for the content of a file in the key of a spec. Keys compare and
+    hash the name of the file, so a spec is the same spec when its file is
+    changed. Its repr, which spec_hash is made from, is a digest of the
+    content of the file, so the spec_hash of a spec changes with its file."""
+    __slots__ = ('file_name', )
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+
+    def __eq__(self, other):
+        return (isinstance(other, _FileContent)
+                and self.file_name == other.file_name)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.file_name)
+
+    def __repr__(self):
+        digest = hashlib.sha1()
+        try:
+            with open(self.file_name, 'rb') as input_file:
+                for block in iter(lambda: input_file.read(1 << 20), b''):
+                    digest.update(block)
+        except (IOError, OSError):
+            return repr((self.file_name, None))
+        return repr((self.file_name, digest.hexdigest()))
+
+
+class ValueFile(_FrozenSpec):
+    """Values read from a text file, one on each line, to use as the vals of
+    an Iterable. Line endings are stripped and empty lines are skipped. If
+    mapped is True the file is memory mapped rather than read a line at a
+    time. ValueFiles of the same file compare equal, while the spec_hash of a
+    ValueFile is made from the content of the file, so anything kept by the
+    spec_hash is made again when the file changes."""
+    __slots__ = ('file_name', 'mapped', 'encoding')
+
+    def __init__(self, file_name, mapped=False, encoding='utf-8'):
+        if not isinstance(file_name, str):
+            raise TypeError('file_name must be a str, got ' + repr(file_name))
+        self._set('file_name', file_name)
+        self._set('mapped', bool(mapped))
+        self._set('encoding', encoding)
+
+    def _args(self):
+        return (self.file_name, self.mapped, self.encoding)
+
+    def _key(self):
+        return (_FileContent(self.file_name), self.mapped, self.encoding)
+
+
+class ValueStream(_FrozenSpec):
+    """Values produced by calling factory, to use as the vals of an Iterable.
+    factory is called with no arguments each time the values are read, and
+    returns an iterable of the values, such as a generator. name identifies
+    the values, so streams with the same name and factory are the same
+    values, and the spec_hash of a stream is made from its name and the
+    qualified name of its factory, as for DerivedKey."""
+    __slots__ = ('name', 'factory')
+
+    def __init__(self, name, factory):
+        if not callable(factory):
+            raise TypeError('factory must be callable, got ' + repr(factory))
+        self._set('name', name)
+        self._set('factory', factory)
+
+    def _args(self):
+        return (self.name, self.factory)
+
+    def _key(self):
+        return (self.name, _CallableKey(self.factory, 'ValueStream factory'))
+
+
+def stable_name(func, kind):
+    """Returns a tuple of the module and qualified name of func, which
+    identify it between processes. Raises ValueError if func is a lambda or
+    a function nested in another function, as functions with the same
+    qualified name can then be different functions, or has no qualified
+    name."""
+    qualname = getattr(func, '__qualname__', None)
+    if (not isinstance(qualname, str) or '<lambda>' in qualname
+            or '<locals>' in qualname):
+        raise ValueError(
+            kind + ' ' + repr(func) + ' isn\'t identified between processes '
+            'by its name, so it can\'t be used where a spec_hash is needed. '
+            'Use a function defined at the top level of a module.')
+    return (getattr(func, '__module__', None), qualname)
+
+
+class _CallableKey(object):
+    """Stands for a function in the key of a spec. Keys compare and hash the
+    function itself, so specs using different functions with the same name,
+    such as two lambdas, are different. Its repr, which spec_hash is made
+    from, is the stable_name of the function."""
+    __slots__ = ('func', 'kind')
+
+    def __init__(self, func, kind):
+        self.func = func
+        self.kind = kind
+
+    def __eq__(self, other):
+        return isinstance(other, _CallableKey) and self.func == other.func
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.func)
+
+    def __repr__(self):
+        return repr(stable_name(self.func, self.kind))
+
+
+def _check_arg_keys(arg_keys):
+    """Checks arg_keys is a str or a list of str. Returns it as a tuple."""
+    if isinstance(arg_keys, str):
+        arg_keys = (arg_keys, )
+    arg_keys = tuple(arg_keys)
+    if not all(isinstance(arg_key, str) for arg_key in arg_keys):
+        raise TypeError('arg_keys must only contain str, got ' +
+                        repr(arg_keys))
+    return arg_keys
+
+
+def _check_cache_size(cache_size):
+    if cache_size is not None and (isinstance(cache_size, bool)
+                                   or not isinstance(cache_size, int)
+                                   or cache_size < 1):
+        raise ValueError('cache_size must be a positive int or None, got ' +
+                         repr(cache_size))
+
+
+class DerivedKey(_FrozenSpec):
+    """A key whose value in each copy of the template of a group is computed
+    by calling func with the values of arg_keys bound in the copy, in order.
+    arg_keys can be keys bound by the insertion iterables of the group or
+    earlier derived keys of the group, and func must return a str. func is
+    called once for each different set of arguments, with up to cache_size
+    results kept, or every result if cache_size is None.
+    Derived keys with different functions are different, while the spec_hash
+    of a derived key is made from its key, arg_keys and the qualified name of
+    func, so spec_hash raises a ValueError if func is a lambda or nested
+    function, see stable_name."""
+    __slots__ = ('key', 'func', 'arg_keys', 'cache_size')
+
+    def __init__(self, key, func, arg_keys, cache_size=4096):
+        if not isinstance(key, str):
+            raise TypeError('key must be a str, got ' + repr(key))
+        if not callable(func):
+            raise TypeError('func must be callable, got ' + repr(func))
+        arg_keys = _check_arg_keys(arg_keys)
+        _check_cache_size(cache_size)
+        self._set('key', key)
+        self._set('func', func)
+        self._set('arg_keys', arg_keys)
+        self._set('cache_size', cache_size)
+
+    def _args(self):
+        return (self.key, self.func, self.arg_keys, self.cache_size)
+
+    def _key(self):
+        return (self.key, _CallableKey(self.func, 'Derived key function'),
+                self.arg_keys, self.cache_size)
+
+
+class ConditionalSegment(_FrozenSpec):
+    """A part of the template of a group whose text depends on the values
+    bound in each copy. The key of the segment is replaced in the template by
+    segment in the copies for which guard, called with the values bound at
+    arg_keys, returns True, and by otherwise in the others. The chosen text
+    is then substituted as the rest of the template. arg_keys can be keys
+    bound by the insertion iterables or derived keys of the group. guard is
+    called once for each different set of arguments, up to cache_size, and
+    guard identifies the segment as func does a DerivedKey."""
+    __slots__ = ('key', 'guard', 'arg_keys', 'segment', 'otherwise',
+                 'cache_size')
+
+    def __init__(self, key, guard, arg_keys, segment, otherwise='',
+                 cache_size=4096):
+        if not isinstance(key, str):
+            raise TypeError('key must be a str, got ' + repr(key))
+        if not callable(guard):
+            raise TypeError('guard must be callable, got ' + repr(guard))
+        arg_keys = _check_arg_keys(arg_keys)
+        if not (isinstance(segment, str) and isinstance(otherwise, str)):
+            raise TypeError('segment and otherwise must be str, got ' +
+                            repr(segment) + ' and ' + repr(otherwise))
+        _check_cache_size(cache_size)
+        self._set('key', key)
+        self._set('guard', guard)
+        self._set('arg_keys', arg_keys)
+        self._set('segment', segment)
+        self._set('otherwise', otherwise)
+        self._set('cache_size', cache_size)
+
+    def _args(self):
+        return (self.key, self.guard, self.arg_keys, self.segment,
+                self.otherwise, self.cache_size)
+
+    def _key(self):
+        return (self.key, _CallableKey(self.guard, 'Segment guard'),
+                self.arg_keys, self.segment, self.otherwise, self.cache_size)
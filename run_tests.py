@@ -18,12 +18,50 @@
 from .testing.test_funcs import run_func_tests as run_func_tests_internal
 from .testing.test_interface import run_interface_tests as run_interface_tests_internal
 from .testing.test_iters import run_iter_tests as run_iter_tests_internal
+from .testing.test_iter_classes import run_iter_class_tests as run_iter_class_tests_internal
+from .testing.test_async_interface import run_async_interface_tests as run_async_interface_tests_internal
+from .testing.test_modes import run_mode_tests as run_mode_tests_internal
+from .testing.test_locking import run_locking_tests as run_locking_tests_internal
+from .testing.test_equivalence import run_equivalence_tests as run_equivalence_tests_internal
+from .testing.test_tables import run_table_tests as run_table_tests_internal
+from .testing.test_incremental import run_incremental_tests as run_incremental_tests_internal
+from .testing.test_source_template import run_source_template_tests as run_source_template_tests_internal
+from .testing.test_check import run_check_tests as run_check_tests_internal
+from .testing.test_sources import run_source_tests as run_source_tests_internal
+from .testing.test_dedup import run_dedup_tests as run_dedup_tests_internal
+from .testing.test_jobserver import run_jobserver_tests as run_jobserver_tests_internal
+from .testing.test_streams import run_stream_tests as run_stream_tests_internal
+from .testing.test_parallel import run_parallel_tests as run_parallel_tests_internal
+from .testing.test_shards import run_shard_tests as run_shard_tests_internal
+from .testing.test_checkpoint import run_checkpoint_tests as run_checkpoint_tests_internal
+from .testing.test_queue import run_queue_tests as run_queue_tests_internal
+from .testing.test_derived import run_derived_tests as run_derived_tests_internal
+from .testing.test_segments import run_segment_tests as run_segment_tests_internal
 
 
 def run_all_tests():
     run_func_tests()
     run_interface_tests()
     run_iter_tests_internal()
+    run_iter_class_tests()
+    run_async_interface_tests()
+    run_mode_tests()
+    run_locking_tests()
+    run_equivalence_tests()
+    run_table_tests()
+    run_incremental_tests()
+    run_source_template_tests()
+    run_check_tests()
+    run_source_tests()
+    run_dedup_tests()
+    run_jobserver_tests()
+    run_stream_tests()
+    run_parallel_tests()
+    run_shard_tests()
+    run_checkpoint_tests()
+    run_queue_tests()
+    run_derived_tests()
+    run_segment_tests()
 
 
 def run_func_tests():
@@ -36,3 +74,79 @@ def run_interface_tests():
 
 def run_iter_tests():
     run_iter_tests_internal()
+
+
+def run_iter_class_tests():
+    run_iter_class_tests_internal()
+
+
+def run_async_interface_tests():
+    run_async_interface_tests_internal()
+
+
+def run_mode_tests():
+    run_mode_tests_internal()
+
+
+def run_locking_tests():
+    run_locking_tests_internal()
+
+
+def run_equivalence_tests(seed=0, iterations=150):
+    run_equivalence_tests_internal(seed, iterations)
+
+
+def run_table_tests():
+    run_table_tests_internal()
+
+
+def run_incremental_tests():
+    run_incremental_tests_internal()
+
+
+def run_source_template_tests():
+    run_source_template_tests_internal()
+
+
+def run_check_tests():
+    run_check_tests_internal()
+
+
+def run_source_tests():
+    run_source_tests_internal()
+
+
+def run_dedup_tests():
+    run_dedup_tests_internal()
+
+
+def run_jobserver_tests():
+    run_jobserver_tests_internal()
+
+
+def run_stream_tests():
+    run_stream_tests_internal()
+
+
+def run_parallel_tests():
+    run_parallel_tests_internal()
+
+
+def run_shard_tests():
+    run_shard_tests_internal()
+
+
+def run_checkpoint_tests():
+    run_checkpoint_tests_internal()
+
+
+def run_queue_tests():
+    run_queue_tests_internal()
+
+
+def run_derived_tests():
+    run_derived_tests_internal()
+
+
+def run_segment_tests():
+    run_segment_tests_internal()
@@ -0,0 +1,115 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import threading
+from py_gen.internal.funcs import (read_from_file, insert_in_source,
+                                   write_to_file, clang_format, make_dirs)
+from py_gen.internal.incremental import expand_iter_group_incremental
+from py_gen.internal.iters import expand_iter_group
+from py_gen.internal.scaffold import index_scaffold
+
+
+class SourceTemplate(object):
+    """An input source which is read and indexed once, and from which any
+    number of outputs can be generated with different iter_groups. The
+    offsets, indentation and literal segments of the source around each list
+    of insertion points used are indexed on first use and kept, so generating
+    again with groups using the same insertion points doesn't scan the source.
+
+    insertion_point_lists is an optional list of lists of insertion points to
+    index on construction. A SourceTemplate can be shared between threads, and
+    pickles as its source and the insertion points it has indexed, which are
+    indexed again when unpickled."""
+
+    def __init__(self, source, insertion_point_lists=()):
+        self.source = source
+        self._indexes = {}
+        self._lock = threading.Lock()
+        for insertion_points in insertion_point_lists:
+            self._get_index(tuple(insertion_points))
+
+    @classmethod
+    def from_file(cls, input_file_name, insertion_point_lists=()):
+        """Returns a SourceTemplate of the source read from input_file_name"""
+        return cls(read_from_file(input_file_name), insertion_point_lists)
+
+    def __reduce__(self):
+        with self._lock:
+            insertion_point_lists = list(self._indexes)
+        return (type(self), (self.source, insertion_point_lists))
+
+    def _get_index(self, insertion_points):
+        """Returns the ScaffoldIndex of insertion_points, or None if they
+        can't be inserted independently, indexing them on first use"""
+        with self._lock:
+            if insertion_points in self._indexes:
+                return self._indexes[insertion_points]
+        index = index_scaffold(self.source, insertion_points)
+        with self._lock:
+            return self._indexes.setdefault(insertion_points, index)
+
+    def render(self, iter_groups, state_dir=None):
+        """Returns the source generated with iter_groups, as generate_source
+        would return it for this source. state_dir is used for incremental
+        generation as by generate_source."""
+        iter_groups = list(iter_groups)
+        if state_dir is not None:
+            make_dirs(state_dir)
+        expanded = []
+
+        def expand(iter_group):
+            if state_dir is None:
+                return expand_iter_group(iter_group)
+            return expand_iter_group_incremental(iter_group, state_dir)
+
+        def expand_all():
+            for iter_group in iter_groups:
+                expanded.append(expand(iter_group))
+                yield expanded[-1]
+
+        index = self._get_index(
+            tuple(iter_group.insertion_point for iter_group in iter_groups))
+        if index is not None:
+            source = index.render(expand_all())
+            if source is not None:
+                return source
+        # Insert the groups one at a time where the index can't be used,
+        # reusing any already generated
+        source = self.source
+        for position, iter_group in enumerate(iter_groups):
+            if position < len(expanded):
+                replacement_string = expanded[position]
+            else:
+                replacement_string = expand(iter_group)
+            source = insert_in_source(source, iter_group.insertion_point,
+                                      replacement_string)
+        return source
+
+    def render_to_file(self,
+                       output_file_name,
+                       iter_groups,
+                       format_generated=False,
+                       format_script="",
+                       state_dir=None):
+        """Writes the source generated with iter_groups to output_file_name,
+        formatting it as by generate_file if format_generated is True. Returns
+        the generated source."""
+        source = self.render(iter_groups, state_dir)
+        write_to_file(output_file_name, source)
+        if format_generated:
+            clang_format(output_file_name, format_script)
+        return source
@@ -0,0 +1,33 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+from string import Template
+from ..iter_classes import Iterable, Itermode, IterGroup
+
+# Template of the groups made by make_group unless another is given
+TEMPLATE_TEXT = 'template void f<${T}, ${N}>();\n'
+
+
+def make_group(types, sizes, template=TEMPLATE_TEXT, insertion_point='@ip@',
+               **kwargs):
+    """Returns an IterGroup substituting the product of types, as the key T,
+    and sizes, as the key N, into the template text template. Other keyword
+    arguments are passed to IterGroup."""
+    return IterGroup(insertion_point, Template(template), [
+        Iterable('T', list(types), Itermode.product),
+        Iterable('N', list(sizes), Itermode.product)
+    ], **kwargs)
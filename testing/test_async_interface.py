@@ -0,0 +1,112 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from string import Template
+from ..async_interface import (generate_source_async, generate_file_async,
+                               generate_files_async)
+from ..interface import generate_source
+from ..iter_classes import Itermode, Iterable, IterGroup
+
+
+def run_coroutine(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestAsyncInterface(unittest.TestCase):
+    """Tests each function in the async_interface file. Each function is tested
+    in a separate method."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.iter_groups = [
+            IterGroup('@ip1@', Template('a ${key0} c ${key1} e\n'), [
+                Iterable('key0', ['a', 'b', 'c'], Itermode.combinations, 2),
+                Iterable('key1', ['a', 'b'], Itermode.product, 2)
+            ])
+        ]
+        self.source = 'Line one\n  @ip1@\nEnding line'
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_generate_source_async(self):
+        self.assertEqual(
+            generate_source(self.source, self.iter_groups),
+            run_coroutine(
+                generate_source_async(self.source, self.iter_groups)))
+
+    def test_generate_file_async(self):
+        file_name = os.path.join(self.test_dir, 'testFileGenerate.txt')
+        with open(file_name + '.in', 'w') as output_file:
+            output_file.write(self.source)
+        returned_str = run_coroutine(
+            generate_file_async(file_name + '.in', file_name,
+                                self.iter_groups))
+        self.assertEqual(
+            generate_source(self.source, self.iter_groups), returned_str)
+        with open(file_name, 'r') as input_file:
+            self.assertEqual(returned_str, input_file.read())
+
+    def test_generate_files_async(self):
+        jobs = []
+        for index in range(8):
+            file_name = os.path.join(self.test_dir, 'file' + str(index))
+            with open(file_name + '.in', 'w') as output_file:
+                output_file.write(str(index) + '\n@ip1@')
+            jobs.append((file_name + '.in', file_name, self.iter_groups))
+        returned = run_coroutine(
+            generate_files_async(jobs, max_concurrency=3))
+        for index, (_, file_name, _) in enumerate(jobs):
+            expected = generate_source(str(index) + '\n@ip1@',
+                                       self.iter_groups)
+            self.assertEqual(expected, returned[index])
+            with open(file_name, 'r') as input_file:
+                self.assertEqual(expected, input_file.read())
+
+    @unittest.skipIf(
+        sys.platform.startswith("win"),
+        "formatting tests are disabled on Windows")
+    def test_generate_formatted_file_async(self):
+        file_name = os.path.join(self.test_dir, 'testFormattedFile.txt')
+        with open(file_name + '.in', 'w') as output_file:
+            output_file.write(self.source)
+        # Any command taking the file name as its last argument can be used as
+        # the formatting script
+        run_coroutine(
+            generate_file_async(
+                file_name + '.in',
+                file_name,
+                self.iter_groups,
+                format_generated=True,
+                format_script='sed -i s/Line/Formatted/'))
+        with open(file_name, 'r') as input_file:
+            self.assertTrue(input_file.read().startswith('Formatted one\n'))
+
+
+def run_async_interface_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestAsyncInterface)
+    unittest.TextTestRunner().run(suite)
@@ -0,0 +1,261 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import asyncio
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from string import Template
+from .test_locking import counted_enumerate, register_test_itermode
+from ..async_interface import generate_files_async
+from ..interface import (generate_file, generate_file_guarded, generate_files,
+                         generate_source, report_stale)
+from ..internal.check import CheckResult, get_manifest_file_name
+from ..iter_classes import (DerivedKey, Iterable, Itermode, IterGroup,
+                            ValueFile)
+
+# Arguments of each call of a derived key's function, to count the copies
+# generated
+calls = []
+
+
+def count_suffix(function_name):
+    calls.append(function_name)
+    return '_' + function_name
+
+
+SOURCE = ('namespace test {\n'
+          '  @types@\n'
+          '  // Functions\n'
+          '  @functions@\n'
+          '}\n')
+
+
+class TestCheck(unittest.TestCase):
+    """Tests the check mode of generate_file and the batch API."""
+
+    def setUp(self):
+        register_test_itermode(self, 'counted', counted_enumerate)
+        self.test_dir = tempfile.mkdtemp()
+        self.count_file = os.path.join(self.test_dir, 'count')
+        self.input_file = os.path.join(self.test_dir, 'test.cpp.in')
+        self.output_file = os.path.join(self.test_dir, 'test.cpp')
+        with open(self.input_file, 'w') as input_file:
+            input_file.write(SOURCE)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def make_groups(self, types, functions):
+        return [
+            IterGroup('@types@', Template('using ${T}_t = ${T};\n'), [
+                Iterable('T', [self.count_file] + types, 'counted', 1)
+            ]),
+            IterGroup('@functions@', Template('void ${F}();\n'),
+                      [Iterable('F', functions, Itermode.product)])
+        ]
+
+    def generation_count(self):
+        if not os.path.exists(self.count_file):
+            return 0
+        with open(self.count_file, 'r') as count_file:
+            return len(count_file.readlines())
+
+    def check(self, iter_groups):
+        return generate_file(
+            self.input_file, self.output_file, iter_groups, check=True)
+
+    def test_missing_output(self):
+        self.assertEqual(
+            self.check(self.make_groups(['int'], ['f'])),
+            CheckResult(self.output_file, True, ['@types@', '@functions@']))
+
+    def test_check_with_manifest(self):
+        generate_file(self.input_file, self.output_file,
+                      self.make_groups(['int'], ['f']), manifest=True)
+        self.assertTrue(
+            os.path.exists(get_manifest_file_name(self.output_file)))
+        # Nothing is generated when no IterGroup has changed
+        count = self.generation_count()
+        self.assertEqual(
+            self.check(self.make_groups(['int'], ['f'])),
+            CheckResult(self.output_file, False, []))
+        self.assertEqual(self.generation_count(), count)
+        # Only changed IterGroups are generated and compared
+        self.assertEqual(
+            self.check(self.make_groups(['int'], ['f', 'g'])),
+            CheckResult(self.output_file, True, ['@functions@']))
+        self.assertEqual(self.generation_count(), count)
+        # A changed IterGroup generating the same output isn't stale
+        iter_groups = self.make_groups(['int'], ['f'])
+        iter_groups[1] = IterGroup('@functions@', Template('void ${F}();\n'),
+                                   [Iterable('F', ['f'], Itermode.chain)])
+        self.assertFalse(self.check(iter_groups).stale)
+        # Editing the output is found without the manifest
+        with open(self.output_file, 'a') as output_file:
+            output_file.write('// edited\n')
+        self.assertEqual(
+            self.check(self.make_groups(['int'], ['f'])),
+            CheckResult(self.output_file, True, []))
+
+    def test_check_without_manifest(self):
+        generate_file(self.input_file, self.output_file,
+                      self.make_groups(['int'], ['f']))
+        self.assertFalse(self.check(self.make_groups(['int'], ['f'])).stale)
+        self.assertEqual(
+            self.check(self.make_groups(['int', 'float'], ['f'])),
+            CheckResult(self.output_file, True, ['@types@']))
+        # Comparison stops at the first difference
+        self.assertEqual(
+            self.check(self.make_groups(['int', 'float'], ['f', 'g'])),
+            CheckResult(self.output_file, True, ['@types@']))
+        # Generated strings creating a later insertion point are compared with
+        # the full output
+        iter_groups = self.make_groups(['int'], ['f'])
+        iter_groups[0] = IterGroup('@types@', Template('@functions@\n'), [])
+        generate_file(self.input_file, self.output_file, iter_groups)
+        self.assertFalse(self.check(iter_groups).stale)
+        self.assertTrue(
+            self.check(self.make_groups(['int'], ['f'])).stale)
+
+    def test_check_stops_at_difference(self):
+        # The last group can't create a later insertion point, so it isn't
+        # generated once an earlier part of the output differs
+        iter_groups = self.make_groups(['int'], ['f'])[::-1]
+        generate_file(self.input_file, self.output_file, iter_groups)
+        with open(self.output_file, 'r') as output_file:
+            output = output_file.read()
+        with open(self.output_file, 'w') as output_file:
+            output_file.write(output.replace('namespace', 'namespace ns'))
+        count = self.generation_count()
+        self.assertEqual(self.check(iter_groups),
+                         CheckResult(self.output_file, True, []))
+        self.assertEqual(self.generation_count(), count)
+        # A group is generated a copy at a time as it is compared
+        functions = ['f' + str(index) for index in range(100)]
+        iter_groups = [
+            IterGroup('@types@', Template('using ${T}_t = ${T};\n'),
+                      [Iterable('T', ['int'], Itermode.product)]),
+            IterGroup('@functions@', Template('void ${F}${S}();\n'),
+                      [Iterable('F', functions, Itermode.product)],
+                      derived_keys=[DerivedKey('S', count_suffix, 'F')])
+        ]
+        generate_file(self.input_file, self.output_file, iter_groups)
+        del calls[:]
+        self.assertFalse(self.check(iter_groups).stale)
+        self.assertEqual(calls, functions)
+        with open(self.output_file, 'r') as output_file:
+            output = output_file.read()
+        with open(self.output_file, 'w') as output_file:
+            output_file.write(output.replace('void f1_f1', 'void g1_f1'))
+        del calls[:]
+        self.assertEqual(self.check(iter_groups),
+                         CheckResult(self.output_file, True, ['@functions@']))
+        self.assertEqual(calls, ['f0', 'f1'])
+
+    def test_generate_files(self):
+        jobs = []
+        for index in range(4):
+            output_file = os.path.join(self.test_dir,
+                                       'test' + str(index) + '.cpp')
+            jobs.append((self.input_file, output_file,
+                         self.make_groups(['int'], ['f' + str(index)])))
+        sources = generate_files(jobs, workers=2, manifest=True)
+        for (_, output_file, iter_groups), source in zip(jobs, sources):
+            with open(output_file, 'r') as output:
+                self.assertEqual(output.read(), source)
+        results = generate_files(jobs, workers=2, check=True)
+        self.assertEqual(report_stale(results, io.StringIO()), 0)
+        jobs[2] = (jobs[2][0], jobs[2][1], self.make_groups(['int'], ['g']))
+        results = generate_files(jobs, workers=1, check=True)
+        stream = io.StringIO()
+        self.assertEqual(report_stale(results, stream), 1)
+        self.assertEqual(stream.getvalue(),
+                         'stale: ' + jobs[2][1] + ' (@functions@)\n')
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(
+                generate_files_async(jobs, check=True))
+        finally:
+            loop.close()
+        self.assertEqual([result.stale for result in results],
+                         [False, False, True, False])
+
+    def test_check_guarded(self):
+        with open(self.output_file, 'w') as output_file:
+            output_file.write(SOURCE)
+        iter_groups = self.make_groups(['int'], ['f'])
+        self.assertEqual(
+            generate_file_guarded(self.output_file, iter_groups, check=True),
+            CheckResult(self.output_file, True, ['@types@', '@functions@']))
+        generate_file_guarded(self.output_file, iter_groups)
+        count = self.generation_count()
+        self.assertFalse(
+            generate_file_guarded(self.output_file, iter_groups,
+                                  check=True).stale)
+        self.assertEqual(
+            generate_file_guarded(self.output_file,
+                                  self.make_groups(['char'], ['f']),
+                                  check=True),
+            CheckResult(self.output_file, True, ['@types@']))
+        self.assertEqual(self.generation_count(), count)
+
+
+    def test_value_file_edited(self):
+        # The spec_hash of a ValueFile follows the content of the file, so
+        # nothing kept by it is used once the file is edited
+        values_file = os.path.join(self.test_dir, 'functions.txt')
+        guarded_file = os.path.join(self.test_dir, 'guarded.cpp')
+        cache_dir = os.path.join(self.test_dir, 'cache')
+        iter_groups = [
+            IterGroup('@types@', Template('using ${T}_t = ${T};\n'),
+                      [Iterable('T', ['int'], Itermode.product)]),
+            IterGroup('@functions@', Template('void ${F}();\n'), [
+                Iterable('F', ValueFile(values_file), Itermode.product)
+            ])
+        ]
+        for functions in ['f\n', 'g\nh\n']:
+            with open(values_file, 'w') as output_file:
+                output_file.write(functions)
+            expected = generate_source(SOURCE, iter_groups)
+            self.assertIn('void ' + functions.split()[-1] + '();', expected)
+            if functions != 'f\n':
+                self.assertEqual(
+                    self.check(iter_groups),
+                    CheckResult(self.output_file, True, ['@functions@']))
+                self.assertTrue(
+                    generate_file_guarded(guarded_file, iter_groups,
+                                          check=True).stale)
+            else:
+                with open(guarded_file, 'w') as output_file:
+                    output_file.write(SOURCE)
+            self.assertEqual(
+                generate_file(self.input_file, self.output_file,
+                              iter_groups, cache_dir=cache_dir,
+                              manifest=True), expected)
+            self.assertFalse(self.check(iter_groups).stale)
+            generate_file_guarded(guarded_file, iter_groups)
+            with open(guarded_file, 'r') as output_file:
+                self.assertIn('void ' + functions.split()[-1] + '();',
+                              output_file.read())
+
+
+def run_check_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCheck)
+    unittest.TextTestRunner().run(suite)
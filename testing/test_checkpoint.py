@@ -0,0 +1,165 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from string import Template
+from .test_locking import counted_enumerate, register_test_itermode
+from ..interface import generate_file
+from ..internal import checkpoint
+from ..internal.checkpoint import get_checkpoint_path, iterate_checkpoints
+from ..internal.funcs import read_from_file
+from ..iter_classes import Iterable, Itermode, IterGroup, RemovalIterGroup
+
+
+class TestCheckpoint(unittest.TestCase):
+    """Tests checkpointing generate_file and resuming it once interrupted."""
+
+    def setUp(self):
+        register_test_itermode(self, 'counted', counted_enumerate)
+        self.test_dir = tempfile.mkdtemp()
+        self.checkpoint_dir = os.path.join(self.test_dir, 'checkpoints')
+        self.count_file = os.path.join(self.test_dir, 'count')
+        self.input_file_name = os.path.join(self.test_dir, 'kernels.cpp.in')
+        self.output_file_name = os.path.join(self.test_dir, 'kernels.cpp')
+        self.expected_file_name = os.path.join(self.test_dir, 'expected.cpp')
+        with open(self.input_file_name, 'w') as input_file:
+            input_file.write('// @counted@\nnamespace k {\n  @gemm@\n}\n'
+                             '@combined@\n')
+        self.iter_groups = [
+            IterGroup('@counted@', Template('${C} '), [
+                Iterable('C', [self.count_file, 'a', 'b'], 'counted', 1)
+            ]),
+            IterGroup('@gemm@',
+                      Template('template void gemm<${T}, ${N}>();\n'), [
+                          Iterable('T', ['float', 'double', 'half'],
+                                   Itermode.product),
+                          Iterable('N', [str(size) for size in range(2000)],
+                                   Itermode.product)
+                      ]),
+            RemovalIterGroup('@combined@', Template('${A}${B};'), [
+                Iterable('A', ['1', '2', '3'], Itermode.product),
+                Iterable('B', ['x', 'y', 'z'], Itermode.product)
+            ], [Iterable('A', ['2'], Itermode.product)],
+                             combine_iters=True)
+        ]
+        generate_file(self.input_file_name, self.expected_file_name,
+                      self.iter_groups)
+        os.remove(self.count_file)
+        self.path = get_checkpoint_path(self.checkpoint_dir,
+                                        self.output_file_name)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def generation_count(self):
+        with open(self.count_file, 'r') as count_file:
+            return len(count_file.readlines())
+
+    def interrupt(self, checkpoints):
+        """Runs a checkpointed generation for a number of checkpoints, then
+        stops it as if it was interrupted"""
+        source = read_from_file(self.input_file_name)
+        states = iterate_checkpoints(source, self.iter_groups, self.path, 0)
+        for _ in range(checkpoints):
+            state = dict(next(states))
+        states.close()
+        return state
+
+    def generate(self):
+        return generate_file(self.input_file_name,
+                             self.output_file_name,
+                             self.iter_groups,
+                             checkpoint_dir=self.checkpoint_dir,
+                             checkpoint_interval=0)
+
+    def assert_matches_uninterrupted(self):
+        with open(self.output_file_name, 'rb') as output_file:
+            with open(self.expected_file_name, 'rb') as expected_file:
+                self.assertEqual(expected_file.read(), output_file.read())
+        # The checkpoints are removed once the output is written
+        self.assertFalse(os.path.exists(self.path))
+
+    def test_uninterrupted(self):
+        self.assertEqual(read_from_file(self.expected_file_name),
+                         self.generate())
+        self.assert_matches_uninterrupted()
+
+    def test_resume_within_group(self):
+        state = self.interrupt(4)
+        self.assertEqual(1, state['completed'])
+        self.assertEqual(2048, state['rank'])
+        self.generate()
+        self.assert_matches_uninterrupted()
+        # Completed groups aren't generated again
+        self.assertEqual(1, self.generation_count())
+
+    def test_partial_written_after_checkpoint(self):
+        self.assertEqual(1024, self.interrupt(3)['rank'])
+        # Copies written after the last checkpoint are dropped
+        with open(os.path.join(self.path, 'partial'), 'ab') as partial_file:
+            partial_file.write(b'template void gemm<float, 0>();\n')
+        self.generate()
+        self.assert_matches_uninterrupted()
+
+    def test_interrupted_finishing_group(self):
+        # Stop after the group in progress is written to its group file, but
+        # before the checkpoint recording it as completed
+        write_checkpoint = checkpoint.write_checkpoint
+
+        def interrupted(path, state):
+            if state['completed'] == 2:
+                raise KeyboardInterrupt
+            write_checkpoint(path, state)
+
+        checkpoint.write_checkpoint = interrupted
+        try:
+            with self.assertRaises(KeyboardInterrupt):
+                self.generate()
+        finally:
+            checkpoint.write_checkpoint = write_checkpoint
+        self.assertTrue(os.path.exists(os.path.join(self.path, 'group_1')))
+        self.generate()
+        self.assert_matches_uninterrupted()
+        self.assertEqual(1, self.generation_count())
+
+    def test_changed_spec(self):
+        self.interrupt(3)
+        self.iter_groups[2] = IterGroup(
+            '@combined@', Template('${A};'),
+            [Iterable('A', ['1'], Itermode.product)])
+        generate_file(self.input_file_name, self.expected_file_name,
+                      self.iter_groups)
+        # The checkpoints of a different generation aren't resumed from
+        self.generate()
+        self.assert_matches_uninterrupted()
+        self.assertEqual(3, self.generation_count())
+
+    def test_invalid_options(self):
+        with self.assertRaises(ValueError):
+            generate_file(self.input_file_name,
+                          self.output_file_name,
+                          self.iter_groups,
+                          lock=True,
+                          checkpoint_dir=self.checkpoint_dir)
+
+
+def run_checkpoint_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestCheckpoint)
+    unittest.TextTestRunner().run(suite)
@@ -0,0 +1,185 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from string import Template
+from .groups import TEMPLATE_TEXT, make_group
+from ..interface import generate_source, generate_file, generate_files
+from ..internal.dedup import (DedupRegistry, DroppedInstantiation,
+                              expand_iter_group_dedup)
+from ..internal.iters import expand_iter_group
+from ..iter_classes import (EmitMode, Iterable, Itermode, IterGroup,
+                            RemovalIterGroup)
+
+TEMPLATE = Template(TEMPLATE_TEXT)
+
+
+class TestDedup(unittest.TestCase):
+    """Tests the DedupRegistry and generation leaving out repeats."""
+
+    def test_unique_rows_unchanged(self):
+        iter_groups = [
+            make_group(['int', 'float'], ['1', '2'], insertion_point='@a@'),
+            make_group(['int', 'float'], ['1', '2'], insertion_point='@a@',
+                       combine_iters=True),
+            RemovalIterGroup('@a@', TEMPLATE, [
+                Iterable('T', ['int', 'float'], Itermode.product),
+                Iterable('N', ['1', '2'], Itermode.product)
+            ], [Iterable('', ['2'], Itermode.product)], True),
+            IterGroup('@a@', TEMPLATE, [
+                Iterable('T', [], Itermode.product),
+                Iterable('N', [], Itermode.product)
+            ], True)
+        ]
+        for iter_group in iter_groups:
+            self.assertEqual(
+                expand_iter_group(iter_group),
+                expand_iter_group_dedup(iter_group, DedupRegistry()))
+
+    def test_repeats_dropped(self):
+        registry = DedupRegistry()
+        source = generate_source('@a@--\n@b@', [
+            make_group(['int', 'int', 'float'], ['1'], insertion_point='@a@'),
+            make_group(['float', 'double'], ['1'], insertion_point='@b@')
+        ], dedup=registry)
+        self.assertEqual(
+            'template void f<int, 1>();\n'
+            'template void f<float, 1>();\n--\n'
+            'template void f<double, 1>();\n', source)
+        self.assertEqual([
+            DroppedInstantiation(None, '@a@', {
+                'T': 'int',
+                'N': '1'
+            }, None, '@a@'),
+            DroppedInstantiation(None, '@b@', {
+                'T': 'float',
+                'N': '1'
+            }, None, '@a@')
+        ], registry.report())
+        stream = io.StringIO()
+        self.assertEqual(2, registry.write_report(stream))
+        self.assertEqual(
+            'dropped: @a@ (T=int, N=1), first emitted at @a@\n'
+            'dropped: @b@ (T=float, N=1), first emitted at @a@\n',
+            stream.getvalue())
+        # Different templates or keys are different instantiations
+        other = IterGroup('@c@', Template('f<${T}, ${N}>;'), [
+            Iterable('T', ['int'], Itermode.product),
+            Iterable('N', ['1'], Itermode.product)
+        ])
+        self.assertEqual('f<int, 1>;',
+                         expand_iter_group_dedup(other, registry))
+        # As are groups binding the elements of their outputs or not
+        for bind_elements, expected in [(True, 'f(pq, p);\n'),
+                                        (False, 'f(pq, ${a_0});\n')]:
+            self.assertEqual(
+                expected,
+                expand_iter_group_dedup(
+                    IterGroup('@d@', Template('f(${a}, ${a_0});\n'), [
+                        Iterable('a', ['p', 'q'], Itermode.combinations, 2,
+                                 bind_elements=bind_elements)
+                    ]), registry))
+
+    def test_aliases(self):
+        registry = DedupRegistry([('int32_t', 'int'), ('int64_t', 'long')])
+        self.assertEqual(
+            'template void f<int, 1>();\n',
+            expand_iter_group_dedup(
+                make_group(['int', 'int32_t'], ['1'], insertion_point='@a@'),
+                registry))
+        self.assertEqual(
+            'template void f<long, 1>();\n',
+            expand_iter_group_dedup(
+                make_group(['int32_t', 'long', 'int64_t'], ['1'],
+                           insertion_point='@a@'), registry))
+        self.assertEqual(3, len(registry.report()))
+
+    def test_xmacro_and_combined(self):
+        registry = DedupRegistry()
+        expand_iter_group_dedup(
+            make_group(['a', 'b'], ['1'], insertion_point='@a@'), registry)
+        # A combined group whose copies are all dropped generates nothing
+        self.assertEqual(
+            '',
+            expand_iter_group_dedup(
+                make_group(['a', 'b'], ['1', '1'], insertion_point='@b@',
+                           combine_iters=True), registry))
+        iter_group = IterGroup('@c@', TEMPLATE, [
+            Iterable('T', ['a', 'c'], Itermode.product),
+            Iterable('N', ['1'], Itermode.product)
+        ], emit_mode=EmitMode.xmacro, table_name='F')
+        self.assertIn('    X(c, 1)\n',
+                      expand_iter_group_dedup(iter_group, registry))
+        self.assertNotIn('X(a, 1)',
+                         expand_iter_group_dedup(iter_group, registry))
+
+    def test_unsplittable_template(self):
+        # Copies of a template with $$ can't be substituted separately, so
+        # they're always all generated
+        registry = DedupRegistry()
+        iter_group = IterGroup('@a@', Template('$$${T}'), [
+            Iterable('T', ['x', 'x'], Itermode.product)
+        ])
+        self.assertEqual('$x$x', expand_iter_group_dedup(iter_group,
+                                                         registry))
+        self.assertEqual(
+            '$x',
+            expand_iter_group_dedup(
+                IterGroup('@b@', Template('$$${T}'),
+                          [Iterable('T', ['x'], Itermode.product)]),
+                registry))
+        # Later combinations substitute into the copies of a combined group
+        # before them, so its copies aren't generated separately either
+        iter_group = make_group(['x', 'y'], ['$$', '2'], insertion_point='@c@',
+                                combine_iters=True)
+        for _ in range(2):
+            self.assertEqual(
+                'template void f<x, $>();\ntemplate void f<y, 2>();\n',
+                expand_iter_group_dedup(iter_group, registry))
+
+    def test_files(self):
+        test_dir = tempfile.mkdtemp()
+        try:
+            input_file = os.path.join(test_dir, 'test.cpp.in')
+            with open(input_file, 'w') as output:
+                output.write('@a@')
+            jobs = [(input_file, os.path.join(test_dir, name + '.cpp'),
+                     [make_group(types, ['1'], insertion_point='@a@')])
+                    for name, types in [('x', ['int', 'float']),
+                                        ('y', ['float', 'half'])]]
+            registry = DedupRegistry()
+            sources = generate_files(jobs, workers=2, dedup=registry)
+            self.assertEqual('template void f<half, 1>();\n', sources[1])
+            stream = io.StringIO()
+            registry.write_report(stream)
+            self.assertEqual(
+                'dropped: ' + jobs[1][1] + ' @a@ (T=float, N=1), first '
+                'emitted at ' + jobs[0][1] + ' @a@\n', stream.getvalue())
+            with self.assertRaises(ValueError):
+                generate_file(input_file, jobs[0][1], jobs[0][2], lock=True,
+                              dedup=registry)
+        finally:
+            shutil.rmtree(test_dir)
+
+
+def run_dedup_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDedup)
+    unittest.TextTestRunner().run(suite)
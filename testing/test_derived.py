@@ -0,0 +1,250 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from string import Template
+from .groups import make_group
+from ..interface import (binding_keys, generate_bindings, generate_file,
+                         generate_file_parallel, generate_source)
+from ..internal.checkpoint import generate_checkpointed
+from ..internal.dedup import DedupRegistry
+from ..internal.shards import generate_shard_sources
+from ..iter_classes import (BindingForm, DerivedKey, EmitMode, Iterable,
+                            Itermode, IterGroup, RemovalIterGroup)
+
+# Arguments of each call of a derived function, to count the calls
+calls = []
+
+
+def mangle(type_name, size):
+    calls.append((type_name, size))
+    return type_name[0] + size
+
+
+def upper(value):
+    calls.append((value, ))
+    return value.upper()
+
+
+TYPES = ['float', 'double', 'half']
+SIZES = ['1', '2']
+TEMPLATE_TEXT = 'f<${T}, ${N}>(${M});\n'
+
+
+class TestDerived(unittest.TestCase):
+    """Tests keys derived from the values bound in each copy of a template."""
+
+    def setUp(self):
+        del calls[:]
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_derived_values(self):
+        group = make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                           derived_keys=[DerivedKey('M', mangle, ['T', 'N'])])
+        self.assertEqual(
+            'f<float, 1>(f1);\nf<double, 1>(d1);\nf<half, 1>(h1);\n'
+            'f<float, 2>(f2);\nf<double, 2>(d2);\nf<half, 2>(h2);\n',
+            generate_source('@ip@', [group]))
+
+    def test_called_once_per_input(self):
+        group = make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                           derived_keys=[DerivedKey('M', upper, 'T')])
+        generate_source('@ip@', [group])
+        self.assertEqual([('float', ), ('double', ), ('half', )], calls)
+        # With room for one result, the first iterable varying fastest means
+        # every copy calls the function again
+        del calls[:]
+        generate_source('@ip@', [
+            make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                       derived_keys=[DerivedKey('M', upper, 'T', 1)])
+        ])
+        self.assertEqual(6, len(calls))
+
+    def test_chained_and_bound_keys(self):
+        group = make_group(TYPES, SIZES, '${U} ${N};', derived_keys=[
+            DerivedKey('M', mangle, ['T', 'N']),
+            DerivedKey('U', upper, 'M'),
+            DerivedKey('N', upper, 'T')
+        ])
+        # Derived keys can use earlier derived keys, and keys bound by an
+        # iterable keep the value of the iterable
+        self.assertEqual('F1 1;D1 1;H1 1;F2 2;D2 2;H2 2;',
+                         generate_source('@ip@', [group]))
+        self.assertEqual(['T', 'N', 'M', 'U'], binding_keys(group))
+        self.assertEqual(('float', '1', 'f1', 'F1'),
+                         next(generate_bindings(group, BindingForm.tuple)))
+        self.assertEqual({
+            'T': 'float',
+            'N': '1',
+            'M': 'f1',
+            'U': 'F1'
+        }, next(generate_bindings(group)))
+        self.assertEqual((('float', ), ('1', )),
+                         next(generate_bindings(group, BindingForm.raw)))
+
+    def test_combined_and_removal(self):
+        derived_keys = [DerivedKey('M', mangle, ['T', 'N'])]
+        iterables = [
+            Iterable('T', ['float', 'double', 'half'], Itermode.product),
+            Iterable('N', ['1', '2', '3'], Itermode.product)
+        ]
+        removal = [Iterable('T', ['double'], Itermode.product)]
+        template = Template('${M};')
+        self.assertEqual(
+            'f1;d2;h3;',
+            generate_source('@ip@', [
+                IterGroup('@ip@', template, iterables, combine_iters=True,
+                          derived_keys=derived_keys)
+            ]))
+        self.assertEqual(
+            'f1;h3;',
+            generate_source('@ip@', [
+                RemovalIterGroup('@ip@', template, iterables, removal,
+                                 combine_iters=True,
+                                 derived_keys=derived_keys)
+            ]))
+        self.assertEqual(
+            'f1;h1;f2;h2;f3;h3;',
+            generate_source('@ip@', [
+                RemovalIterGroup('@ip@', template, iterables, removal,
+                                 derived_keys=derived_keys)
+            ]))
+
+    def test_xmacro(self):
+        group = IterGroup('@ip@', Template('f<${T}>(${M});'), [
+            Iterable('T', ['float', 'half'], Itermode.product)
+        ],
+                          emit_mode=EmitMode.xmacro,
+                          table_name='TABLE',
+                          derived_keys=[DerivedKey('M', upper, 'T')])
+        generated = generate_source('@ip@', [group])
+        self.assertIn('X(float, FLOAT)', generated)
+        self.assertIn('TABLE_ROW(py_gen_T, py_gen_M)', generated)
+
+    def test_engines_agree(self):
+        group = make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                           derived_keys=[DerivedKey('M', mangle, ['T', 'N'])])
+        expected = generate_source('@ip@', [group])
+        input_file_name = os.path.join(self.test_dir, 'kernels.cpp.in')
+        output_file_name = os.path.join(self.test_dir, 'kernels.cpp')
+        with open(input_file_name, 'w') as input_file:
+            input_file.write('@ip@')
+        generate_file_parallel(input_file_name, output_file_name, [group],
+                               workers=1, chunk_size=8)
+        with open(output_file_name, 'r') as output_file:
+            self.assertEqual(expected, output_file.read())
+        state_dir = os.path.join(self.test_dir, 'state')
+        for _ in range(2):
+            self.assertEqual(
+                expected,
+                generate_file(input_file_name, output_file_name, [group],
+                              state_dir=state_dir))
+        self.assertEqual(
+            expected,
+            generate_checkpointed('@ip@', [group],
+                                  os.path.join(self.test_dir, 'checkpoint'),
+                                  0))
+        self.assertEqual(
+            sorted(expected.splitlines()),
+            sorted(''.join(generate_shard_sources('@ip@', [group],
+                                                  4)).splitlines()))
+        registry = DedupRegistry()
+        self.assertEqual(expected,
+                         generate_source('@ip@', [group], dedup=registry))
+        # Only the copies not emitted before are generated
+        wider = IterGroup('@ip@', group.template, [
+            Iterable('T', ['float', 'bfloat'], Itermode.product),
+            Iterable('N', ['1'], Itermode.product)
+        ],
+                          derived_keys=group.derived_keys)
+        self.assertEqual('f<bfloat, 1>(b1);\n',
+                         generate_source('@ip@', [wider], dedup=registry))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            generate_source('@ip@', [
+                make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                           derived_keys=[DerivedKey('M', upper, 'X')])
+            ])
+        with self.assertRaises(TypeError):
+            generate_source('@ip@', [
+                make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                           derived_keys=[DerivedKey('M', len, 'T')])
+            ])
+        with self.assertRaises(TypeError):
+            make_group(TYPES, SIZES, TEMPLATE_TEXT, derived_keys=['M'])
+        with self.assertRaises(TypeError):
+            DerivedKey('M', 'upper', 'T')
+        with self.assertRaises(ValueError):
+            DerivedKey('M', upper, 'T', 0)
+
+    def test_spec(self):
+        group = make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                           derived_keys=[DerivedKey('M', mangle, ['T', 'N'])])
+        self.assertEqual(group, pickle.loads(pickle.dumps(group)))
+        self.assertNotEqual(
+            make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                       derived_keys=[DerivedKey('M', upper, 'T')]), group)
+        plain = make_group(TYPES, SIZES, TEMPLATE_TEXT, derived_keys=[])
+        self.assertNotEqual(plain.spec_hash(), group.spec_hash())
+        # Groups without derived keys are unchanged by them
+        self.assertNotIn('DerivedKey', repr(plain))
+
+    def test_functions_with_same_name(self):
+        # Derived keys are told apart by their function, not its name
+        lower = DerivedKey('M', lambda value: value.lower(), 'T')
+        first = DerivedKey('M', lambda value: value[0], 'T')
+        self.assertNotEqual(lower, first)
+        self.assertNotEqual(
+            make_group(TYPES, SIZES, TEMPLATE_TEXT, derived_keys=[lower]),
+            make_group(TYPES, SIZES, TEMPLATE_TEXT, derived_keys=[first]))
+        # Groups used as values are kept by their content
+        for derived_key, expected in [(lower, ['float', 'double', 'half']),
+                                      (first, ['f', 'd', 'h'])]:
+            source = Iterable(
+                'V', make_group(TYPES, SIZES, '${M}',
+                                derived_keys=[derived_key]), Itermode.product)
+            self.assertEqual(
+                ''.join('[' + value + ']' for value in expected * 2),
+                generate_source('@ip@', [
+                    IterGroup('@ip@', Template('[${V}]'), [source])
+                ]))
+        # Lambdas have no name identifying them between processes
+        with self.assertRaises(ValueError):
+            make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                       derived_keys=[lower]).spec_hash()
+        registry = DedupRegistry()
+        generate_source(
+            '@ip@', [make_group(TYPES, SIZES, '${M};', derived_keys=[lower])],
+            dedup=registry)
+        self.assertEqual(
+            'f;d;h;f;d;h;',
+            generate_source('@ip@', [
+                make_group(TYPES, SIZES, '${M};', derived_keys=[first])
+            ], dedup=registry))
+
+
+def run_derived_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestDerived)
+    unittest.TextTestRunner().run(suite)
@@ -0,0 +1,560 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import asyncio
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from string import Template
+from . import reference
+from ..async_interface import generate_source_async
+from ..interface import (generate_source, generate_file, generate_file_guarded,
+                         generate_file_mapped, generate_file_parallel,
+                         generate_files_distributed, generate_sharded_files)
+from ..internal.dedup import DedupRegistry
+from ..internal.iters import is_separable
+from ..iter_classes import (Itermode, Iterable, IterGroup, LengthPolicy,
+                            RemovalIterGroup, ShardMode)
+from ..source_template import SourceTemplate
+
+# Differential tests comparing the output of each generation engine with the
+# frozen reference implementation in reference.py, on randomly generated specs.
+# Specs are plain data so they can be shrunk to a minimal failing case. A spec
+# is a dict of the source and a list of group dicts, and each Iterable is a
+# tuple of (key, vals, Itermode name, iter_modifier, comma_list).
+# Values and templates include '$', '$$' and keys, which the repeated
+# safe_substitute calls of the reference substitute again.
+# Combined groups either have Iterables producing the same number of outputs,
+# or Iterables of any lengths with LengthPolicy.shortest. The reference
+# combines as many outputs as the first Iterable produces, so it only matches
+# shortest where no later Iterable produces fewer, and raises IndexError
+# otherwise. Specs where it does are skipped, see reference_diverges.
+
+MODES = ['product', 'permutations', 'combinations', 'combinationsWR']
+VALUES = ['a', 'b', 'c', 'int', 'x y', '1', '$', '$$', '${k0}', 'x$']
+INSERTION_POINTS = ['@ip0@', '@ip1@', '@ip2@']
+TEMPLATE_TEXT = [
+    'a', ' ', '\n', '  ', 'x y', ', ', '(', ');\n    ', '\n  ', '$$', '$ '
+]
+# Functions of the reference generating the joined outputs of each Itermode
+REFERENCE_LISTS = {
+    'product': reference.gen_product_list,
+    'permutations': reference.gen_permutations_list,
+    'combinations': reference.gen_combinations_list,
+    'combinationsWR': reference.gen_combinations_with_replacement_list
+}
+
+
+def build_iterables(descriptions):
+    return [
+        Iterable(key, vals, Itermode[mode], modifier, comma_list)
+        for key, vals, mode, modifier, comma_list in descriptions
+    ]
+
+
+def build_groups(spec):
+    """Returns the list of IterGroups and RemovalIterGroups described by spec"""
+    iter_groups = []
+    for group in spec['groups']:
+        template = Template(group['template'])
+        length_policy = LengthPolicy[group['length_policy']]
+        if group['removal_iterables'] is None:
+            iter_groups.append(
+                IterGroup(group['insertion_point'], template,
+                          build_iterables(group['iterables']),
+                          group['combine_iters'], length_policy))
+        else:
+            iter_groups.append(
+                RemovalIterGroup(group['insertion_point'], template,
+                                 build_iterables(group['iterables']),
+                                 build_iterables(group['removal_iterables']),
+                                 group['combine_iters'], length_policy))
+    return iter_groups
+
+
+def random_iterable(rng, key):
+    return (key, rng.sample(VALUES, rng.randint(0, 4)), rng.choice(MODES),
+            rng.randint(0, 3), rng.random() < 0.3)
+
+
+def random_group(rng, insertion_point):
+    keys = ['k' + str(index) for index in range(rng.randint(1, 3))]
+    combine_iters = rng.random() < 0.4
+    length_policy = 'strict'
+    if combine_iters and rng.random() < 0.5:
+        length_policy = 'shortest'
+    iterables = [random_iterable(rng, key) for key in keys]
+    if length_policy == 'strict':
+        # Combined Iterables must produce the same number of outputs
+        _, vals, mode, modifier, _ = iterables[0]
+        iterables = [(key, rng.sample(VALUES, len(vals)), mode, modifier,
+                      comma_list)
+                     for key, _, _, _, comma_list in iterables]
+    removal_iterables = None
+    if rng.random() < 0.4:
+        removal_iterables = [
+            random_iterable(rng, '') for _ in range(rng.randint(0, 2))
+        ]
+    # Templates use the group's keys, unbound keys, text including line breaks
+    # and indentation, and sometimes the insertion point of another group
+    pieces = (['${' + key + '}' for key in keys] + ['${unbound}'] +
+              TEMPLATE_TEXT + [rng.choice(INSERTION_POINTS)] * (rng.random() <
+                                                                 0.2))
+    template = ''.join(
+        rng.choice(pieces) for _ in range(rng.randint(1, 6)))
+    return {
+        'insertion_point': insertion_point,
+        'template': template,
+        'iterables': iterables,
+        'removal_iterables': removal_iterables,
+        'combine_iters': combine_iters,
+        'length_policy': length_policy
+    }
+
+
+def random_spec(rng):
+    """Returns a random spec with nested indentation in its source"""
+    lines = []
+    for _ in range(rng.randint(0, 6)):
+        indent = ' ' * rng.choice([0, 2, 4, 8])
+        lines.append(indent + rng.choice(INSERTION_POINTS + ['text', 'x y']))
+    source = '\n'.join(lines) + rng.choice(['', '\n'])
+    groups = [
+        random_group(rng, rng.choice(INSERTION_POINTS))
+        for _ in range(rng.randint(1, 3))
+    ]
+    return {'source': source, 'groups': groups}
+
+
+def format_spec(spec):
+    """Returns a readable reproducer for spec"""
+    lines = ['source = ' + repr(spec['source'])]
+    for group in spec['groups']:
+        lines.append('group ' + repr(group['insertion_point']) +
+                     ' template=' + repr(group['template']) + ' combine=' +
+                     repr(group['combine_iters']) + ' length_policy=' +
+                     group['length_policy'])
+        for description in group['iterables']:
+            lines.append('    iterable ' + repr(description))
+        for description in group['removal_iterables'] or []:
+            lines.append('    removal ' + repr(description))
+    return '\n'.join(lines)
+
+
+def with_group(spec, index, **changes):
+    groups = list(spec['groups'])
+    group = dict(groups[index])
+    group.update(changes)
+    groups[index] = group
+    return {'source': spec['source'], 'groups': groups}
+
+
+def simplify_iterables(descriptions):
+    """Yields simpler versions of a list of Iterable descriptions"""
+    for index in range(len(descriptions)):
+        yield descriptions[:index] + descriptions[index + 1:]
+    for index, (key, vals, mode, modifier,
+                comma_list) in enumerate(descriptions):
+        simpler = []
+        if comma_list:
+            simpler.append((key, vals, mode, modifier, False))
+        if modifier:
+            simpler.append((key, vals, mode, modifier - 1, comma_list))
+        if mode != 'product':
+            simpler.append((key, vals, 'product', modifier, comma_list))
+        for val_index in range(len(vals)):
+            simpler.append((key, vals[:val_index] + vals[val_index + 1:], mode,
+                            modifier, comma_list))
+        for description in simpler:
+            yield (descriptions[:index] + [description] +
+                   descriptions[index + 1:])
+    # Remove the same value index from every Iterable, keeping combined
+    # Iterables the same length
+    length = min([len(vals) for _, vals, _, _, _ in descriptions] or [0])
+    for val_index in range(length):
+        yield [(key, vals[:val_index] + vals[val_index + 1:], mode, modifier,
+                comma_list)
+               for key, vals, mode, modifier, comma_list in descriptions]
+
+
+def simplifications(spec):
+    """Yields specs which are each one step simpler than spec"""
+    groups = spec['groups']
+    for index in range(len(groups)):
+        yield {
+            'source': spec['source'],
+            'groups': groups[:index] + groups[index + 1:]
+        }
+    lines = spec['source'].split('\n')
+    for index in range(len(lines)):
+        yield dict(spec, source='\n'.join(lines[:index] + lines[index + 1:]))
+        if lines[index] != lines[index].lstrip():
+            yield dict(spec, source='\n'.join(lines[:index] + [
+                lines[index].lstrip()
+            ] + lines[index + 1:]))
+    for index, group in enumerate(groups):
+        if group['combine_iters']:
+            yield with_group(spec, index, combine_iters=False)
+        if group['length_policy'] != 'strict':
+            yield with_group(spec, index, length_policy='strict')
+        if group['removal_iterables'] is not None:
+            yield with_group(spec, index, removal_iterables=None)
+            for removal_iterables in simplify_iterables(
+                    group['removal_iterables']):
+                yield with_group(
+                    spec, index, removal_iterables=removal_iterables)
+        for iterables in simplify_iterables(group['iterables']):
+            yield with_group(spec, index, iterables=iterables)
+        template = group['template']
+        for start in range(len(template)):
+            yield with_group(
+                spec, index, template=template[:start] + template[start + 1:])
+
+
+def shrink(spec, fails):
+    """Greedily simplifies spec for as long as fails(spec) stays True. Returns
+    the simplest failing spec found."""
+    changed = True
+    while changed:
+        changed = False
+        for candidate in simplifications(spec):
+            if fails(candidate):
+                spec = candidate
+                changed = True
+                break
+    return spec
+
+
+def outcome(engine, spec):
+    """Returns the output of engine for spec, or the type of exception it
+    raised. Raises ValueError if spec is not a valid spec."""
+    try:
+        iter_groups = build_groups(spec)
+    except (TypeError, ValueError) as error:
+        raise ValueError('Invalid spec: ' + str(error))
+    try:
+        return ('output', engine(spec['source'], iter_groups))
+    except Exception as error:
+        return ('exception', type(error).__name__)
+
+
+def reference_diverges(spec):
+    """Returns whether the reference combines the Iterables of a group of spec
+    using LengthPolicy.shortest differently, as a later Iterable produces fewer
+    outputs than the first"""
+    for group in spec['groups']:
+        if group['combine_iters'] and group['length_policy'] == 'shortest':
+            counts = [
+                len(REFERENCE_LISTS[iterable.itermode.name](iterable)[1])
+                for iterable in build_iterables(group['iterables'])
+            ]
+            if min(counts) < counts[0]:
+                return True
+    return False
+
+
+def differs(engine, spec):
+    """Returns whether engine and the reference differ for a valid spec which
+    the reference doesn't diverge on"""
+    try:
+        expected = outcome(reference.generate_source, spec)
+    except ValueError:
+        return False
+    if reference_diverges(spec):
+        return False
+    return outcome(engine, spec) != expected
+
+
+def file_engine(generate):
+    """Returns an engine writing the source to an input file and reading the
+    generated output file back"""
+
+    def engine(source, iter_groups):
+        test_dir = tempfile.mkdtemp()
+        try:
+            input_file_name = os.path.join(test_dir, 'input.cpp.in')
+            output_file_name = os.path.join(test_dir, 'output.cpp')
+            with open(input_file_name, 'w') as input_file:
+                input_file.write(source)
+            generate(input_file_name, output_file_name, iter_groups)
+            with open(output_file_name, 'r') as output_file:
+                return output_file.read()
+        finally:
+            shutil.rmtree(test_dir)
+
+    return engine
+
+
+def async_engine(source, iter_groups):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            generate_source_async(source, iter_groups))
+    finally:
+        loop.close()
+
+
+def incremental_engine(source, iter_groups):
+    """Generates incrementally into a new state directory, then again from the
+    kept state, raising AssertionError if the two outputs differ"""
+    state_dir = tempfile.mkdtemp()
+    try:
+        first = generate_source(source, iter_groups, state_dir)
+        second = generate_source(source, iter_groups, state_dir)
+        if first != second:
+            raise AssertionError('Generating from kept state changed the '
+                                 'output')
+        return second
+    finally:
+        shutil.rmtree(state_dir)
+
+
+def source_template_engine(source, iter_groups):
+    """Renders from a SourceTemplate twice, the second time from its indexes,
+    raising AssertionError if the two outputs differ"""
+    source_template = SourceTemplate(source)
+    first = source_template.render(iter_groups)
+    if source_template.render(iter_groups) != first:
+        raise AssertionError('Rendering from an index changed the output')
+    return first
+
+
+def checkpoint_engine(source, iter_groups):
+    """Generates with a checkpoint recorded after every group"""
+    checkpoint_dir = tempfile.mkdtemp()
+    try:
+        return file_engine(
+            lambda input_file_name, output_file_name, iter_groups:
+            generate_file(input_file_name,
+                          output_file_name,
+                          iter_groups,
+                          checkpoint_dir=checkpoint_dir,
+                          checkpoint_interval=0))(source, iter_groups)
+    finally:
+        shutil.rmtree(checkpoint_dir)
+
+
+def dedup_engine(source, iter_groups):
+    """Generates with a new DedupRegistry. Generated specs rarely repeat an
+    instantiation, and where one is dropped the output is expected to differ,
+    so the output of generate_source is returned instead."""
+    registry = DedupRegistry()
+    generated = generate_source(source, iter_groups, dedup=registry)
+    if registry.dropped:
+        return generate_source(source, iter_groups)
+    return generated
+
+
+def check_engine(source, iter_groups):
+    """Generates, then checks the output with and without a manifest, raising
+    AssertionError if either check reports it stale"""
+    test_dir = tempfile.mkdtemp()
+    try:
+        input_file_name = os.path.join(test_dir, 'input.cpp.in')
+        output_file_name = os.path.join(test_dir, 'output.cpp')
+        with open(input_file_name, 'w') as input_file:
+            input_file.write(source)
+        for manifest in [False, True]:
+            generated = generate_file(input_file_name, output_file_name,
+                                      iter_groups, manifest=manifest)
+            if generate_file(input_file_name, output_file_name, iter_groups,
+                             check=True, manifest=manifest).stale:
+                raise AssertionError('The output was checked as stale')
+        return generated
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def guarded_source(source, iter_groups):
+    """Returns the source generate_file_guarded is expected to write on its
+    first run, with each line holding only an insertion point replaced by a
+    guarded region around the reference expansion of its group"""
+    expansions = {}
+    for iter_group in iter_groups:
+        generated = reference.generate_source(iter_group.insertion_point,
+                                              [iter_group])
+        expansions[iter_group.insertion_point] = (iter_group, generated)
+    lines = []
+    for line in source.split('\n'):
+        if line.strip() not in expansions:
+            lines.append(line)
+            continue
+        iter_group, generated = expansions[line.strip()]
+        indent = line[:reference.get_space_count(line)]
+        body = ''
+        if generated:
+            body = indent + reference.add_spaces_to_lines(
+                len(indent), generated)
+            if not body.endswith('\n'):
+                body += '\n'
+        lines.append(indent + '// py_gen begin ' + iter_group.insertion_point +
+                     ' ' + iter_group.spec_hash() + '\n' + body + indent +
+                     '// py_gen end ' + iter_group.insertion_point)
+    return '\n'.join(lines)
+
+
+def guarded_engine(source, iter_groups):
+    """Generates guarded regions in place, raising AssertionError if they
+    don't hold the reference expansions, if generating again changes them or
+    if a check reports them stale. The output, which holds the markers, is
+    expected to differ, so the output of generate_source is returned instead.
+    Guarded regions are only checked where every group has its own insertion
+    point, alone on its lines, which no generated string holds."""
+    points = [iter_group.insertion_point for iter_group in iter_groups]
+    if len(set(points)) != len(points) or any(
+            point in line and line.strip() != point
+            for line in source.split('\n') for point in points):
+        return generate_source(source, iter_groups)
+    for iter_group in iter_groups:
+        generated = reference.generate_source(iter_group.insertion_point,
+                                              [iter_group])
+        if any(point in generated for point in points):
+            return generate_source(source, iter_groups)
+    test_dir = tempfile.mkdtemp()
+    try:
+        file_name = os.path.join(test_dir, 'guarded.cpp')
+        with open(file_name, 'w') as guarded_file:
+            guarded_file.write(source)
+        guarded = generate_file_guarded(file_name, iter_groups)
+        if guarded != guarded_source(source, iter_groups):
+            raise AssertionError('The guarded regions don\'t hold the '
+                                 'reference expansions')
+        if generate_file_guarded(file_name, iter_groups) != guarded:
+            raise AssertionError('Generating again changed the guarded '
+                                 'regions')
+        if generate_file_guarded(file_name, iter_groups, check=True).stale:
+            raise AssertionError('The guarded regions were checked as stale')
+    finally:
+        shutil.rmtree(test_dir)
+    return generate_source(source, iter_groups)
+
+
+def shards_engine(source, iter_groups):
+    """Generates a single shard, which holds every copy of each group. Groups
+    which generate no copies, end with the unsubstituted template or whose
+    copies aren't separable, as by is_separable, are generated differently by
+    sharding, so the output of generate_source is returned instead."""
+    for iter_group in iter_groups:
+        if not is_separable(iter_group):
+            return generate_source(source, iter_groups)
+        copies = generate_source(iter_group.insertion_point, [iter_group])
+        if (not copies or iter_group.combine_iters
+                and copies.endswith(iter_group.template.template)):
+            return generate_source(source, iter_groups)
+    return file_engine(
+        lambda input_file_name, output_file_name, iter_groups:
+        generate_sharded_files(input_file_name, [output_file_name],
+                               iter_groups, ShardMode.position))(source,
+                                                                 iter_groups)
+
+
+def distributed_engine(source, iter_groups):
+    """Generates through a new work queue, with this process running every
+    task and the groups split into tasks of a few copies"""
+    queue_dir = tempfile.mkdtemp()
+    try:
+        return file_engine(
+            lambda input_file_name, output_file_name, iter_groups:
+            generate_files_distributed(
+                [(input_file_name, output_file_name, iter_groups)],
+                queue_dir,
+                task_rows=2))(source, iter_groups)
+    finally:
+        shutil.rmtree(queue_dir)
+
+
+# Each engine takes a source and a list of groups and returns the generated
+# source. Every engine and mode producing generated source should be listed.
+ENGINES = [
+    ('generate_source', generate_source),
+    ('generate_source_async', async_engine),
+    ('generate_source incremental', incremental_engine),
+    ('SourceTemplate', source_template_engine),
+    ('generate_source dedup', dedup_engine),
+    ('generate_file', file_engine(generate_file)),
+    ('generate_file_mapped', file_engine(generate_file_mapped)),
+    ('generate_file_parallel',
+     file_engine(lambda input_file_name, output_file_name, iter_groups:
+                 generate_file_parallel(input_file_name, output_file_name,
+                                        iter_groups, workers=1,
+                                        chunk_size=8))),
+    ('generate_file_parallel workers=2',
+     file_engine(lambda input_file_name, output_file_name, iter_groups:
+                 generate_file_parallel(input_file_name, output_file_name,
+                                        iter_groups, workers=2,
+                                        chunk_size=8))),
+    ('generate_file checkpointed', checkpoint_engine),
+    ('generate_file locked',
+     file_engine(lambda input_file_name, output_file_name, iter_groups:
+                 generate_file(input_file_name, output_file_name,
+                               iter_groups, lock=True))),
+    ('generate_file check', check_engine),
+    ('generate_file_guarded', guarded_engine),
+    ('generate_sharded_files', shards_engine),
+    ('generate_files_distributed', distributed_engine),
+]
+
+
+class TestEquivalence(unittest.TestCase):
+    """Compares every engine with the reference implementation on randomly
+    generated specs, shrinking any difference found to a minimal spec."""
+    seed = 0
+    iterations = 150
+
+    def test_engines_match_reference(self):
+        rng = random.Random(self.seed)
+        for _ in range(self.iterations):
+            spec = random_spec(rng)
+            for name, engine in ENGINES:
+                fails = lambda candidate: differs(engine, candidate)
+                if fails(spec):
+                    minimal = shrink(spec, fails)
+                    self.fail(name + ' differs from the reference for\n' +
+                              format_spec(minimal) + '\nreference: ' +
+                              repr(outcome(reference.generate_source,
+                                           minimal)) + '\n' + name + ': ' +
+                              repr(outcome(engine, minimal)))
+
+    def test_shrink(self):
+        # An engine which loses the last comma_list output of a group is shrunk
+        # to a single group and Iterable
+        def broken_engine(source, iter_groups):
+            result = reference.generate_source(source, iter_groups)
+            if any(iterable.comma_list for group in iter_groups
+                   for iterable in getattr(group, 'iterables', [])):
+                return result[:-1]
+            return result
+
+        rng = random.Random(1)
+        spec = None
+        while spec is None or not differs(broken_engine, spec):
+            spec = random_spec(rng)
+        minimal = shrink(spec, lambda candidate: differs(
+            broken_engine, candidate))
+        self.assertTrue(differs(broken_engine, minimal))
+        self.assertEqual(1, len(minimal['groups']))
+        self.assertEqual(1, len(minimal['groups'][0]['iterables']))
+        self.assertTrue(minimal['groups'][0]['iterables'][0][4])
+
+
+def run_equivalence_tests(seed=0, iterations=150):
+    TestEquivalence.seed = seed
+    TestEquivalence.iterations = iterations
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestEquivalence)
+    unittest.TextTestRunner().run(suite)
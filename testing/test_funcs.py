@@ -18,9 +18,11 @@
 import unittest
 import os
 import sys
+import tempfile
 from ..internal.funcs import (get_space_count, add_spaces_to_lines,
                               read_from_file, insert_in_source, write_to_file,
-                              clang_format)
+                              clang_format, map_file, find_all, get_line_bounds,
+                              splice_in_buffer, write_vectored)
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -94,6 +96,64 @@ class TestFuncs(unittest.TestCase):
         with open(file_name, 'r') as input_file:
             self.assertNotEqual(unformatted_input, input_file.read())
 
+    def test_map_file(self):
+        test_dir = tempfile.mkdtemp()
+        file_name = os.path.join(test_dir, 'testFileMapped.txt')
+        for contents in [b'', b'a\nb']:
+            with open(file_name, 'wb') as output_file:
+                output_file.write(contents)
+            with map_file(file_name) as buffer:
+                self.assertEqual(contents, buffer[:])
+        os.remove(file_name)
+        os.rmdir(test_dir)
+
+    def test_find_all(self):
+        self.assertEqual([], find_all(b'abc', b'd'))
+        self.assertEqual([0, 4], find_all(b'@i@ @i@', b'@i@'))
+        # Occurrences don't overlap, as with str.replace
+        self.assertEqual([0, 2], find_all(b'aaaaa', b'aa'))
+
+    def test_get_line_bounds(self):
+        buffer = b'a\n  @ip@ b\r\nc'
+        self.assertEqual((2, 10), get_line_bounds(buffer, 4))
+        self.assertEqual((0, 1), get_line_bounds(buffer, 0))
+        self.assertEqual((12, 13), get_line_bounds(buffer, 12))
+        long_line = b'x\n' + b' ' * 1000 + b'@ip@'
+        self.assertEqual((2, len(long_line)),
+                         get_line_bounds(long_line, len(long_line) - 4))
+
+    def test_splice_in_buffer(self):
+        source = 'a\n  @inP1@\n  c\n@inP2@\ne'
+        insertions = [('@inP1@', 'b\nb\n  b'), ('@inP2@', '  d\n  d\nd')]
+        buffers = splice_in_buffer(source.encode('utf-8'), insertions)
+        expected = source
+        for insertion_point, replacement_string in insertions:
+            expected = insert_in_source(expected, insertion_point,
+                                        replacement_string)
+        self.assertEqual(expected.encode('utf-8'),
+                         b''.join(bytes(buffer) for buffer in buffers))
+        # Replacements creating later insertion points can't be spliced
+        self.assertIsNone(
+            splice_in_buffer(b'@inP1@ @inP2@', [('@inP1@', '@inP2@'),
+                                                ('@inP2@', 'd')]))
+        self.assertIsNone(
+            splice_in_buffer(b'@inP1@P2@', [('@inP1@', 'x@in'),
+                                            ('@inP2@', 'd')]))
+        # Earlier replacements changing the indentation of a later line
+        self.assertIsNone(
+            splice_in_buffer(b'@inP1@ @inP2@', [('@inP1@', 'a\n b'),
+                                                ('@inP2@', 'd')]))
+
+    def test_write_vectored(self):
+        test_dir = tempfile.mkdtemp()
+        file_name = os.path.join(test_dir, 'testFileVectored.txt')
+        buffers = [b'a', memoryview(b'bcd')[1:], b'', bytearray(b'e')] * 3000
+        write_vectored(file_name, buffers)
+        with open(file_name, 'rb') as input_file:
+            self.assertEqual(b'acde' * 3000, input_file.read())
+        os.remove(file_name)
+        os.rmdir(test_dir)
+
 
 def run_func_tests():
     suite = unittest.TestLoader().loadTestsFromTestCase(TestFuncs)
@@ -0,0 +1,178 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+from string import Template
+from .groups import make_group
+from .test_equivalence import VALUES, build_groups, random_spec
+from ..interface import generate_source
+from ..internal.incremental import (expand_rows, get_render_key,
+                                    get_state_file_name, read_state)
+from ..internal.iters import expand_iter_group
+from ..iter_classes import Iterable, Itermode, IterGroup, RemovalIterGroup
+
+SIZES = ['1', '2', '3']
+
+
+def change_vals(rng, spec):
+    """Returns spec with a value added to or removed from the vals of one
+    Iterable of each group"""
+    groups = []
+    for group in spec['groups']:
+        group = dict(group)
+        iterables = list(group['iterables'])
+        if iterables:
+            index = rng.randrange(len(iterables))
+            key, vals, mode, modifier, comma_list = iterables[index]
+            if vals and rng.random() < 0.5:
+                vals = vals[:-1]
+            else:
+                vals = vals + [rng.choice(VALUES)]
+            iterables[index] = (key, vals, mode, modifier, comma_list)
+        group['iterables'] = iterables
+        groups.append(group)
+    return {'source': spec['source'], 'groups': groups}
+
+
+class TestIncremental(unittest.TestCase):
+    """Tests incremental generation from the rows kept in a state directory."""
+
+    def setUp(self):
+        self.state_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.state_dir)
+
+    def test_substitutes_new_rows(self):
+        # Adding a value only substitutes the rows using it
+        state, substituted = expand_rows(make_group(['int', 'float'], SIZES),
+                                         None)
+        self.assertEqual(substituted, 6)
+        for types, expected in [(['int', 'float', 'double'], 3),
+                                (['int', 'double'], 0), (['char'], 3)]:
+            iter_group = make_group(types, SIZES)
+            state, substituted = expand_rows(iter_group, state)
+            self.assertEqual(substituted, expected)
+            self.assertEqual(state.generated, expand_iter_group(iter_group))
+            self.assertTrue(state.is_consistent())
+        # Adding a value to the last Iterable copies every earlier row as one
+        # run
+        iter_group = IterGroup('@ip@', Template('${T}${N};'), [
+            Iterable('T', ['a', 'b'], Itermode.product),
+            Iterable('N', ['1', '2', '3'], Itermode.product)
+        ])
+        state, _ = expand_rows(iter_group, None)
+        iter_group = IterGroup('@ip@', Template('${T}${N};'), [
+            Iterable('T', ['a', 'b'], Itermode.product),
+            Iterable('N', ['0', '1', '2', '3'], Itermode.product)
+        ])
+        state, substituted = expand_rows(iter_group, state)
+        self.assertEqual(substituted, 2)
+        self.assertEqual(state.generated, 'a0;b0;a1;b1;a2;b2;a3;b3;')
+
+    def test_state_dir(self):
+        source = 'namespace test {\n  @ip@\n}\n'
+        generate_source(source, [make_group(['int'], SIZES)], self.state_dir)
+        iter_group = make_group(['int', 'float'], SIZES)
+        self.assertEqual(
+            generate_source(source, [iter_group], self.state_dir),
+            generate_source(source, [iter_group]))
+        render_key = get_render_key(iter_group)
+        state = read_state(
+            get_state_file_name(self.state_dir, render_key), render_key)
+        self.assertEqual(state.lengths,
+                         [len('template void f<int, 1>();\n'),
+                          len('template void f<float, 1>();\n')] * 3)
+        # A different template doesn't use the kept rows
+        other_group = make_group(['int', 'float'], SIZES,
+                                 'g<${T}, ${N}>();\n')
+        self.assertNotEqual(
+            get_state_file_name(self.state_dir, render_key),
+            get_state_file_name(self.state_dir,
+                                get_render_key(other_group)))
+        self.assertEqual(
+            generate_source(source, [other_group], self.state_dir),
+            generate_source(source, [other_group]))
+        # Carriage returns in the kept rows are read back unchanged
+        for types in [['int'], ['int', 'float']]:
+            iter_group = make_group(types, SIZES, 'x${T}\r${N};')
+            self.assertEqual(
+                generate_source(source, [iter_group], self.state_dir),
+                generate_source(source, [iter_group]))
+
+    def test_unsplittable_groups(self):
+        # Templates with escaped or invalid delimiters, and values containing
+        # delimiters, are generated in full
+        groups = [
+            make_group(['int'], SIZES, '$${T} ${N}'),
+            make_group(['int'], SIZES, '$ ${T} ${N}'),
+            make_group(['$N'], SIZES)
+        ]
+        for iter_group in groups:
+            self.assertEqual(expand_rows(iter_group, None), None)
+            self.assertEqual(
+                generate_source('@ip@', [iter_group], self.state_dir),
+                generate_source('@ip@', [iter_group]))
+        self.assertEqual(os.listdir(self.state_dir), [])
+
+    def test_removal(self):
+        # Uncombined removal groups are generated by rows, and combined groups
+        # are generated in full
+        iter_group = RemovalIterGroup(
+            '@ip@', Template('${a}${b};'),
+            [Iterable('a', ['x', 'y'], Itermode.product),
+             Iterable('b', ['1', '2'], Itermode.product)],
+            [Iterable('', ['y'], Itermode.product)])
+        state, _ = expand_rows(iter_group, None)
+        self.assertEqual(state.generated, 'x1;x2;')
+        iter_group = RemovalIterGroup(
+            '@ip@', Template('${a}${b};'),
+            [Iterable('a', ['x', 'y'], Itermode.product),
+             Iterable('b', ['1', '2'], Itermode.product)],
+            [Iterable('', ['y'], Itermode.product)], True)
+        self.assertEqual(expand_rows(iter_group, None), None)
+        self.assertEqual(
+            generate_source('@ip@', [iter_group], self.state_dir),
+            'x1;${a}${b};')
+
+    def test_random_changes(self):
+        # Generating a changed spec from the state of the original spec must
+        # match generating it without state
+        rng = random.Random(0)
+        for _ in range(100):
+            spec = random_spec(rng)
+            changed = change_vals(rng, spec)
+            try:
+                iter_groups = build_groups(changed)
+                generate_source(spec['source'], build_groups(spec),
+                                self.state_dir)
+                expected = generate_source(changed['source'], iter_groups)
+            except (IndexError, ValueError):
+                # Changed combined groups may no longer be valid
+                continue
+            self.assertEqual(
+                generate_source(changed['source'], iter_groups,
+                                self.state_dir), expected)
+
+
+def run_incremental_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestIncremental)
+    unittest.TextTestRunner().run(suite)
@@ -19,7 +19,9 @@ import unittest
 from string import Template
 import os
 import sys
-from ..interface import generate_source, generate_file
+import tempfile
+from ..interface import (generate_source, generate_file, generate_file_mapped,
+                         generate_file_guarded)
 from ..iter_classes import Itermode, Iterable, IterGroup, RemovalIterGroup
 
 TEST_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -158,6 +160,83 @@ a bc c ba e\n  a ab c bb e\n  a ac c bb e\n  a bc c bb e\n\n    1 111 2\n    1 \
         with open(file_name, 'r') as input_file:
             self.assertNotEqual(unformatted_input, input_file.read())
 
+    def test_generate_file_mapped(self):
+        test_dir = tempfile.mkdtemp()
+        file_name = os.path.join(test_dir, 'testFileGenerate.txt')
+        iter_groups = [
+            IterGroup('@ip1@', Template('a ${key0} c ${key1} e\n'), [
+                Iterable('key0', ['a', 'b', 'c'], Itermode.combinations, 2),
+                Iterable('key1', ['a', 'b'], Itermode.product, 2)
+            ]),
+            IterGroup('@ip2@', Template('1 ${key0} 2\n@ip1@\n'), [
+                Iterable('key0', ['1', '2', '3'], Itermode.combinationsWR, 3)
+            ])
+        ]
+        sources = [
+            'Line one\n  @ip1@\n    @ip2@\nEnding line',
+            # The first group can't be spliced as the second group creates
+            # more of its insertion point
+            'Line one\n  @ip2@\n    @ip1@\nEnding line', ''
+        ]
+        for source in sources:
+            with open(file_name + '.in', 'w') as output_file:
+                output_file.write(source)
+            for groups in [iter_groups, iter_groups[::-1]]:
+                expected = generate_source(source, groups)
+                size = generate_file_mapped(file_name + '.in', file_name,
+                                            groups)
+                with open(file_name, 'r') as input_file:
+                    self.assertEqual(expected, input_file.read())
+                self.assertEqual(len(expected.encode('utf-8')), size)
+        os.remove(file_name)
+        os.remove(file_name + '.in')
+        os.rmdir(test_dir)
+
+    def test_generate_file_guarded(self):
+        test_dir = tempfile.mkdtemp()
+        file_name = os.path.join(test_dir, 'testFileGuarded.txt')
+        group0 = IterGroup('@ip1@', Template('a ${key0}\n'), [
+            Iterable('key0', ['a', 'b'], Itermode.combinations, 1)
+        ])
+        group1 = IterGroup('@ip2@', Template('b ${key0}\n'), [
+            Iterable('key0', ['1', '2'], Itermode.product, 1)
+        ])
+        with open(file_name, 'w') as output_file:
+            output_file.write('Line one\n  @ip1@\n    @ip2@\nEnding line')
+        hash0 = group0.spec_hash()
+        hash1 = group1.spec_hash()
+        first_source = generate_file_guarded(file_name, [group0, group1])
+        self.assertEqual(
+            'Line one\n  // py_gen begin @ip1@ ' + hash0 +
+            '\n  a a\n  a b\n  // py_gen end @ip1@\n    // py_gen begin @ip2@ ' +
+            hash1 + '\n    b 1\n    b 2\n    // py_gen end @ip2@\nEnding line',
+            first_source)
+        # Running again with the same groups leaves the file unchanged
+        self.assertEqual(first_source,
+                         generate_file_guarded(file_name, [group0, group1]))
+        # Edit the first region by hand, then change only the second group.
+        # The first region is copied through rather than generated again.
+        with open(file_name, 'w') as output_file:
+            output_file.write(first_source.replace('a b', 'a edited'))
+        group1 = IterGroup('@ip2@', Template('b ${key0}\n'), [
+            Iterable('key0', ['3'], Itermode.product, 1)
+        ])
+        second_source = generate_file_guarded(file_name, [group0, group1])
+        self.assertEqual(
+            'Line one\n  // py_gen begin @ip1@ ' + hash0 +
+            '\n  a a\n  a edited\n  // py_gen end @ip1@\n    // py_gen begin @ip2@ '
+            + group1.spec_hash() +
+            '\n    b 3\n    // py_gen end @ip2@\nEnding line', second_source)
+        with open(file_name, 'r') as input_file:
+            self.assertEqual(second_source, input_file.read())
+        # Insertion points must be alone on their line
+        with open(file_name, 'w') as output_file:
+            output_file.write('x @ip1@')
+        with self.assertRaises(ValueError):
+            generate_file_guarded(file_name, [group0])
+        os.remove(file_name)
+        os.rmdir(test_dir)
+
 
 def run_interface_tests():
     suite = unittest.TestLoader().loadTestsFromTestCase(TestInterface)
@@ -0,0 +1,122 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import unittest
+import pickle
+from string import Template
+from ..iter_classes import (Itermode, Iterable, IterGroup, RemovalIterGroup,
+                            LengthPolicy)
+
+
+class TestIterClasses(unittest.TestCase):
+    """Tests the construction, validation, hashing and pickling of the classes
+    in the iter_classes file."""
+
+    def test_iterable_is_immutable(self):
+        it = Iterable('key0', ['a', 'b'], Itermode.product, 2)
+        self.assertEqual(('a', 'b'), it.vals)
+        with self.assertRaises(AttributeError):
+            it.key = 'key1'
+        with self.assertRaises(AttributeError):
+            it.extra = 1
+
+    def test_default_vals_not_shared(self):
+        self.assertEqual((), Iterable().vals)
+        self.assertEqual(Iterable(), Iterable())
+
+    def test_content_hash(self):
+        it0 = Iterable('key0', ['a', 'b'], Itermode.product, 2)
+        it1 = Iterable('key0', ('a', 'b'), Itermode.product, 2)
+        it2 = Iterable('key0', ['a', 'c'], Itermode.product, 2)
+        self.assertEqual(it0, it1)
+        self.assertEqual(hash(it0), hash(it1))
+        self.assertEqual(it0.spec_hash(), it1.spec_hash())
+        self.assertNotEqual(it0, it2)
+        self.assertNotEqual(it0.spec_hash(), it2.spec_hash())
+        group0 = IterGroup('@ip@', Template('${key0}'), [it0])
+        group1 = IterGroup('@ip@', Template('${key0}'), [it1])
+        self.assertEqual(group0, group1)
+        self.assertEqual(1, len(set([group0, group1])))
+        self.assertEqual(group0.spec_hash(), group1.spec_hash())
+
+    def test_pickle(self):
+        groups = [
+            IterGroup(
+                '@ip@',
+                Template('${key0} ${key1}'), [
+                    Iterable('key0', ['a', 'b'], Itermode.permutations, 2),
+                    Iterable('key1', ['a', 'b'], Itermode.product, 1, True)
+                ],
+                combine_iters=True),
+            RemovalIterGroup('@ip@', Template('${key0}'), [
+                Iterable('key0', ['a', 'b'], Itermode.combinations, 1)
+            ], [Iterable('', ['a'], Itermode.combinations, 1)])
+        ]
+        for group in groups:
+            copy = pickle.loads(pickle.dumps(group))
+            self.assertEqual(group, copy)
+            self.assertEqual(group.spec_hash(), copy.spec_hash())
+            self.assertEqual(group.template.template, copy.template.template)
+
+    def test_invalid_itermode(self):
+        with self.assertRaises(TypeError):
+            Iterable('key0', ['a'], 'product', 1)
+        with self.assertRaises(ValueError):
+            IterGroup('@ip@', Template('${key0}'), [Iterable('key0', ['a'])])
+        with self.assertRaises(ValueError):
+            RemovalIterGroup('@ip@', Template('${key0}'), [],
+                             [Iterable('key0', ['a'])])
+
+    def test_invalid_iter_modifier(self):
+        for modifier in [-1, 1.5, '2', True]:
+            with self.assertRaises(ValueError):
+                Iterable('key0', ['a'], Itermode.product, modifier)
+
+    def test_combined_length_mismatch(self):
+        iterables = [
+            Iterable('key0', ['a', 'b', 'c'], Itermode.combinations, 2),
+            Iterable('key1', ['a', 'b', 'c'], Itermode.permutations, 2)
+        ]
+        with self.assertRaises(ValueError):
+            IterGroup('@ip@', Template('${key0}'), iterables, True)
+        with self.assertRaises(ValueError):
+            RemovalIterGroup('@ip@', Template('${key0}'), iterables, [], True)
+        with self.assertRaises(ValueError):
+            IterGroup('@ip@', Template('${key0}'), [], True)
+        # Uncombined groups and other length policies may have differing
+        # lengths
+        IterGroup('@ip@', Template('${key0}'), iterables)
+        IterGroup('@ip@', Template('${key0}'), iterables, True,
+                  LengthPolicy.shortest)
+        RemovalIterGroup('@ip@', Template('${key0}'), iterables, [], True,
+                         LengthPolicy.cycle)
+        with self.assertRaises(TypeError):
+            IterGroup('@ip@', Template('${key0}'), iterables, True, 'cycle')
+
+    def test_invalid_group_arguments(self):
+        it = Iterable('key0', ['a'], Itermode.product, 1)
+        with self.assertRaises(TypeError):
+            IterGroup('@ip@', '${key0}', [it])
+        with self.assertRaises(TypeError):
+            IterGroup(None, Template('${key0}'), [it])
+        with self.assertRaises(TypeError):
+            IterGroup('@ip@', Template('${key0}'), ['key0'])
+
+
+def run_iter_class_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestIterClasses)
+    unittest.TextTestRunner().run(suite)
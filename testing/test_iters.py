@@ -22,8 +22,11 @@ from ..internal.iters import (
     gen_product, dispatch_iterations, gen_combinations_list,
     gen_combinations_with_replacement_list, gen_permutations_list,
     gen_product_list, combined_dispatcher, removal_dispatcher,
-    combined_removal_dispatcher)
-from ..iter_classes import Iterable, Itermode
+    combined_removal_dispatcher, iterate_bindings, get_binding_keys,
+    get_substitutions, substitute_outputs)
+from ..internal.modes import iterate_outputs
+from ..iter_classes import (BindingForm, Iterable, IterGroup, Itermode,
+                            LengthPolicy, RemovalIterGroup)
 
 
 class TestIters(unittest.TestCase):
@@ -419,6 +422,43 @@ class TestDispatchIterations(unittest.TestCase):
         self.assertEqual(perm_res.template, 'a, b | b, a | ')
         self.assertEqual(prod_res.template, 'a, a | a, b | b, a | b, b | ')
 
+    def test_bind_elements(self):
+        t = Template('${id0}: ${id0_1} ${id0_0} | ')
+        its = [
+            Iterable(
+                key='id0',
+                vals=['a', 'b'],
+                itermode=Itermode.permutations,
+                iter_modifier=2,
+                comma_list=True,
+                bind_elements=True)
+        ]
+        res = dispatch_iterations(t, its)
+        self.assertEqual(res.template, 'a, b: b a | b, a: a b | ')
+
+    def test_substitute_outputs_slots(self):
+        # Copies only replacing changed slots must match substituting every
+        # output, including outputs of different lengths, repeated outputs,
+        # escaped and invalid delimiters and keys of other iterables
+        t = Template('$$${id_1} ${id}${other} $id_0 ${id_01} $$ $ ${id_2}|')
+        for its in [
+                Iterable('id', ['a', 'b', 'c'], Itermode.product, 3, True,
+                         True),
+                Iterable('id', ['a', 'b', 'c'], Itermode.grayProduct, 3,
+                         bind_elements=True),
+                Iterable('id', ['a', 'b', 'c'], Itermode.powerset, 0,
+                         bind_elements=True),
+                Iterable('id', ['a', 'a', '$b'], Itermode.permutations, 2,
+                         bind_elements=True),
+                Iterable('id', ['a', 'b'], Itermode.product, 2)
+        ]:
+            expected = ''.join(
+                t.safe_substitute(get_substitutions(its, output))
+                for output in iterate_outputs(its))
+            self.assertEqual(
+                substitute_outputs(t, its, iterate_outputs(its)).template,
+                expected)
+
 
 class TestCombinedDispatchIterations(unittest.TestCase):
     def test_gen_combinations_list(self):
@@ -474,6 +514,38 @@ class TestCombinedDispatchIterations(unittest.TestCase):
  c  | 31  c, a  | 32  c, b  | 33  c, c  | ',
             combined_dispatcher(template2, iterables2).template)
 
+        iterables3 = [
+            Iterable('key0', ['1', '2', '3'], Itermode.combinations, 2),
+            Iterable('key1', ['a', 'b', 'c'], Itermode.combinations, 2,
+                     bind_elements=True)
+        ]
+        template3 = Template('${key0}  ${key1_0}<${key1_1}  | ')
+        self.assertEqual('12  a<b  | 13  a<c  | 23  b<c  | ',
+                         combined_dispatcher(template3, iterables3).template)
+
+    def test_combined_length_policies(self):
+        iterables = [
+            Iterable('key0', ['1', '2', '3'], Itermode.combinations, 1),
+            Iterable('key1', ['a', 'b'], Itermode.combinations, 1)
+        ]
+        template = Template('${key0}${key1} | ')
+        self.assertEqual(
+            '1a | 2b | ',
+            combined_dispatcher(template, iterables,
+                                LengthPolicy.shortest).template)
+        self.assertEqual(
+            '1a | 2b | 3a | ',
+            combined_dispatcher(template, iterables,
+                                LengthPolicy.cycle).template)
+        with self.assertRaises(ValueError):
+            combined_dispatcher(template, iterables, LengthPolicy.strict)
+        # An Iterable without outputs can't be cycled
+        iterables.append(Iterable('key2', [], Itermode.combinations, 1))
+        self.assertEqual(
+            template.template,
+            combined_dispatcher(template, iterables,
+                                LengthPolicy.cycle).template)
+
     def test_removal_dispatcher(self):
         in_iterables = [
             Iterable('key0', ['1', '2', '3'], Itermode.product, 2),
@@ -492,6 +564,18 @@ class TestCombinedDispatchIterations(unittest.TestCase):
             removal_dispatcher(template, in_iterables,
                                removal_iterables).template)
 
+    def test_removal_dispatcher_bind_elements(self):
+        in_iterables = [
+            Iterable('key0', ['1', '2', '3'], Itermode.combinations, 2,
+                     bind_elements=True)
+        ]
+        removal_iterables = [Iterable('', ['1', '2'], Itermode.product, 2)]
+        template = Template('${key1_1}${key0_1}${key0_0} | ')
+        self.assertEqual(
+            '${key1_1}31 | ${key1_1}32 | ',
+            removal_dispatcher(template, in_iterables,
+                               removal_iterables).template)
+
     def test_combined_removal_dispatcher(self):
         in_iterables = [
             Iterable('key0', ['1', '2', '3'], Itermode.product, 2),
@@ -508,6 +592,97 @@ class TestCombinedDispatchIterations(unittest.TestCase):
             combined_removal_dispatcher(template, in_iterables,
                                         removal_iterables).template)
 
+    def test_combined_values_with_delimiter(self):
+        # Each combination is substituted into the text generated before it,
+        # so values holding '$' are substituted again by later combinations
+        in_iterables = [
+            Iterable('key0', ['$$', '${key1}', 'x$', '$key'],
+                     Itermode.product),
+            Iterable('key1', ['a', 'b', 'c', 'd'], Itermode.product)
+        ]
+        template = Template('${key0}${key1}|')
+        self.assertEqual(
+            '$a|bb|xd|$keyd|',
+            combined_dispatcher(template, in_iterables).template)
+        self.assertEqual(
+            '$a|bb|x${key1}|${key0}${key1}|',
+            combined_removal_dispatcher(
+                template, in_iterables,
+                [Iterable('', ['d'], Itermode.product)]).template)
+        self.assertEqual(
+            '$a|xd|$keyd|',
+            combined_removal_dispatcher(
+                template, in_iterables,
+                [Iterable('', ['b'], Itermode.product)]).template)
+
+
+    def test_iterate_bindings_forms(self):
+        iter_group = IterGroup('@ip@', Template('${a}${b_0} | '), [
+            Iterable('a', ['1', '2'], Itermode.product),
+            Iterable('b', ['x', 'y'], Itermode.permutations, 2, True, True),
+            Iterable('a', ['3'], Itermode.product)
+        ])
+        self.assertEqual(['a', 'b', 'b_0', 'b_1'],
+                         get_binding_keys(iter_group))
+        self.assertEqual([{
+            'a': '1',
+            'b': 'x, y',
+            'b_0': 'x',
+            'b_1': 'y'
+        }, {
+            'a': '2',
+            'b': 'x, y',
+            'b_0': 'x',
+            'b_1': 'y'
+        }], list(iterate_bindings(iter_group))[:2])
+        self.assertEqual([('1', 'x, y', 'x', 'y'), ('2', 'x, y', 'x', 'y'),
+                          ('1', 'y, x', 'y', 'x'), ('2', 'y, x', 'y', 'x')],
+                         list(iterate_bindings(iter_group, BindingForm.tuple)))
+        self.assertEqual(
+            (('1', ), ('x', 'y'), ('3', )),
+            next(iterate_bindings(iter_group, BindingForm.raw)))
+        with self.assertRaises(TypeError):
+            next(iterate_bindings(iter_group, 'dict'))
+
+    def test_iterate_bindings_removal(self):
+        in_iterables = [
+            Iterable('key0', ['1', '2', '3'], Itermode.product, 2),
+            Iterable('key1', ['a', 'b', 'c'], Itermode.product, 2, True)
+        ]
+        removal_iterables = [
+            Iterable('', ['1', '2'], Itermode.product, 2),
+            Iterable('', ['a', 'b'], Itermode.product, 2, True)
+        ]
+        # Combined groups leave out combinations including a removed output
+        iter_group = RemovalIterGroup('@ip@', Template(''), in_iterables,
+                                      removal_iterables, True)
+        self.assertEqual([('13', 'a, c'), ('23', 'b, c'), ('31', 'c, a'),
+                          ('32', 'c, b'), ('33', 'c, c')],
+                         list(iterate_bindings(iter_group,
+                                               BindingForm.tuple)))
+        iter_group = RemovalIterGroup('@ip@', Template(''), in_iterables,
+                                      removal_iterables)
+        bindings = list(iterate_bindings(iter_group, BindingForm.tuple))
+        self.assertEqual(25, len(bindings))
+        self.assertEqual([('13', 'a, c'), ('23', 'a, c')], bindings[:2])
+
+    def test_iterate_bindings_lengths(self):
+        iter_group = IterGroup('@ip@', Template(''), [
+            Iterable('k', ['a', 'b'], Itermode.powerset, bind_elements=True)
+        ])
+        # Element keys are those of the first output
+        self.assertEqual(['k', 'k_0'], get_binding_keys(iter_group))
+        self.assertEqual({'k': 'ab', 'k_0': 'a', 'k_1': 'b'},
+                         list(iterate_bindings(iter_group))[2])
+        with self.assertRaises(ValueError):
+            list(iterate_bindings(iter_group, BindingForm.tuple))
+        iter_group = IterGroup('@ip@', Template(''), [
+            Iterable('k', [], Itermode.product, bind_elements=True)
+        ])
+        self.assertEqual(['k'], get_binding_keys(iter_group))
+        self.assertEqual([], list(iterate_bindings(iter_group,
+                                                   BindingForm.tuple)))
+
 
 def run_iter_tests():
     suite = unittest.TestLoader().loadTestsFromTestCase(TestIters)
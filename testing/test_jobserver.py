@@ -0,0 +1,216 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import asyncio
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
+from .test_locking import register_test_itermode
+from ..async_interface import generate_files_async
+from ..interface import generate_file_parallel, generate_files
+from ..internal.jobserver import get_jobserver, parse_makeflags
+from ..iter_classes import Iterable, IterGroup
+
+
+def timed_enumerate(pool, r):
+    """Enumerates pool, appending the start and end time of a short sleep to
+    the file named by the first value, to find overlapping generations"""
+    start = time.time()
+    time.sleep(0.05)
+    with open(pool[0], 'a') as times_file:
+        times_file.write(repr(start) + ' ' + repr(time.time()) + '\n')
+    return ((val, ) for val in pool[1:])
+
+
+class TestJobserver(unittest.TestCase):
+    """Tests the make jobserver client and its use by generate_files."""
+
+    def setUp(self):
+        register_test_itermode(self, 'timed', timed_enumerate)
+        self.test_dir = tempfile.mkdtemp()
+        self.read_fd, self.write_fd = os.pipe()
+        self.makeflags = os.environ.get('MAKEFLAGS')
+
+    def tearDown(self):
+        if self.makeflags is None:
+            os.environ.pop('MAKEFLAGS', None)
+        else:
+            os.environ['MAKEFLAGS'] = self.makeflags
+        os.close(self.read_fd)
+        os.close(self.write_fd)
+        shutil.rmtree(self.test_dir)
+
+    def use_pipe(self, tokens):
+        os.write(self.write_fd, b'+' * tokens)
+        os.environ['MAKEFLAGS'] = (' -j --jobserver-auth=' +
+                                   str(self.read_fd) + ',' +
+                                   str(self.write_fd))
+
+    def free_tokens(self):
+        os.set_blocking(self.read_fd, False)
+        try:
+            return len(os.read(self.read_fd, 1024))
+        except BlockingIOError:
+            return 0
+        finally:
+            os.set_blocking(self.read_fd, True)
+
+    def test_parse_makeflags(self):
+        self.assertIsNone(parse_makeflags(''))
+        self.assertIsNone(parse_makeflags('-j4'))
+        self.assertEqual(('fds', 3, 4),
+                         parse_makeflags(' -j4 --jobserver-fds=3,4 -j'))
+        self.assertEqual(('fds', 5, 6),
+                         parse_makeflags('--jobserver-auth=3,4 '
+                                         '--jobserver-auth=5,6'))
+        self.assertEqual(('fifo', '/tmp/GMfifo1'),
+                         parse_makeflags('-j4 --jobserver-auth=fifo:'
+                                         '/tmp/GMfifo1'))
+        self.assertIsNone(parse_makeflags('--jobserver-auth=-2,-2'))
+
+    def test_tokens(self):
+        self.assertIsNone(get_jobserver({}))
+        # Descriptors which aren't pipes were closed by make
+        self.assertIsNone(
+            get_jobserver({'MAKEFLAGS': '--jobserver-auth=1023,1022'}))
+        self.use_pipe(2)
+        with get_jobserver() as jobserver:
+            tokens = [jobserver.acquire() for _ in range(3)]
+            # The implicit slot is taken first
+            self.assertEqual([None, b'+', b'+'], tokens)
+            self.assertEqual(0, self.free_tokens())
+            for token in tokens:
+                jobserver.release(token)
+            self.assertEqual(2, self.free_tokens())
+            self.assertIsNone(jobserver.acquire())
+        # The inherited descriptors aren't closed
+        os.write(self.write_fd, b'+')
+
+    def test_fifo(self):
+        fifo = os.path.join(self.test_dir, 'fifo')
+        os.mkfifo(fifo)
+        with get_jobserver({'MAKEFLAGS': '--jobserver-auth=fifo:' + fifo
+                            }) as jobserver:
+            jobserver.release(b'x')
+            self.assertIsNone(jobserver.acquire())
+            self.assertEqual(b'x', jobserver.acquire())
+        self.assertIsNone(
+            get_jobserver({'MAKEFLAGS': '--jobserver-auth=fifo:' + fifo +
+                           'missing'}))
+
+    def make_jobs(self, times_file):
+        input_file = os.path.join(self.test_dir, 'test.in')
+        with open(input_file, 'w') as output:
+            output.write('@a@')
+        return [(input_file, os.path.join(self.test_dir, str(index)), [
+            IterGroup('@a@', Template('${k}'),
+                      [Iterable('k', [times_file, str(index)], 'timed')])
+        ]) for index in range(4)]
+
+    def read_times(self, times_file):
+        with open(times_file, 'r') as times:
+            return sorted(
+                tuple(float(time) for time in line.split())
+                for line in times)
+
+    @unittest.skipIf('fork' not in multiprocessing.get_all_start_methods(),
+                     'needs fork to share the registered Itermode')
+    def test_generate_files(self):
+        times_file = os.path.join(self.test_dir, 'times')
+        jobs = self.make_jobs(times_file)
+        # With only the implicit slot, jobs run one at a time
+        self.use_pipe(0)
+        self.assertEqual(['0', '1', '2', '3'],
+                         generate_files(jobs, workers=4))
+        times = self.read_times(times_file)
+        self.assertTrue(
+            all(end <= start
+                for (_, end), (start, _) in zip(times, times[1:])))
+        self.use_pipe(1)
+        self.assertEqual(['0', '1', '2', '3'],
+                         generate_files(jobs, workers=4))
+        # Every token taken is given back
+        self.assertEqual(1, self.free_tokens())
+
+    @unittest.skipIf('fork' not in multiprocessing.get_all_start_methods(),
+                     'needs fork to share the registered Itermode')
+    def test_generate_file_parallel(self):
+        times_file = os.path.join(self.test_dir, 'times')
+        input_file_name, output_file_name, _ = self.make_jobs(times_file)[0]
+        iter_groups = [
+            IterGroup('@a@', Template('${k}'),
+                      [Iterable('k', [times_file] + ['x'] * 64, 'timed')])
+        ]
+        # Each chunk enumerates the values again in its worker, and with only
+        # the implicit slot the chunks are rendered one at a time
+        self.use_pipe(0)
+        generate_file_parallel(input_file_name, output_file_name, iter_groups,
+                               workers=4, chunk_size=16)
+        with open(output_file_name, 'r') as output_file:
+            self.assertEqual('x' * 64, output_file.read())
+        times = self.read_times(times_file)
+        self.assertLess(2, len(times))
+        self.assertTrue(
+            all(end <= start
+                for (_, end), (start, _) in zip(times, times[1:])))
+        self.assertEqual(0, self.free_tokens())
+
+    def test_generate_files_async(self):
+        times_file = os.path.join(self.test_dir, 'times')
+        jobs = self.make_jobs(times_file)
+        self.use_pipe(0)
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertEqual(['0', '1', '2', '3'],
+                             loop.run_until_complete(
+                                 generate_files_async(jobs)))
+        finally:
+            loop.close()
+        times = self.read_times(times_file)
+        self.assertTrue(
+            all(end <= start
+                for (_, end), (start, _) in zip(times, times[1:])))
+        self.assertEqual(0, self.free_tokens())
+
+    def test_generate_files_async_failure(self):
+        times_file = os.path.join(self.test_dir, 'times')
+        jobs = self.make_jobs(times_file)
+        jobs[0] = (os.path.join(self.test_dir, 'missing.in'), ) + jobs[0][1:]
+        self.use_pipe(1)
+        loop = asyncio.new_event_loop()
+        # Generation already running can't be stopped, so the executor is
+        # waited for before the test directory is removed
+        try:
+            with ThreadPoolExecutor(4) as executor:
+                with self.assertRaises(FileNotFoundError):
+                    loop.run_until_complete(
+                        generate_files_async(jobs, executor=executor))
+        finally:
+            loop.close()
+        # The other jobs were cancelled, and gave back their tokens, before
+        # the failure was raised
+        self.assertEqual(1, self.free_tokens())
+
+
+def run_jobserver_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestJobserver)
+    unittest.TextTestRunner().run(suite)
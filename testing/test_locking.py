@@ -0,0 +1,164 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+from string import Template
+from ..interface import generate_file
+from ..internal.locking import (DEFAULT_FILE_MODE, file_lock,
+                                read_lock_record, write_lock_record,
+                                write_file_atomic)
+from ..internal import modes
+from ..internal.modes import register_itermode
+from ..internal.sources import clear_source_cache
+from ..iter_classes import Iterable, IterGroup
+
+
+def counted_enumerate(pool, r):
+    """Enumerates pool, appending a line to the file named by the first value
+    so the number of generations can be counted across processes"""
+    with open(pool[0], 'a') as count_file:
+        count_file.write('generated\n')
+    return ((val, ) for val in pool[1:])
+
+
+def register_test_itermode(test_case, itermode, enumerate):
+    """Registers enumerate for itermode as register_itermode, until test_case
+    is torn down, when the Itermodes registered before are restored"""
+    registered = dict(modes._MODES)
+
+    def restore():
+        modes._MODES.clear()
+        modes._MODES.update(registered)
+        clear_source_cache()
+
+    test_case.addCleanup(restore)
+    register_itermode(itermode, enumerate)
+
+
+def generate_in_process(args):
+    input_file_name, output_file_name, iter_groups, cache_dir = args
+    return generate_file(input_file_name, output_file_name, iter_groups,
+                         lock=True, cache_dir=cache_dir)
+
+
+class TestLocking(unittest.TestCase):
+    """Tests the functions in the locking file and the locked and cached modes
+    of generate_file."""
+
+    def setUp(self):
+        register_test_itermode(self, 'counted', counted_enumerate)
+        self.test_dir = tempfile.mkdtemp()
+        self.count_file = os.path.join(self.test_dir, 'count')
+        self.iter_groups = [
+            IterGroup('@ip1@', Template('a ${key0}\n'), [
+                Iterable('key0', [self.count_file, 'x', 'y'], 'counted', 1)
+            ])
+        ]
+        self.input_file = os.path.join(self.test_dir, 'testFile.txt.in')
+        with open(self.input_file, 'w') as output_file:
+            output_file.write('Line one\n  @ip1@\nEnding line')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def generation_count(self):
+        if not os.path.exists(self.count_file):
+            return 0
+        with open(self.count_file, 'r') as count_file:
+            return len(count_file.readlines())
+
+    def test_lock_record(self):
+        path = os.path.join(self.test_dir, 'locked')
+        with file_lock(path) as lock_file:
+            self.assertEqual('', read_lock_record(lock_file))
+            write_lock_record(lock_file, 'a longer record')
+            write_lock_record(lock_file, 'record')
+        with file_lock(path) as lock_file:
+            self.assertEqual('record', read_lock_record(lock_file))
+
+    def test_write_file_atomic(self):
+        file_name = os.path.join(self.test_dir, 'atomic.cpp')
+        write_file_atomic(file_name, 'a')
+        # A new file is given DEFAULT_FILE_MODE, and an existing one keeps its
+        # permissions
+        self.assertEqual(DEFAULT_FILE_MODE, os.stat(file_name).st_mode & 0o777)
+        os.chmod(file_name, 0o640)
+        prepared = []
+        write_file_atomic(file_name, 'b', prepared.append)
+        with open(file_name, 'r') as input_file:
+            self.assertEqual('b', input_file.read())
+        self.assertEqual(0o640, os.stat(file_name).st_mode & 0o777)
+        # The prepared file keeps the extension of the output
+        self.assertTrue(prepared[0].endswith('.cpp'))
+        self.assertEqual(['atomic.cpp'], [
+            name for name in os.listdir(self.test_dir)
+            if name.startswith('atomic') or name.startswith('.atomic')
+        ])
+
+    def test_generate_file_locked(self):
+        output_file = os.path.join(self.test_dir, 'testFile.txt')
+        expected = 'Line one\n  a x\n  a y\n\nEnding line'
+        self.assertEqual(
+            expected,
+            generate_file(self.input_file, output_file, self.iter_groups,
+                          lock=True))
+        self.assertEqual(1, self.generation_count())
+        # The unchanged output of the same generation is reused
+        generate_file(self.input_file, output_file, self.iter_groups,
+                      lock=True)
+        self.assertEqual(1, self.generation_count())
+        # A changed output is generated again
+        with open(output_file, 'w') as changed_file:
+            changed_file.write('changed')
+        self.assertEqual(
+            expected,
+            generate_file(self.input_file, output_file, self.iter_groups,
+                          lock=True))
+        self.assertEqual(2, self.generation_count())
+        with open(output_file, 'r') as input_file:
+            self.assertEqual(expected, input_file.read())
+
+    @unittest.skipIf('fork' not in multiprocessing.get_all_start_methods(),
+                     'needs fork to share the registered Itermode')
+    def test_generate_file_cached_concurrently(self):
+        cache_dir = os.path.join(self.test_dir, 'cache')
+        jobs = [(self.input_file,
+                 os.path.join(self.test_dir, 'out' + str(index % 3)),
+                 self.iter_groups, cache_dir) for index in range(12)]
+        pool = multiprocessing.get_context('fork').Pool(6)
+        try:
+            results = pool.map(generate_in_process, jobs)
+        finally:
+            pool.close()
+            pool.join()
+        expected = 'Line one\n  a x\n  a y\n\nEnding line'
+        self.assertEqual([expected] * len(jobs), results)
+        # Only the first process generated, the rest reused its result
+        self.assertEqual(1, self.generation_count())
+        for index in range(3):
+            with open(os.path.join(self.test_dir, 'out' + str(index)),
+                      'r') as input_file:
+                self.assertEqual(expected, input_file.read())
+
+
+def run_locking_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestLocking)
+    unittest.TextTestRunner().run(suite)
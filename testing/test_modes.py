@@ -0,0 +1,114 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import unittest
+from string import Template
+from .test_locking import register_test_itermode
+from ..internal.iters import dispatch_iterations
+from ..internal.modes import iterate_outputs, count_outputs, slice_outputs
+from ..iter_classes import Iterable, Itermode, IterGroup
+
+
+class TestModes(unittest.TestCase):
+    """Tests the Itermode registry and the functions registered for each
+    built in Itermode."""
+
+    def test_count_and_slice(self):
+        # Every counted and unranked output must match plain enumeration
+        for itermode in [
+                Itermode.product, Itermode.permutations,
+                Itermode.combinations, Itermode.combinationsWR,
+                Itermode.powerset, Itermode.grayProduct
+        ]:
+            for vals in [[], ['a'], ['a', 'b', 'c'], ['a', 'b', 'c', 'd']]:
+                for modifier in range(0, 5):
+                    it = Iterable('id', vals, itermode, modifier)
+                    outputs = list(iterate_outputs(it))
+                    self.assertEqual(len(outputs), count_outputs(it))
+                    self.assertEqual(outputs,
+                                     list(slice_outputs(it, 0, len(outputs))))
+                    self.assertEqual(outputs[1:3],
+                                     list(slice_outputs(it, 1, 3)))
+
+    def test_powerset(self):
+        t = Template('${id} | ')
+        it = Iterable('id', ['a', 'b', 'c'], Itermode.powerset, 1, True)
+        self.assertEqual('a | b | c | a, b | a, c | b, c | a, b, c | ',
+                         dispatch_iterations(t, [it]).template)
+
+    def test_gray_product(self):
+        t = Template('${id} | ')
+        it = Iterable('id', ['a', 'b', 'c'], Itermode.grayProduct, 2)
+        self.assertEqual('aa | ab | ac | bc | bb | ba | ca | cb | cc | ',
+                         dispatch_iterations(t, [it]).template)
+        # Each output differs from the previous one in a single element, and
+        # every output of product is produced once
+        it = Iterable('id', ['a', 'b', 'c', 'd'], Itermode.grayProduct, 4)
+        outputs = list(iterate_outputs(it))
+        for previous, output in zip(outputs, outputs[1:]):
+            self.assertEqual(
+                1, sum(a != b for a, b in zip(previous, output)))
+        product_it = Iterable('id', ['a', 'b', 'c', 'd'], Itermode.product,
+                              4)
+        self.assertEqual(sorted(outputs),
+                         list(iterate_outputs(product_it)))
+
+    def test_zip(self):
+        t = Template('${id_0} ${id_1} | ')
+        it = Iterable(
+            'id', [['int', 'float', 'double'], ['i', 'f']],
+            Itermode.zip,
+            bind_elements=True)
+        self.assertEqual('int i | float f | ',
+                         dispatch_iterations(t, [it]).template)
+        self.assertEqual(2, count_outputs(it))
+        self.assertEqual([('float', 'f')], list(slice_outputs(it, 1, 5)))
+
+    def test_range(self):
+        t = Template('${id} | ')
+        it = Iterable('id', [1, 7, 3], Itermode.range, 2, True)
+        self.assertEqual('1, 1 | 1, 4 | 4, 1 | 4, 4 | ',
+                         dispatch_iterations(t, [it]).template)
+        self.assertEqual(4, count_outputs(it))
+
+    def test_chain(self):
+        t = Template('${id} | ')
+        it = Iterable('id', [['a', 'b'], ['c']], Itermode.chain)
+        self.assertEqual('a | b | c | ', dispatch_iterations(t, [it]).template)
+
+    def test_register_itermode(self):
+        # The mode is registered until the test is torn down
+        register_test_itermode(self, 'reversed',
+                               lambda pool, r: ((val, ) * r
+                                                for val in reversed(pool)))
+        it = Iterable('id', ['a', 'b', 'c'], 'reversed', 2)
+        self.assertEqual('cc | bb | aa | ',
+                         dispatch_iterations(Template('${id} | '),
+                                             [it]).template)
+        # Modes without count and unrank functions are enumerated instead
+        self.assertEqual(3, count_outputs(it))
+        self.assertEqual([('b', 'b')], list(slice_outputs(it, 1, 2)))
+        IterGroup('@ip@', Template('${id}'), [
+            it, Iterable('id', ['a', 'b', 'c'], Itermode.combinations, 1)
+        ], True)
+        with self.assertRaises(TypeError):
+            Iterable('id', ['a'], 'unregistered', 1)
+
+
+def run_mode_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestModes)
+    unittest.TextTestRunner().run(suite)
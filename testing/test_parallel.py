@@ -0,0 +1,141 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from string import Template
+from ..interface import generate_file, generate_file_parallel
+from ..internal.parallel import plan_chunks, render_chunk
+from ..iter_classes import Iterable, Itermode, IterGroup, RemovalIterGroup
+
+SOURCE = """#include <cstdint>
+
+namespace kernels {
+    @instantiations@
+}  // namespace kernels
+
+/* @sizes@ */
+"""
+
+
+class TestParallel(unittest.TestCase):
+    """Tests rendering generated strings in parallel into a mapped output."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.input_file_name = os.path.join(self.test_dir, 'kernels.cpp.in')
+        self.output_file_name = os.path.join(self.test_dir, 'kernels.cpp')
+        self.expected_file_name = os.path.join(self.test_dir, 'expected.cpp')
+        self.write_source(SOURCE)
+        self.instantiations = IterGroup(
+            '@instantiations@',
+            Template('template void gemm<${T}, ${N}>(\n    const ${T}*);\n'), [
+                Iterable('T', ['float', 'double', 'std::int8_t'],
+                         Itermode.product),
+                Iterable('N', [str(size) for size in range(1, 40)],
+                         Itermode.product)
+            ])
+        self.sizes = RemovalIterGroup(
+            '@sizes@', Template('${S} '),
+            [Iterable('S', ['1', '2', '4', '8'], Itermode.combinations, 2)],
+            [Iterable('S', ['1', '2'], Itermode.combinations, 2)],
+            combine_iters=True)
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write_source(self, source):
+        with open(self.input_file_name, 'w') as input_file:
+            input_file.write(source)
+
+    def assert_matches_generate_file(self, iter_groups, **kwargs):
+        size = generate_file_parallel(self.input_file_name,
+                                      self.output_file_name, iter_groups,
+                                      **kwargs)
+        generate_file(self.input_file_name, self.expected_file_name,
+                      iter_groups)
+        with open(self.output_file_name, 'rb') as output_file:
+            output = output_file.read()
+        with open(self.expected_file_name, 'rb') as expected_file:
+            self.assertEqual(expected_file.read(), output)
+        self.assertEqual(len(output), size)
+
+    def test_matches_generate_file(self):
+        for chunk_size in [1, 100, 1 << 20]:
+            self.assert_matches_generate_file(
+                [self.instantiations, self.sizes],
+                workers=1,
+                chunk_size=chunk_size)
+
+    def test_worker_processes(self):
+        self.assert_matches_generate_file([self.instantiations, self.sizes],
+                                          workers=2,
+                                          chunk_size=64)
+
+    def test_chunks(self):
+        chunks = plan_chunks(0, self.instantiations, 4, 1000)
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual(
+            [(chunk.start, chunk.stop) for chunk in chunks],
+            list(zip([0] + [chunk.stop for chunk in chunks[:-1]],
+                     [chunk.stop for chunk in chunks])))
+        self.assertEqual(39, chunks[-1].stop)
+        # The size of each chunk is known without rendering it
+        for chunk in chunks:
+            self.assertEqual(
+                chunk.size,
+                len(render_chunk(self.instantiations, chunk, 4).encode(
+                    'utf-8')))
+        self.assertEqual([False] + [True] * (len(chunks) - 1),
+                         [chunk.indent_first for chunk in chunks])
+        # Combined groups are sized by generating them
+        self.assertIsNone(plan_chunks(1, self.sizes, 0, 1000))
+
+    def test_dependent_insertions(self):
+        # A generated string creating a later insertion point is generated as
+        # by generate_file
+        first = IterGroup('@first@', Template('@sec${end}'),
+                          [Iterable('end', ['ond@'], Itermode.product)])
+        second = IterGroup('@second@', Template('${v}'),
+                           [Iterable('v', ['x'], Itermode.product)])
+        self.write_source('  @first@ and @second@\n')
+        self.assert_matches_generate_file([first, second], workers=1)
+        with open(self.output_file_name, 'r') as output_file:
+            self.assertEqual('  x and x\n', output_file.read())
+
+    def test_errors(self):
+        # Errors raised generating a group are raised before the output is
+        # written
+        self.write_source('@empty@\n')
+        empty = IterGroup('@empty@', Template('${v}'), [
+            Iterable('v', [], Itermode.product)
+        ])
+        with self.assertRaises(IndexError):
+            generate_file_parallel(self.input_file_name,
+                                   self.output_file_name, [empty], workers=1)
+        self.assertFalse(os.path.exists(self.output_file_name))
+        self.assertEqual([], [
+            file_name for file_name in os.listdir(self.test_dir)
+            if file_name.startswith('.')
+        ])
+
+
+def run_parallel_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestParallel)
+    unittest.TextTestRunner().run(suite)
@@ -0,0 +1,161 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from string import Template
+from ..interface import generate_file, generate_files_distributed
+from ..internal.iters import expand_iter_group
+from ..internal.queue import (claim_task, create_run, read_run, remove_run,
+                              split_iter_group, take_lease, wait_for_run,
+                              work, work_on, _lease_path)
+from ..iter_classes import Iterable, Itermode, IterGroup, RemovalIterGroup
+
+
+class TestQueue(unittest.TestCase):
+    """Tests generating files between the workers of a work queue."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.queue_dir = os.path.join(self.test_dir, 'queue')
+        self.input_file_name = os.path.join(self.test_dir, 'kernels.cpp.in')
+        with open(self.input_file_name, 'w') as input_file:
+            input_file.write('namespace k {\n  @gemm@\n}\n@combined@\n')
+        self.iter_groups = [
+            IterGroup('@gemm@',
+                      Template('template void gemm<${T}, ${N}>();\n'), [
+                          Iterable('T', ['float', 'double', 'half'],
+                                   Itermode.product),
+                          Iterable('N', [str(size) for size in range(500)],
+                                   Itermode.product)
+                      ]),
+            RemovalIterGroup('@combined@', Template('${A}${B};'), [
+                Iterable('A', ['1', '2', '3'], Itermode.product),
+                Iterable('B', ['x', 'y', 'z'], Itermode.product)
+            ], [Iterable('A', ['2'], Itermode.product)],
+                             combine_iters=True)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def output_file_name(self, name):
+        return os.path.join(self.test_dir, name)
+
+    def expected(self):
+        return generate_file(self.input_file_name,
+                             self.output_file_name('expected.cpp'),
+                             self.iter_groups)
+
+    def start_workers(self, count):
+        """Starts workers in separate processes, as they would be started on
+        other hosts"""
+        package_dir = os.path.dirname(
+            os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(
+            [os.path.dirname(package_dir)] +
+            [path for path in [env.get('PYTHONPATH')] if path])
+        return [
+            subprocess.Popen([
+                sys.executable, '-m',
+                os.path.basename(package_dir), 'worker', self.queue_dir,
+                '--idle-timeout', '2', '--poll-interval', '0.05'
+            ],
+                             env=env) for _ in range(count)
+        ]
+
+    def test_split(self):
+        tasks = split_iter_group(self.iter_groups[0], 200)
+        self.assertEqual([(0, 66), (66, 132), (132, 198), (198, 264),
+                          (264, 330), (330, 396), (396, 462), (462, 500)],
+                         [(start, stop) for _, start, stop in tasks])
+        # Combined groups are a single task
+        self.assertEqual([(self.iter_groups[1], None, None)],
+                         split_iter_group(self.iter_groups[1], 200))
+
+    def test_workers(self):
+        workers = self.start_workers(3)
+        try:
+            sources = generate_files_distributed(
+                [(self.input_file_name, self.output_file_name('a.cpp'),
+                  self.iter_groups),
+                 (self.input_file_name, self.output_file_name('b.cpp'),
+                  self.iter_groups[1:])],
+                self.queue_dir,
+                task_rows=100,
+                take_part=False)
+        finally:
+            for worker in workers:
+                worker.wait()
+        self.assertEqual(self.expected(), sources[0])
+        with open(self.output_file_name('a.cpp'), 'r') as output_file:
+            self.assertEqual(sources[0], output_file.read())
+        self.assertIn('@gemm@', sources[1])
+        self.assertNotIn('@combined@', sources[1])
+        # Finished runs are removed
+        self.assertEqual([], os.listdir(os.path.join(self.queue_dir, 'runs')))
+
+    def test_take_part(self):
+        sources = generate_files_distributed(
+            [(self.input_file_name, self.output_file_name('a.cpp'),
+              self.iter_groups)],
+            self.queue_dir,
+            task_rows=100)
+        self.assertEqual([self.expected()], sources)
+
+    def test_expired_lease(self):
+        run_dir = create_run(self.queue_dir,
+                             split_iter_group(self.iter_groups[0], 500), 30.0)
+        # A worker which failed holding a lease
+        self.assertTrue(take_lease(run_dir, '00000000', 'failed', 30.0))
+        claimed = claim_task(self.queue_dir, 'live')
+        self.assertEqual('00000001', claimed[1])
+        work_on(*claimed)
+        self.assertEqual(2, work(self.queue_dir, 'live', idle_timeout=0))
+        self.assertIsNone(claim_task(self.queue_dir, 'live'))
+        # Once the lease expires another worker takes the task over
+        past = time.time() - 60.0
+        os.utime(_lease_path(run_dir, '00000000'), (past, past))
+        self.assertEqual(1, work(self.queue_dir, 'live', idle_timeout=0))
+        results = wait_for_run(run_dir, take_part=False)
+        remove_run(run_dir)
+        self.assertIsNone(read_run(run_dir))
+        self.assertEqual(expand_iter_group(self.iter_groups[0]),
+                         ''.join(results))
+
+    def test_task_error(self):
+        tasks = split_iter_group(self.iter_groups[0], 500)
+        # A task which raises an error when it is run
+        tasks.insert(1, (None, None, None))
+        run_dir = create_run(self.queue_dir, tasks)
+        with self.assertRaises(AttributeError):
+            wait_for_run(run_dir)
+        # The other tasks still finish
+        self.assertIsNone(claim_task(self.queue_dir, 'live'))
+        remove_run(run_dir)
+        self.assertEqual([], os.listdir(os.path.join(self.queue_dir, 'runs')))
+
+
+def run_queue_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestQueue)
+    unittest.TextTestRunner().run(suite)
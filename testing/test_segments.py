@@ -0,0 +1,210 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from string import Template
+from .groups import make_group
+from ..interface import generate_file, generate_source
+from ..internal.iters import get_kept_rows, get_render
+from ..internal.parallel import compile_group
+from ..internal.shards import generate_shard_sources
+from ..iter_classes import (ConditionalSegment, DerivedKey, EmitMode,
+                            Iterable, Itermode, IterGroup, RemovalIterGroup,
+                            ValueStream)
+
+# Arguments of each call of a guard, to count the calls
+calls = []
+
+
+def is_float(type_name):
+    calls.append(type_name)
+    return type_name in ['float', 'double']
+
+
+def is_large(size):
+    return size.isdigit() and int(size) > 1
+
+
+def suffix(type_name):
+    return type_name[0]
+
+
+TYPES = ['float', 'int', 'double']
+SIZES = ['1', '2']
+TEMPLATE_TEXT = 'f<${T}, ${N}>(${ARGS})${BODY}\n'
+FLOAT_ARGS = ConditionalSegment('ARGS', is_float, 'T', '${T} tolerance',
+                                'int exact')
+LARGE_BODY = ConditionalSegment('BODY', is_large, ['N'],
+                                ' { unroll<${N}>(); }', ';')
+
+
+class TestSegments(unittest.TestCase):
+    """Tests template segments chosen for each copy of a template."""
+
+    def setUp(self):
+        del calls[:]
+        self.test_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_segments(self):
+        group = make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                           segments=[FLOAT_ARGS, LARGE_BODY])
+        self.assertEqual(
+            'f<float, 1>(float tolerance);\n'
+            'f<int, 1>(int exact);\n'
+            'f<double, 1>(double tolerance);\n'
+            'f<float, 2>(float tolerance) { unroll<2>(); }\n'
+            'f<int, 2>(int exact) { unroll<2>(); }\n'
+            'f<double, 2>(double tolerance) { unroll<2>(); }\n',
+            generate_source('@ip@', [group]))
+        # Each guard is called once for each different value
+        self.assertEqual(['float', 'int', 'double'], calls)
+
+    def test_compiled_matches_rows(self):
+        derived = [DerivedKey('S', suffix, 'T')]
+        segments = [
+            ConditionalSegment('ARGS', is_float, 'T', 'x${S}_${N}, {}', 'no'),
+            ConditionalSegment('BODY', is_large, 'N', '${S}${BODY}', '')
+        ]
+        group = make_group(TYPES, ['1', '2', '3'], TEMPLATE_TEXT,
+                           derived_keys=derived, segments=segments)
+        render = get_render(group)
+        rows = ''.join(render(outputs) for outputs in get_kept_rows(group))
+        compiled = compile_group(group)
+        self.assertIsNotNone(compiled)
+        self.assertEqual(rows, compiled.render(0, 3))
+        self.assertEqual(rows, generate_source('@ip@', [group]))
+        # Values holding the template delimiter are substituted a copy at a
+        # time, so later substitutions apply to them
+        group = make_group(TYPES, ['1', '2', '$S'], TEMPLATE_TEXT,
+                           derived_keys=derived, segments=segments)
+        self.assertIsNone(compile_group(group))
+        self.assertIn('f<float, f>(xf_f, {})\n',
+                      generate_source('@ip@', [group]))
+
+    def test_combined_and_removal(self):
+        iterables = [
+            Iterable('T', ['float', 'int', 'double'], Itermode.product),
+            Iterable('N', ['1', '2', '3'], Itermode.product)
+        ]
+        removal = [Iterable('N', ['2'], Itermode.product)]
+        template = Template('${T}${ARGS};')
+        segments = [FLOAT_ARGS]
+        self.assertEqual(
+            'floatfloat tolerance;intint exact;doubledouble tolerance;',
+            generate_source('@ip@', [
+                IterGroup('@ip@', template, iterables, combine_iters=True,
+                          segments=segments)
+            ]))
+        self.assertEqual(
+            'floatfloat tolerance;doubledouble tolerance;',
+            generate_source('@ip@', [
+                RemovalIterGroup('@ip@', template, iterables, removal,
+                                 combine_iters=True, segments=segments)
+            ]))
+
+    def test_engines_agree(self):
+        group = make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                           segments=[FLOAT_ARGS, LARGE_BODY])
+        expected = generate_source('@ip@', [group])
+        self.assertEqual(
+            sorted(expected.splitlines()),
+            sorted(''.join(generate_shard_sources('@ip@', [group],
+                                                  3)).splitlines()))
+        input_file_name = os.path.join(self.test_dir, 'kernels.cpp.in')
+        output_file_name = os.path.join(self.test_dir, 'kernels.cpp')
+        with open(input_file_name, 'w') as input_file:
+            input_file.write('@ip@')
+        state_dir = os.path.join(self.test_dir, 'state')
+        for _ in range(2):
+            self.assertEqual(
+                expected,
+                generate_file(input_file_name, output_file_name, [group],
+                              state_dir=state_dir))
+
+    def test_errors(self):
+        with self.assertRaises(ValueError):
+            generate_source('@ip@', [
+                make_group(TYPES, SIZES, TEMPLATE_TEXT, segments=[
+                    ConditionalSegment('ARGS', is_float, 'X', '')
+                ])
+            ])
+        with self.assertRaises(ValueError):
+            make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                       segments=[FLOAT_ARGS, FLOAT_ARGS])
+        with self.assertRaises(TypeError):
+            make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                       segments=[DerivedKey('ARGS', suffix, 'T')])
+        with self.assertRaises(TypeError):
+            ConditionalSegment('ARGS', is_float, 'T', None)
+        with self.assertRaises(ValueError):
+            IterGroup('@ip@', Template('${T}'),
+                      [Iterable('T', ['int'], Itermode.product)],
+                      emit_mode=EmitMode.xmacro,
+                      table_name='TABLE',
+                      segments=[FLOAT_ARGS])
+
+    def test_spec(self):
+        group = make_group(TYPES, SIZES, TEMPLATE_TEXT, segments=[FLOAT_ARGS])
+        self.assertEqual(group, pickle.loads(pickle.dumps(group)))
+        self.assertNotEqual(
+            make_group(TYPES, SIZES, TEMPLATE_TEXT, segments=[LARGE_BODY]),
+            group)
+        plain = make_group(TYPES, SIZES, TEMPLATE_TEXT, segments=[])
+        self.assertNotEqual(plain.spec_hash(), group.spec_hash())
+        self.assertNotIn('ConditionalSegment', repr(plain))
+
+    def test_guards_with_same_name(self):
+        # Segments are told apart by their guard, not its name
+        segments = [
+            ConditionalSegment('ARGS', lambda type_name: True, 'T', 'a'),
+            ConditionalSegment('ARGS', lambda type_name: False, 'T', 'a')
+        ]
+        self.assertNotEqual(segments[0], segments[1])
+        for segment, args in zip(segments, ['a', '']):
+            source = Iterable(
+                'V', make_group(TYPES, ['1'], TEMPLATE_TEXT,
+                                segments=[segment]), Itermode.product)
+            self.assertEqual(
+                ('[f<float, 1>(' + args + ')${BODY}\n]' +
+                 '[f<int, 1>(' + args + ')${BODY}\n]' +
+                 '[f<double, 1>(' + args + ')${BODY}\n]'),
+                generate_source('@ip@', [
+                    IterGroup('@ip@', Template('[${V}]'), [source])
+                ]))
+        with self.assertRaises(ValueError):
+            make_group(TYPES, SIZES, TEMPLATE_TEXT,
+                       segments=segments[:1]).spec_hash()
+        # The factories of ValueStreams are told apart the same way
+        streams = [
+            ValueStream('types', lambda: ['int']),
+            ValueStream('types', lambda: ['float'])
+        ]
+        self.assertNotEqual(streams[0], streams[1])
+        with self.assertRaises(ValueError):
+            streams[0].spec_hash()
+
+
+def run_segment_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSegments)
+    unittest.TextTestRunner().run(suite)
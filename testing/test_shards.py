@@ -0,0 +1,150 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import shutil
+import tempfile
+import unittest
+from string import Template
+from .groups import make_group
+from ..interface import generate_sharded_files, generate_source
+from ..internal.shards import HashRing, shard_iter_group
+from ..iter_classes import (EmitMode, Iterable, Itermode, IterGroup,
+                            RemovalIterGroup, ShardMode)
+
+TYPES = ['float', 'double']
+
+
+def get_assignments(shards):
+    return {copy: shard for shard, copies in enumerate(shards)
+            for copy in copies}
+
+
+class TestShards(unittest.TestCase):
+    """Tests splitting the copies of a template between shards."""
+
+    def setUp(self):
+        self.test_dir = tempfile.mkdtemp()
+        self.input_file_name = os.path.join(self.test_dir, 'kernels.cpp.in')
+        with open(self.input_file_name, 'w') as input_file:
+            input_file.write('#include "f.h"\n@ip@')
+        self.output_file_names = [
+            os.path.join(self.test_dir, 'kernels_' + str(shard) + '.cpp')
+            for shard in range(8)
+        ]
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def test_shards_hold_every_copy(self):
+        group = make_group(TYPES, [str(size) for size in range(32)])
+        generated = generate_source('@ip@', [group])
+        for shard_mode in [ShardMode.hash, ShardMode.position]:
+            shards = shard_iter_group(group, 8, shard_mode)
+            self.assertEqual(8, len(shards))
+            # Copies keep their generated order within each shard
+            for copies in shards:
+                self.assertEqual(sorted(copies, key=generated.index), copies)
+            self.assertEqual(sorted(generated.splitlines(True)),
+                             sorted(sum(shards, [])))
+        position_shards = shard_iter_group(group, 8, ShardMode.position)
+        self.assertEqual([8] * 8, [len(copies) for copies in position_shards])
+
+    def test_added_values(self):
+        sizes = [str(size) for size in range(32)]
+        before = shard_iter_group(make_group(TYPES, sizes), 8)
+        after = shard_iter_group(make_group(TYPES, sizes + ['64']), 8)
+        # Only the shards gaining the new copies change
+        changed = [shard for shard in range(8) if before[shard] != after[shard]]
+        self.assertEqual(
+            sorted(set(shard for copy, shard in get_assignments(after).items()
+                       if '64' in copy)), changed)
+        self.assertLessEqual(len(changed), 2)
+        # Adding a value at the start shifts the copies split by position
+        before = shard_iter_group(make_group(TYPES, sizes), 8,
+                                  ShardMode.position)
+        after = shard_iter_group(make_group(TYPES, ['64'] + sizes), 8,
+                                 ShardMode.position)
+        self.assertGreater(
+            sum(old != new for old, new in zip(before, after)), len(changed))
+
+    def test_added_shard(self):
+        group = make_group(TYPES, [str(size) for size in range(256)])
+        before = get_assignments(shard_iter_group(group, 8))
+        after = get_assignments(shard_iter_group(group, 9))
+        moved = [copy for copy in before if before[copy] != after[copy]]
+        # Only copies moving to the new shard change shard
+        self.assertTrue(all(after[copy] == 8 for copy in moved))
+        self.assertLess(len(moved), len(before) // 4)
+        ring = HashRing(4)
+        self.assertEqual(ring.get_shard('T=float'), ring.get_shard('T=float'))
+
+    def test_generate_sharded_files(self):
+        sizes = [str(size) for size in range(32)]
+        written = generate_sharded_files(self.input_file_name,
+                                         self.output_file_names,
+                                         [make_group(TYPES, sizes)])
+        self.assertEqual(self.output_file_names, written)
+        output = ''
+        for output_file_name in self.output_file_names:
+            with open(output_file_name, 'r') as output_file:
+                shard = output_file.read()
+            self.assertTrue(shard.startswith('#include "f.h"\n'))
+            output += shard[len('#include "f.h"\n'):]
+        self.assertEqual(64, len(output.splitlines()))
+        # Unchanged shards aren't written again
+        self.assertEqual([],
+                         generate_sharded_files(self.input_file_name,
+                                                self.output_file_names,
+                                                [make_group(TYPES, sizes)]))
+        written = generate_sharded_files(self.input_file_name,
+                                         self.output_file_names,
+                                         [make_group(TYPES, sizes + ['64'])])
+        self.assertTrue(0 < len(written) <= 2)
+
+    def test_empty_and_removed(self):
+        group = RemovalIterGroup(
+            '@ip@', Template('${N};'),
+            [Iterable('N', ['1', '2', '3'], Itermode.product)],
+            [Iterable('N', ['2'], Itermode.product)])
+        shards = shard_iter_group(group, 8)
+        self.assertEqual(['1;', '3;'], sorted(sum(shards, [])))
+        written = generate_sharded_files(self.input_file_name,
+                                         self.output_file_names, [group])
+        self.assertEqual(8, len(written))
+        with self.assertRaises(ValueError):
+            shard_iter_group(
+                IterGroup('@ip@', Template('${N}'),
+                          [Iterable('N', ['1'], Itermode.product)],
+                          emit_mode=EmitMode.xmacro,
+                          table_name='T'), 2)
+        with self.assertRaises(ValueError):
+            shard_iter_group(group, 0)
+        with self.assertRaises(ValueError):
+            shard_iter_group(
+                IterGroup('@ip@', Template('${N};'), [
+                    Iterable('N', ['$$', '2'], Itermode.product)
+                ], combine_iters=True), 2)
+        with self.assertRaises(ValueError):
+            shard_iter_group(
+                IterGroup('@ip@', Template('$$${N};'),
+                          [Iterable('N', ['1', '2'], Itermode.product)]), 2)
+
+
+def run_shard_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestShards)
+    unittest.TextTestRunner().run(suite)
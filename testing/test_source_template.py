@@ -0,0 +1,134 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from string import Template
+from ..interface import generate_source
+from ..internal.scaffold import index_scaffold
+from ..iter_classes import Iterable, Itermode, IterGroup
+from ..source_template import SourceTemplate
+
+SOURCE = ('namespace test {\n'
+          '  @types@\n'
+          '  struct s {\n'
+          '    @members@\n'
+          '  };\n'
+          '}\n')
+
+
+def make_groups(types):
+    return [
+        IterGroup('@types@', Template('using ${T}_t = ${T};\n'),
+                  [Iterable('T', types, Itermode.product)]),
+        IterGroup('@members@', Template('${T} ${T}_member;\n'),
+                  [Iterable('T', types, Itermode.product)])
+    ]
+
+
+class TestSourceTemplate(unittest.TestCase):
+    """Tests generating from SourceTemplates."""
+
+    def test_render(self):
+        source_template = SourceTemplate(SOURCE)
+        for types in [['int'], ['int', 'float'], ['char', 'long', 'short']]:
+            self.assertEqual(
+                source_template.render(make_groups(types)),
+                generate_source(SOURCE, make_groups(types)))
+        # Each list of insertion points is indexed once
+        self.assertEqual(
+            list(source_template._indexes), [('@types@', '@members@')])
+        index = source_template._indexes[('@types@', '@members@')]
+        self.assertEqual(index.segments, [
+            'namespace test {\n  ', '\n  struct s {\n    ', '\n  };\n}\n'
+        ])
+        self.assertEqual(index.space_counts, [2, 4])
+
+    def test_fallback(self):
+        # Groups which can't be inserted from an index are inserted one at a
+        # time
+        iter_groups = [
+            IterGroup('@types@', Template('${T} @members@\n'),
+                      [Iterable('T', ['int', 'float'], Itermode.product)])
+        ] + make_groups(['int'])[1:]
+        self.assertEqual(
+            SourceTemplate(SOURCE).render(iter_groups),
+            generate_source(SOURCE, iter_groups))
+        # Insertion points containing line breaks or close to each other can't
+        # be indexed
+        self.assertEqual(index_scaffold('a\nb', ['a\n']), None)
+        self.assertEqual(index_scaffold('@a@@b@', ['@a@', '@b@']), None)
+        self.assertEqual(index_scaffold('  @a@ @b@', ['@a@', '@b@']), None)
+        iter_groups = [
+            IterGroup('@a@', Template('x\n'), []),
+            IterGroup('@b@', Template('y\n'), [])
+        ]
+        self.assertEqual(
+            SourceTemplate('  @a@@b@\n').render(iter_groups),
+            generate_source('  @a@@b@\n', iter_groups))
+
+    def test_empty_generation(self):
+        self.assertRaises(IndexError,
+                          SourceTemplate(SOURCE).render, make_groups([]))
+
+    def test_pickle(self):
+        source_template = SourceTemplate(SOURCE, [['@types@', '@members@']])
+        unpickled = pickle.loads(pickle.dumps(source_template))
+        self.assertEqual(unpickled.source, SOURCE)
+        self.assertEqual(
+            list(unpickled._indexes), [('@types@', '@members@')])
+        self.assertEqual(
+            unpickled.render(make_groups(['int'])),
+            source_template.render(make_groups(['int'])))
+
+    def test_threads(self):
+        source_template = SourceTemplate(SOURCE)
+        type_lists = [['t' + str(index), 'int'] for index in range(32)]
+        with ThreadPoolExecutor(8) as executor:
+            results = list(
+                executor.map(
+                    lambda types: source_template.render(make_groups(types)),
+                    type_lists))
+        for types, result in zip(type_lists, results):
+            self.assertEqual(result, generate_source(SOURCE,
+                                                     make_groups(types)))
+
+    def test_render_to_file(self):
+        test_dir = tempfile.mkdtemp()
+        try:
+            input_file_name = os.path.join(test_dir, 'test.cpp.in')
+            output_file_name = os.path.join(test_dir, 'test.cpp')
+            with open(input_file_name, 'w') as input_file:
+                input_file.write(SOURCE)
+            source_template = SourceTemplate.from_file(input_file_name)
+            source = source_template.render_to_file(output_file_name,
+                                                    make_groups(['int']))
+            with open(output_file_name, 'r') as output_file:
+                self.assertEqual(output_file.read(), source)
+            self.assertEqual(source, generate_source(SOURCE,
+                                                     make_groups(['int'])))
+        finally:
+            shutil.rmtree(test_dir)
+
+
+def run_source_template_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSourceTemplate)
+    unittest.TextTestRunner().run(suite)
@@ -0,0 +1,138 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from string import Template
+from .test_locking import counted_enumerate, register_test_itermode
+from ..interface import generate_source
+from ..internal.sources import clear_source_cache, get_source_values
+from ..iter_classes import (EmitMode, Iterable, Itermode, IterGroup,
+                            RemovalIterGroup)
+
+
+class TestSources(unittest.TestCase):
+    """Tests Iterables using other Iterables and groups as their values."""
+
+    def setUp(self):
+        register_test_itermode(self, 'counted', counted_enumerate)
+        clear_source_cache()
+        self.test_dir = tempfile.mkdtemp()
+        self.count_file = os.path.join(self.test_dir, 'count')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def generation_count(self):
+        if not os.path.exists(self.count_file):
+            return 0
+        with open(self.count_file, 'r') as count_file:
+            return len(count_file.readlines())
+
+    def test_iterable_source(self):
+        inner = Iterable('', ['a', 'b', 'c'], Itermode.combinations, 2, True)
+        self.assertEqual(('a, b', 'a, c', 'b, c'), get_source_values(inner))
+        outer = IterGroup('@ip@', Template('f(${args});\n'),
+                          [Iterable('args', inner, Itermode.product)])
+        self.assertEqual('f(a, b);\nf(a, c);\nf(b, c);\n',
+                         generate_source('@ip@', [outer]))
+
+    def test_nested_groups(self):
+        types = Iterable('T', ['float', 'half'], Itermode.product)
+        layouts = IterGroup('', Template('${L}<${T}>'), [
+            Iterable('L', ['row', 'col'], Itermode.product), types
+        ])
+        tiles = IterGroup('', Template('tile<${layout}, ${N}>'), [
+            Iterable('layout', layouts, Itermode.product),
+            Iterable('N', ['8', '16'], Itermode.product)
+        ])
+        kernels = IterGroup('@ip@', Template('template class ${tile};\n'),
+                            [Iterable('tile', tiles, Itermode.product)])
+        # The same output as listing each level's values by hand
+        flat_tiles = [
+            'tile<' + layout + '<' + data_type + '>, ' + size + '>'
+            for size in ['8', '16'] for data_type in ['float', 'half']
+            for layout in ['row', 'col']
+        ]
+        flat = IterGroup('@ip@', Template('template class ${tile};\n'),
+                         [Iterable('tile', flat_tiles, Itermode.product)])
+        self.assertEqual(
+            generate_source('@ip@', [flat]),
+            generate_source('@ip@', [kernels]))
+
+    def test_removal_and_zip_sources(self):
+        # Removed copies of a group aren't values
+        pairs = RemovalIterGroup('', Template('${a}${b}'), [
+            Iterable('a', ['1', '2'], Itermode.product),
+            Iterable('b', ['x', 'y'], Itermode.product)
+        ], [Iterable('', ['2'], Itermode.product)])
+        self.assertEqual(('1x', '1y'), get_source_values(pairs))
+        # A nested list of zip can be a source
+        zipped = Iterable('p', [pairs, ['first', 'second']], Itermode.zip,
+                          comma_list=True)
+        self.assertEqual(
+            '1x, first | 1y, second | ',
+            generate_source('@ip@', [
+                IterGroup('@ip@', Template('${p} | '), [zipped])
+            ]))
+
+    def test_shared_source(self):
+        inner = Iterable('', [self.count_file, 'x', 'y'], 'counted', 1)
+        outer = [
+            IterGroup('@a@', Template('${k} '), [
+                Iterable('k', Iterable('', [self.count_file, 'x', 'y'],
+                                       'counted', 1), Itermode.product)
+            ]),
+            IterGroup('@b@', Template('${k}${k} '),
+                      [Iterable('k', inner, Itermode.permutations, 1)])
+        ]
+        self.assertEqual(0, self.generation_count())
+        self.assertEqual('x y  | xx yy ', generate_source('@a@ | @b@', outer))
+        # Equal sources are only generated once
+        self.assertEqual(1, self.generation_count())
+        generate_source('@a@', outer[:1])
+        self.assertEqual(1, self.generation_count())
+
+    def test_source_spec(self):
+        def make_group(vals):
+            return IterGroup('@ip@', Template('${k}'), [
+                Iterable('k', IterGroup('', Template('<${v}>'), [
+                    Iterable('v', vals, Itermode.product)
+                ]), Itermode.product)
+            ])
+
+        self.assertEqual(make_group(['a']), make_group(['a']))
+        self.assertEqual(
+            make_group(['a']).spec_hash(),
+            make_group(['a']).spec_hash())
+        self.assertNotEqual(
+            make_group(['a']).spec_hash(),
+            make_group(['b']).spec_hash())
+        self.assertEqual(make_group(['a']),
+                         pickle.loads(pickle.dumps(make_group(['a']))))
+        with self.assertRaises(ValueError):
+            Iterable('k', IterGroup('', Template('${v}'), [],
+                                    emit_mode=EmitMode.xmacro,
+                                    table_name='T'))
+
+
+def run_source_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestSources)
+    unittest.TextTestRunner().run(suite)
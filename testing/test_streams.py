@@ -0,0 +1,158 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from string import Template
+from ..interface import generate_source
+from ..internal.sources import (clear_source_cache, get_source_loads,
+                                get_source_values, reset_source_loads,
+                                write_source_loads)
+from ..iter_classes import (Iterable, Itermode, IterGroup, ValueFile,
+                            ValueStream)
+
+
+def generate_types():
+    for width in ['8', '16', '32']:
+        yield 'int' + width + '_t'
+
+
+class TestStreams(unittest.TestCase):
+    """Tests Iterables reading their values from files and generators."""
+
+    def setUp(self):
+        clear_source_cache()
+        reset_source_loads()
+        self.test_dir = tempfile.mkdtemp()
+        self.file_name = os.path.join(self.test_dir, 'types.txt')
+        self.write_values('float\r\n\nhalf\ndouble')
+
+    def tearDown(self):
+        shutil.rmtree(self.test_dir)
+
+    def write_values(self, text):
+        with open(self.file_name, 'w', newline='') as values_file:
+            values_file.write(text)
+
+    def generate(self, vals, itermode=Itermode.product, iter_modifier=1):
+        group = IterGroup('@ip@', Template('${T};'),
+                          [Iterable('T', vals, itermode, iter_modifier, True)])
+        return generate_source('@ip@', [group])
+
+    def test_value_file(self):
+        for mapped in [False, True]:
+            clear_source_cache()
+            source = ValueFile(self.file_name, mapped)
+            self.assertEqual(('float', 'half', 'double'),
+                             get_source_values(source))
+            self.assertEqual('float;half;double;', self.generate(source))
+        # Lines end at '\n' alone in both modes, with any '\r' before it
+        # stripped
+        self.write_values('a\rb\r\nc\r\r\n\r\n')
+        for mapped in [False, True]:
+            clear_source_cache()
+            self.assertEqual(('a\rb', 'c'),
+                             get_source_values(ValueFile(self.file_name,
+                                                         mapped)))
+        self.write_values('')
+        self.assertEqual((), get_source_values(ValueFile(self.file_name,
+                                                         True)))
+
+    def test_value_stream(self):
+        source = ValueStream('types', generate_types)
+        self.assertEqual('int8_t;int16_t;int32_t;', self.generate(source))
+        # The factory is called again for each enumeration
+        self.assertEqual('int8_t;int16_t;int32_t;', self.generate(source))
+        self.assertEqual('int8_t, int16_t;int8_t, int32_t;int16_t, int32_t;',
+                         self.generate(source, Itermode.combinations, 2))
+        with self.assertRaises(TypeError):
+            ValueStream('types', ['a'])
+
+    def test_streamed_without_loading(self):
+        source = ValueFile(self.file_name)
+        self.generate(source)
+        self.generate(source, Itermode.zip, 0)
+        [load] = get_source_loads()
+        self.assertEqual(0, load.values)
+        self.assertEqual(2, load.streams)
+        # Modes needing the whole pool load it once and share it
+        self.generate(source, Itermode.permutations, 2)
+        self.generate(source, Itermode.product, 2)
+        [load] = get_source_loads()
+        self.assertEqual(3, load.values)
+        self.assertEqual(1, load.hits)
+        # Once loaded, streaming reads the loaded values
+        self.generate(source)
+        self.assertEqual(2, get_source_loads()[0].hits)
+
+    def test_nested_streams(self):
+        source = ValueStream('types', generate_types)
+        self.assertEqual(
+            'float, int8_t;half, int16_t;double, int32_t;',
+            self.generate([ValueFile(self.file_name), source], Itermode.zip,
+                          0))
+        self.assertEqual(
+            'float;half;double;int8_t;int16_t;int32_t;',
+            self.generate([ValueFile(self.file_name, True), source],
+                          Itermode.chain))
+
+    def test_file_changes(self):
+        source = ValueFile(self.file_name)
+        self.assertEqual(3, len(get_source_values(source)))
+        self.write_values('float\nhalf\ndouble\nbfloat16\n')
+        self.assertEqual(4, len(get_source_values(source)))
+        self.assertEqual('float;half;double;bfloat16;',
+                         self.generate(source))
+        # Sources reading the file at any level are loaded again too
+        nested = IterGroup('@ip@', Template('${T}*'),
+                           [Iterable('T', source, Itermode.product)])
+        self.assertEqual('float*;half*;double*;bfloat16*;',
+                         self.generate(nested))
+        self.write_values('int\n')
+        self.assertEqual('int*;', self.generate(nested))
+
+    def test_write_source_loads(self):
+        get_source_values(ValueFile(self.file_name))
+        get_source_values(ValueFile(self.file_name))
+        stream = io.StringIO()
+        seconds = write_source_loads(stream)
+        self.assertEqual(get_source_loads()[0].seconds, seconds)
+        self.assertIn('3 values loaded in', stream.getvalue())
+        self.assertIn('reused 1 times, streamed 0 times', stream.getvalue())
+
+    def test_stream_spec(self):
+        self.assertEqual(ValueFile(self.file_name), ValueFile(self.file_name))
+        self.assertNotEqual(
+            ValueFile(self.file_name).spec_hash(),
+            ValueFile(self.file_name, True).spec_hash())
+        self.assertEqual(
+            ValueStream('types', generate_types).spec_hash(),
+            ValueStream('types', generate_types).spec_hash())
+        iterable = Iterable('T', ValueStream('types', generate_types),
+                            Itermode.product)
+        self.assertEqual(iterable, pickle.loads(pickle.dumps(iterable)))
+        with self.assertRaises(TypeError):
+            ValueFile(None)
+
+
+def run_stream_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestStreams)
+    unittest.TextTestRunner().run(suite)
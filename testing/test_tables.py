@@ -0,0 +1,213 @@
+#   Copyright (C) Codeplay Software Limited.
+#
+#   Licensed under the Apache License, Version 2.0 (the "License");
+#   you may not use these files except in compliance with the License.
+#   You may obtain a copy of the License at
+#
+#       http://www.apache.org/licenses/LICENSE-2.0
+#
+#   For your convenience, a copy of the License has been included in this
+#   repository.
+#
+#   Unless required by applicable law or agreed to in writing, software
+#   distributed under the License is distributed on an "AS IS" BASIS,
+#   WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#   See the License for the specific language governing permissions and
+#   limitations under the License.
+
+import re
+import shutil
+import subprocess
+import unittest
+from string import Template
+from ..interface import generate_source
+from ..internal.iters import expand_iter_group, iterate_bindings
+from ..internal.tables import check_macro_argument, get_template_keys
+from ..iter_classes import (EmitMode, Iterable, Itermode, IterGroup,
+                            RemovalIterGroup)
+
+# A string literal followed by any adjacent string literals
+STRING_LITERALS = re.compile(r'"(?:\\.|[^"\\])*"(?:\s*"(?:\\.|[^"\\])*")*')
+
+
+def join_literals(text):
+    """Returns text with adjacent string literals concatenated into one, as by
+    the compiler"""
+    return STRING_LITERALS.sub(
+        lambda match: '"' + ''.join(
+            re.findall(r'"((?:\\.|[^"\\])*)"', match.group())) + '"', text)
+
+
+TEMPLATE = Template('template struct Add<${T}, ${N}> {\n'
+                    '  static ${T} f(${T} a) { return a + ${N}; }\n'
+                    '};\n')
+
+ITERABLES = [
+    Iterable('T', ['int', 'float'], Itermode.product),
+    Iterable('N', ['1', '2'], Itermode.product)
+]
+
+
+class TestTables(unittest.TestCase):
+    """Tests emitting groups as X-macro tables."""
+
+    def test_emit_xmacro(self):
+        iter_group = IterGroup(
+            '@ip@',
+            TEMPLATE,
+            ITERABLES,
+            emit_mode=EmitMode.xmacro,
+            table_name='ADD')
+        self.assertEqual(
+            expand_iter_group(iter_group), '#define ADD(X) \\\n'
+            '    X(int, 1) \\\n'
+            '    X(float, 1) \\\n'
+            '    X(int, 2) \\\n'
+            '    X(float, 2)\n'
+            '#define ADD_ROW(py_gen_T, py_gen_N) \\\n'
+            '    template struct Add<py_gen_T, py_gen_N> { \\\n'
+            '      static py_gen_T f(py_gen_T a) { return a + py_gen_N; } \\\n'
+            '    };\n'
+            'ADD(ADD_ROW)\n'
+            '#undef ADD_ROW\n')
+
+    def test_iterate_bindings(self):
+        # Substituting each binding in turn must give the expanded output
+        iter_groups = [
+            IterGroup('@ip@', TEMPLATE, ITERABLES),
+            IterGroup('@ip@', TEMPLATE, ITERABLES, True),
+            RemovalIterGroup('@ip@', TEMPLATE, ITERABLES,
+                             [Iterable('', ['float'], Itermode.product)]),
+            IterGroup('@ip@', Template('${T}${T_1};'), [
+                Iterable('T', ['a', 'b', 'c'], Itermode.combinations, 2,
+                         True, True)
+            ])
+        ]
+        for iter_group in iter_groups:
+            self.assertEqual(
+                ''.join(
+                    iter_group.template.safe_substitute(binding)
+                    for binding in iterate_bindings(iter_group)),
+                expand_iter_group(iter_group))
+
+    def test_unused_and_unbound_keys(self):
+        # Only keys used by the template are written to the table, and unbound
+        # keys are left in the row macro as safe_substitute would
+        iter_group = IterGroup(
+            '@ip@',
+            Template('f($N, ${other}, $$);'),
+            ITERABLES,
+            emit_mode=EmitMode.xmacro,
+            table_name='F')
+        self.assertEqual(
+            get_template_keys(iter_group.template), ['N', 'other'])
+        self.assertEqual(
+            expand_iter_group(iter_group), '#define F(X) \\\n'
+            '    X(1) \\\n'
+            '    X(1) \\\n'
+            '    X(2) \\\n'
+            '    X(2)\n'
+            '#define F_ROW(py_gen_N) \\\n'
+            '    f(py_gen_N, ${other}, $);\n'
+            'F(F_ROW)\n'
+            '#undef F_ROW\n')
+
+    def test_empty_table(self):
+        iter_group = IterGroup(
+            '@ip@',
+            Template('${T};\n'), [Iterable('T', [], Itermode.product)],
+            emit_mode=EmitMode.xmacro,
+            table_name='EMPTY')
+        self.assertEqual(
+            expand_iter_group(iter_group), '#define EMPTY(X)\n'
+            '#define EMPTY_ROW() \\\n'
+            '    ${T};\n'
+            'EMPTY(EMPTY_ROW)\n'
+            '#undef EMPTY_ROW\n')
+
+    def test_check_macro_argument(self):
+        for value in ['int', '', 'f(a, b)', '"a, )"', "','", 'a<b>']:
+            check_macro_argument(value)
+        for value in ['a, b', 'f(a', 'f)(', '"a', 'a\nb']:
+            self.assertRaises(ValueError, check_macro_argument, value)
+
+    def test_invalid_tables(self):
+        # Values with commas, templates with directives, line comments or keys
+        # in character literals, and outputs binding different keys can't be
+        # emitted
+        invalid = [
+            (Template('${T}'),
+             [Iterable('T', ['a', 'b'], Itermode.product, 2, True)]),
+            (Template('#if ${T}\n#endif\n'),
+             [Iterable('T', ['a'], Itermode.product)]),
+            (Template('${T} // ${T}\n'),
+             [Iterable('T', ['a'], Itermode.product)]),
+            (Template('${T_1}'),
+             [Iterable('T', ['a', 'b'], Itermode.powerset, 0, False, True)]),
+            (Template("'${T}'"), [Iterable('T', ['a'], Itermode.product)]),
+        ]
+        for template, iterables in invalid:
+            iter_group = IterGroup(
+                '@ip@',
+                template,
+                iterables,
+                emit_mode=EmitMode.xmacro,
+                table_name='T')
+            self.assertRaises(ValueError, expand_iter_group, iter_group)
+
+    def test_group_arguments(self):
+        self.assertRaises(ValueError, IterGroup, '@ip@', TEMPLATE,
+                          ITERABLES, False, emit_mode=EmitMode.xmacro)
+        self.assertRaises(
+            ValueError,
+            RemovalIterGroup,
+            '@ip@',
+            TEMPLATE,
+            ITERABLES, [],
+            emit_mode=EmitMode.xmacro,
+            table_name='1st')
+        self.assertRaises(
+            TypeError, IterGroup, '@ip@', TEMPLATE, ITERABLES,
+            emit_mode=2)
+        # The emission mode is part of the spec of the group
+        self.assertNotEqual(
+            IterGroup('@ip@', TEMPLATE, ITERABLES).spec_hash(),
+            IterGroup(
+                '@ip@',
+                TEMPLATE,
+                ITERABLES,
+                emit_mode=EmitMode.xmacro,
+                table_name='ADD').spec_hash())
+
+    @unittest.skipIf(shutil.which('cpp') is None, 'cpp is not available')
+    def test_preprocessed_output(self):
+        # The preprocessed table must match the expanded output token for
+        # token. Keys pasted into identifiers and numbers, or in string
+        # literals, are substituted there too.
+        source = 'namespace test {\n  @ip@\n}\n'
+        templates = [
+            TEMPLATE,
+            Template('void f_${T}_${N}() { puts("${T}: \\"${N}\\""); }\n'
+                     'int ${T}${N}x = ${N}${N}, y = \'$$\';\n')
+        ]
+        for template in templates:
+            expanded = generate_source(
+                source, [IterGroup('@ip@', template, ITERABLES)])
+            table = generate_source(source, [
+                IterGroup(
+                    '@ip@',
+                    template,
+                    ITERABLES,
+                    emit_mode=EmitMode.xmacro,
+                    table_name='ADD')
+            ])
+            preprocessed = subprocess.check_output(
+                ['cpp', '-P'], input=table.encode('utf-8'))
+            self.assertEqual(
+                join_literals(preprocessed.decode('utf-8')).split(),
+                expanded.split())
+
+
+def run_table_tests():
+    suite = unittest.TestLoader().loadTestsFromTestCase(TestTables)
+    unittest.TextTestRunner().run(suite)